@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2008, 2009 Xigital Solutions
+#
+# Written by Jim Zhan <jim@xigital.com>
+#
+# This file is part of SFDC-Python Salesforce python accessor.
+#
+""" Bulk DML through the SOAP API: any number of records, sent in
+    concurrent batches whose size and concurrency adapt to how the org
+    copes (see tuning.BatchController). Records failing on lock
+    contention (UNABLE_TO_LOCK_ROW), and batches timing out
+    (REQUEST_RUNNING_TOO_LONG), are sent again in smaller batches.
+
+    Usage:
+        writer = BulkWriter(client)
+        results = writer.update(
+            [SObject('Contact', Id=item, Title='CEO') for item in ids]
+        )
+        failed = [index for index, result in enumerate(results)
+                  if not writer.succeeded(result)]
+
+    Children of the same parent record lock it while they are written,
+    group them by their parent reference so that each parent is locked
+    by one batch at a time, while batches of other parents run
+    concurrently:
+        results = writer.update(contacts, groupBy='AccountId')
+
+    Records of an upsert() holding the same external ID are merged into
+    one, the last one wins unless merged by a function:
+        results = writer.upsert('Email__c', contacts, merge=mergeFields)
+"""
+import time
+from collections import OrderedDict
+from threading import Condition, Lock, Thread
+from error import SFDCError, exceptions, status
+from request import CompactSObject, SObject, TrackedSObject
+from response import Result
+from tuning import BatchController
+from writer import DML_LIMIT
+
+
+__author__ = 'Jim Zhan'
+__email__ = 'jim@xigital.com'
+
+
+def _codes(*codes):
+    """ Fault & status codes, checked against error.exceptions and
+        error.status so that a misspelled one fails at import.
+    """
+    for code in codes:
+        if code not in exceptions and code not in status:
+            raise KeyError('Unknown fault or status code: %s' % code)
+    return frozenset(codes)
+
+
+# fault & status codes of transient contention, worth retrying.
+CONTENTION = _codes('UNABLE_TO_LOCK_ROW', 'REQUEST_RUNNING_TOO_LONG')
+
+
+class BulkWriter(object):
+    """ Sends create/update/upsert/delete of many records in batches, each
+        operation & sObject type with a <tuning.BatchController> of its
+        own, kept from one call to the next.
+
+        @param client: Logged in client.
+        @param retries: Times a record is sent again on contention.
+        @param controller: Factory of controllers, for each operation &
+            sObject type.
+
+        @type client: <client.Client>
+        @type retries: integer
+        @type controller: callable
+    """
+    def __init__(self, client, retries=5, controller=BatchController):
+        self.client = client
+        self.retries = retries
+        self.factory = controller
+        self.lock = Lock()
+        self.controllers = {}
+
+
+    def controller(self, key):
+        """ Controller of an (operation, sObject type) key. """
+        self.lock.acquire()
+        try:
+            controller = self.controllers.get(key)
+            if controller is None:
+                controller = self.controllers[key] = self.factory()
+            return controller
+        finally:
+            self.lock.release()
+
+
+    def create(self, sObjects, groupBy=None):
+        """ Create records (of one sObject type).
+
+            @param sObjects: Records to be created.
+            @param groupBy: Parent reference field (e.g. AccountId), or
+                callable returning the parent of a record. Children of
+                one parent are sent in the same batch when they fit,
+                and never in two batches at the same time.
+
+            @type sObjects: <request.SObject> array
+            @type groupBy: string/callable
+
+            @return: SaveResult (or <response.Result>) list, in the order
+                of the records.
+
+            @raise SFDCError: A batch failed, other than on contention.
+        """
+        return self._write(('create', _type(sObjects)), sObjects, groupBy)
+
+
+    def update(self, sObjects, groupBy=None):
+        return self._write(('update', _type(sObjects)), sObjects, groupBy)
+
+
+    def upsert(self, externalIDFieldName, sObjects, groupBy=None,
+               merge=None, caseSensitive=False):
+        """ Upsert records, those holding the same external ID merged
+            first, so that one external ID is sent once: neither twice in
+            a batch (DUPLICATE_VALUE) nor in concurrent batches.
+
+            @param externalIDFieldName: External ID field.
+            @param sObjects: Records to be upserted.
+            @param groupBy: See create().
+            @param merge: Callable merging two records of the same
+                external ID into one, e.g. mergeFields(); default is to
+                keep the last record.
+            @param caseSensitive: Whether the external ID field is case
+                sensitive, see collapse().
+
+            @type externalIDFieldName: string
+            @type sObjects: <request.SObject> array
+            @type groupBy: string/callable
+            @type merge: callable
+            @type caseSensitive: boolean
+
+            @return: UpsertResult (or <response.Result>) list, in the
+                order of the records, merged records share their result.
+        """
+        unique, positions = collapse(sObjects, externalIDFieldName, merge,
+                                     caseSensitive)
+        results = self._write(
+            ('upsert', _type(sObjects), externalIDFieldName),
+            unique,
+            groupBy
+        )
+        return [results[position] for position in positions]
+
+
+    def delete(self, ids):
+        # sObject type told by the ID prefix.
+        return self._write(('delete', ids[0][:3] if ids else None), ids)
+
+
+    def succeeded(self, result):
+        """ Whether a result returned by this writer is a success. """
+        if isinstance(result, Result):
+            return result.success
+        return self.client.getParser().text(result, 'success') == 'true'
+
+
+    def recordId(self, result):
+        """ ID of the record of a result returned by this writer. """
+        if isinstance(result, Result):
+            return result.id
+        return self.client.getParser().text(result, 'id')
+
+
+    def _statusCodes(self, result):
+        if isinstance(result, Result):
+            return [error.statusCode for error in result.errors]
+        parser = self.client.getParser()
+        return [parser.text(error, 'statusCode')
+                for error in parser.children(result, 'errors')]
+
+
+    def _write(self, key, records, groupBy=None):
+        """ Send records through as many threads as the controller of
+            the key allows.
+        """
+        controller = self.controller(key)
+        results = [None] * len(records)
+        if groupBy is None:
+            parents = [None] * len(records)
+        elif callable(groupBy):
+            parents = [groupBy(record) for record in records]
+        else:
+            parents = [record.get(groupBy) for record in records]
+        pending = _Pending(parents)
+        condition = Condition()
+        state = {'running': 0, 'error': None}
+
+        def take():
+            """ Next batch, None once everything is written. """
+            condition.acquire()
+            try:
+                while True:
+                    if not pending or state['error'] is not None:
+                        return None
+                    batch = pending.take(min(controller.batchSize, DML_LIMIT))
+                    if batch:
+                        state['running'] += 1
+                        return batch
+                    # parents left are locked by running batches.
+                    condition.wait()
+            finally:
+                condition.release()
+
+        def work():
+            while True:
+                # batch taken once allowed to run, sized up to date.
+                controller.acquire()
+                try:
+                    batch = take()
+                    if batch is None:
+                        return
+                    retry = []
+                    try:
+                        self._send(key, records, batch, results, retry,
+                                   controller)
+                    except Exception, e:
+                        condition.acquire()
+                        state['error'] = state['error'] or e
+                        condition.release()
+                finally:
+                    controller.release()
+                condition.acquire()
+                try:
+                    pending.done(batch, retry)
+                    state['running'] -= 1
+                    condition.notifyAll()
+                finally:
+                    condition.release()
+
+        threads = [Thread(target=work)
+                   for i in xrange(controller.maxConcurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if state['error'] is not None:
+            raise state['error']
+        return results
+
+
+    def _send(self, key, records, batch, results, retry, controller):
+        """ Send one batch, the records to be sent again go to retry. """
+        operation = key[0]
+        args = list(key[2:]) + [[records[index] for index, attempts in batch]]
+        started = time.time()
+        try:
+            values = getattr(self.client, operation)(*args)
+        except SFDCError, e:
+            if e.code not in CONTENTION or \
+               max(attempts for index, attempts in batch) >= self.retries:
+                raise
+            controller.contended(started)
+            retry.extend((index, attempts + 1) for index, attempts in batch)
+            return
+        contended = False
+        for (index, attempts), value in zip(batch, values):
+            results[index] = value
+            if attempts < self.retries and \
+               CONTENTION.intersection(self._statusCodes(value)):
+                contended = True
+                retry.append((index, attempts + 1))
+        if contended:
+            controller.contended(started)
+        else:
+            controller.succeeded(time.time() - started)
+
+
+class _Pending(object):
+    """ Records to be sent, by parent, with the parents locked by the
+        batches running. Records without parent (None) go in any batch.
+
+        @param parents: Parent of each record.
+    """
+    def __init__(self, parents):
+        # parent: [(index, attempts), ...], in the order of first records.
+        self.groups = OrderedDict()
+        self.parents = parents
+        self.busy = set()
+        self.size = 0
+        for index in xrange(len(parents)):
+            self._add(index, 0)
+
+
+    def __len__(self):
+        return self.size
+
+
+    def _add(self, index, attempts):
+        self.groups.setdefault(self.parents[index], []).append(
+            (index, attempts)
+        )
+        self.size += 1
+
+
+    def take(self, size):
+        """ Up to size (index, attempts) of parents not locked, keeping
+            groups whole if they fit, empty if all are locked.
+        """
+        batch = []
+        taken = []
+        for parent, items in self.groups.iteritems():
+            room = size - len(batch)
+            if not room:
+                break
+            if parent in self.busy or \
+               (batch and parent is not None and len(items) > room):
+                continue
+            batch.extend(items[:room])
+            taken.append((parent, room))
+        for parent, room in taken:
+            items = self.groups[parent]
+            if len(items) > room:
+                self.groups[parent] = items[room:]
+            else:
+                del self.groups[parent]
+            if parent is not None:
+                self.busy.add(parent)
+        self.size -= len(batch)
+        return batch
+
+
+    def done(self, batch, retry):
+        """ Unlock the parents of a batch, queue the records to retry. """
+        for index, attempts in batch:
+            self.busy.discard(self.parents[index])
+        for index, attempts in retry:
+            self._add(index, attempts)
+
+
+def collapse(sObjects, field, merge=None, caseSensitive=False):
+    """ Merge records holding the same value of a field, records without
+        value are kept as they are.
+
+        @param sObjects: Records.
+        @param field: Field name, e.g. an external ID.
+        @param merge: Callable merging two records into one, default is
+            to keep the second one.
+        @param caseSensitive: Whether text values differing in case only
+            are different, as for external IDs marked case sensitive;
+            Salesforce matches other external IDs ignoring case.
+
+        @type sObjects: <request.SObject> array
+        @type field: string
+        @type merge: callable
+        @type caseSensitive: boolean
+
+        @return: (unique records, position of each record among them).
+    """
+    unique = []
+    positions = []
+    seen = {}
+    for sObject in sObjects:
+        value = sObject.get(field)
+        if not caseSensitive and isinstance(value, basestring):
+            value = value.lower()
+        position = seen.get(value) if value is not None else None
+        if position is None:
+            if value is not None:
+                seen[value] = len(unique)
+            positions.append(len(unique))
+            unique.append(sObject)
+        else:
+            positions.append(position)
+            unique[position] = sObject if merge is None else \
+                merge(unique[position], sObject)
+    return unique, positions
+
+
+def mergeFields(first, second):
+    """ Merge two records of the same kind field by field, fields of the
+        second one win. The merged record is a new one, built from the
+        fields of both.
+
+        @param first: Record merged into.
+        @param second: Record whose fields win.
+
+        @type first: <request.SObject>/<request.TrackedSObject>/
+            <request.CompactSObject>
+        @type second: Same as first.
+
+        @return: New record, of the kind of both.
+
+        @raise ValueError: Records of different kinds (or sObject types).
+    """
+    if type(first) is not type(second) or \
+       first.recordType != second.recordType:
+        raise ValueError('Cannot merge %s %s into %s %s' % (
+            type(second).__name__, second.recordType,
+            type(first).__name__, first.recordType
+        ))
+    if isinstance(first, CompactSObject):
+        table = first.table
+        values = list(first.values)
+        # fields of another table are matched by name.
+        positions = range(len(second.values)) \
+            if second.table is table else \
+            [table.position(field) for field in second.table.fields]
+        values.extend([None] * (len(table.fields) - len(values)))
+        for position, value in zip(positions, second.values):
+            if value is not None:
+                values[position] = value
+        return CompactSObject(table, tuple(values))
+    if isinstance(first, TrackedSObject):
+        # changes of both, against what the first one was loaded with.
+        merged = TrackedSObject(first.recordType, first.keys, **first.original)
+        for record in (first, second):
+            for field, value in record.values.items():
+                merged[field] = value
+        return merged
+    fields = _fields(first)
+    fields.update(_fields(second))
+    return SObject(first.recordType, **fields)
+
+
+def _fields(sObject):
+    """ Fields of an <request.SObject>, files given back as such. """
+    files = dict((item.token, item) for item in sObject.files)
+    fields = {}
+    for child in sObject.xml.iterchildren():
+        field = child.tag.split('}')[-1]
+        if field != 'type':
+            fields[field] = files.get(child.text, child.text)
+    return fields
+
+
+def _type(sObjects):
+    return sObjects[0].recordType if sObjects else None
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2008, 2009 Xigital Solutions
+#
+# Written by Jim Zhan <jim@xigital.com>
+#
+# This file is part of SFDC-Python Salesforce python accessor.
+#
+""" SOQL result cache, see Client.useCache(). """
+import time
+from copy import deepcopy
+from threading import Lock
+from collections import OrderedDict
+from soql import normalize, sObjectTypes
+
+
+__author__ = 'Jim Zhan'
+__email__ = 'jim@xigital.com'
+
+
+class QueryCache(object):
+    """ Size bounded (least recently used entries go first) cache of
+        query results with time-to-live. Entries are invalidated by
+        the sObject types they read from. Results are copied in and out,
+        so that callers may change the records they are given.
+
+        @param ttl: Seconds a result stays valid.
+        @param maxSize: Maximum number of cached results.
+
+        @type ttl: integer/float
+        @type maxSize: integer
+    """
+    def __init__(self, ttl=60, maxSize=256):
+        self.ttl = ttl
+        self.maxSize = maxSize
+        self.lock = Lock()
+        self.entries = OrderedDict()
+        # 3 characters ID prefix: sObject type, learnt from cached records.
+        self.prefixes = {}
+        # bumped by invalidate(), results older than the last one are stale.
+        self.generation = 0
+        self.hits = self.misses = 0
+
+
+    def key(self, queryString, batchSize):
+        return (normalize(queryString), batchSize)
+
+
+    def get(self, key):
+        """ Returns a copy of the cached result of the key, or None. """
+        self.lock.acquire()
+        try:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return None
+            self.entries[key] = entry
+            self.hits += 1
+            value = entry[2]
+        finally:
+            self.lock.release()
+        return deepcopy(value)
+
+
+    def put(self, key, value, records=(), generation=None):
+        """ Cache a copy of a result.
+
+            @param key: Key returned by key().
+            @param value: Result to be cached.
+            @param records: Records in the result, used to learn ID
+                prefixes of sObject types.
+            @param generation: The cache's generation when the query was
+                sent, the result is dropped if invalidated since.
+
+            @type generation: integer
+        """
+        types = sObjectTypes(key[0])
+        value = deepcopy(value)
+        self.lock.acquire()
+        try:
+            if generation is not None and generation != self.generation:
+                return
+            for record in records:
+                self._learn(record)
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + self.ttl, types, value)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+        finally:
+            self.lock.release()
+
+
+    def _learn(self, record):
+        if isinstance(record, dict):
+            name, recordId = record.get('type'), record.get('Id')
+            if name and recordId:
+                self.prefixes[recordId[:3]] = name.lower()
+            return
+        name = recordId = None
+        for child in record.iterchildren():
+            tag = child.tag.split('}')[-1]
+            if tag == 'type':
+                name = child.text
+            elif tag == 'Id' and child.text:
+                recordId = child.text
+        if name and recordId:
+            self.prefixes[recordId[:3]] = name.lower()
+
+
+    def invalidate(self, sObjectTypes=None, ids=None):
+        """ Drop cached results reading from any of given sObject types,
+            or the types of given IDs. Everything is dropped if an ID
+            has an unknown prefix, or if no argument is given at all.
+
+            @param sObjectTypes: sObject types written.
+            @param ids: IDs of records written.
+
+            @type sObjectTypes: string array
+            @type ids: SFDC ID array
+        """
+        self.lock.acquire()
+        try:
+            # queries in flight may have read what was just written.
+            self.generation += 1
+            if sObjectTypes is None and ids is None:
+                self.entries.clear()
+                return
+            types = set(name.lower() for name in sObjectTypes or ())
+            for recordId in ids or ():
+                name = self.prefixes.get(recordId[:3])
+                if name is None:
+                    self.entries.clear()
+                    return
+                types.add(name)
+            for key, entry in self.entries.items():
+                if entry[1] & types:
+                    del self.entries[key]
+        finally:
+            self.lock.release()
+
+
+    def clear(self):
+        self.invalidate()
+
+
+if __name__ == '__main__':
+    pass
@@ -6,37 +6,49 @@
 #
 # This file is part of SFDC-Python Salesforce python accessor.
 #
-import util
-from urlparse import urlparse
-from lxml import etree, objectify
-from httplib import HTTPSConnection
-from config import http, sfdc, namespace
-from error import LoginFault, SessionExpired, SFDCError
+import time
+import codec
+import soql
+from contextlib import contextmanager
+from threading import local
+from config import sfdc
+from connection import makeConnection
+from error import SessionExpired
+from parsers import fault, objectify
+from response import Results, toDict
+from util import chunk, parallel
 from request import AuthenticatedRequest, EmailHeader, \
         LeadConvert, Node, ProcessSubmitRequest, \
         ProcessWorkitemRequest, QueryOption, Request, \
-        SObject
+        SessionHeader, SObject
 
 
 __author__ = 'Jim Zhan'
 __email__ = 'jim@xigital.com'
 
 
-def makeConnection(serverUrl=sfdc.address):
-    protocol, host, path, params, query, fragment = urlparse(serverUrl)
-    connection = HTTPSConnection(host)
-    connection.debuglevel = http.debuglevel if sfdc.debug else 0
-    setattr(connection, 'path', path)
-    return connection
+# sendEmail() accepts 10 messages at most.
+EMAIL_LIMIT = 10
 
 
 class Client(object):
     """ Salesforce's SOAP Client. Initialised with blank
         sessionId & serverUrl (should be returned by login()).
+
+        A client may be shared by threads: each call borrows a
+        connection of its own from the pool (see connection.py),
+        while sessionId & loginResult are shared.
     """
     def __init__(self):
         self.sessionId = None
         self.serverUrl = None
+        self.replica = None
+        self.cache = None
+        self.compact = False
+        self.parser = objectify
+        self.local = local()
+        self.sessionStore = None
+        self.queryTuner = None
         self.connection = makeConnection()
         
 
@@ -51,14 +63,158 @@ class Client(object):
         
             @param loginResult: <response.LoginResult>
         """
-        if hasattr(self.connection, 'close'):
-            self.connection.close()
+        # calls in flight keep the previous pool until they are done.
+        previous = self.connection
         self.connection = makeConnection(loginResult.serverUrl.pyval)
         self.loginResult = loginResult
         self.sessionId = loginResult.sessionId.pyval
+        if hasattr(previous, 'close'):
+            previous.close()
+
+
+    def clone(self):
+        """ Create a new Client sharing the session of this one,
+            but talking through its own connection pool.
+
+            @return: <Client> instance.
+        """
+        client = self.__class__()
+        if getattr(self, 'loginResult', None) is not None:
+            client.useSession(self.loginResult)
+        client.replica = self.replica
+        client.cache = self.cache
+        client.compact = self.compact
+        client.parser = self.parser
+        client.sessionStore = self.sessionStore
+        client.queryTuner = self.queryTuner
+        return client
+
+
+    def useSessionStore(self, store, username, password):
+        """ Use the session of username kept in store, shared with the
+            other processes of the host, logging in only if there is
+            none. Expired sessions are renewed once for all of them, and
+            the call is sent again.
+
+            @param store: Session store.
+            @param username: Login username.
+            @param password: Login password (and security token).
+
+            @type store: <session.SessionStore>
+            @type username: string
+            @type password: string
+
+            @return: loginResult used by the client.
+        """
+        self.sessionStore = (store, username, password)
+        return store.login(self, username, password)
+
+
+    def useReplica(self, replica):
+        """ Answer lookup() from a local replica whenever possible.
+
+            @param replica: Replica to be used, None to disable.
+
+            @type replica: <replica.Replica>
+        """
+        self.replica = replica
+
+
+    def useCache(self, cache):
+        """ Cache results of query()/queryRecords(), cached results are
+            invalidated by create()/update()/upsert()/delete()/merge()/
+            undelete() of this client (and its clones).
+
+            @param cache: Cache to be used, None to disable.
+
+            @type cache: <cache.QueryCache>
+        """
+        self.cache = cache
+
+
+    def useQueryTuner(self, tuner):
+        """ Let query()/queryAll()/queryMore() called without batchSize
+            use the batch size the tuner measured best for the shape of
+            the query (see tuning.py).
+
+            @param tuner: Tuner to be used, None to disable.
+
+            @type tuner: <tuning.QueryTuner>
+        """
+        self.queryTuner = tuner
 
 
-    def send(self, request, forList=False):
+    def useParser(self, parser):
+        """ Parse responses with given backend, see parsers.py. Modules
+            built on Client (cache, sync, replica, extract...) expect the
+            default, objectify one.
+
+            @param parser: Parser backend.
+
+            @type parser: <parsers.Parser>
+        """
+        self.parser = parser
+
+
+    @contextmanager
+    def parsing(self, parser):
+        """ Parse responses of the calls made in the with block (by
+            this thread) with given backend.
+
+            Usage:
+                with client.parsing(parsers.EtreeParser()):
+                    result = client.query('SELECT Id FROM Account')[0]
+        """
+        previous = getattr(self.local, 'parser', None)
+        self.local.parser = parser
+        try:
+            yield parser
+        finally:
+            self.local.parser = previous
+
+
+    def getParser(self):
+        """ Backend parsing the responses of this thread's calls. """
+        return getattr(self.local, 'parser', None) or self.parser
+
+
+    def useCompactResults(self, compact=True):
+        """ Return create()/update()/upsert()/delete()/undelete() results
+            as <response.Results> (single <response.Result> for a single
+            record) instead of response elements, so results of large
+            loads are cheap to keep and to summarize.
+
+            @param compact: Whether to return compact results.
+
+            @type compact: boolean
+        """
+        self.compact = compact
+
+
+    def _results(self, results):
+        """ Compact DML results if asked to, see useCompactResults(). """
+        if not self.compact:
+            return results
+        if isinstance(results, (tuple, list)):
+            return Results(results)
+        return Results([results])[0]
+
+
+    def _invalidate(self, sObjects=(), ids=()):
+        """ Invalidate cached query results touched by a DML call. """
+        if self.cache is None:
+            return
+        if not isinstance(sObjects, (tuple, list)):
+            sObjects = [sObjects]
+        if isinstance(ids, basestring):
+            ids = [ids]
+        self.cache.invalidate(
+            [item.recordType for item in sObjects],
+            list(ids)
+        )
+
+
+    def send(self, request, forList=False, parser=None):
         """ Actually talk to Salesforce's server, get & parse
             the response content.
             
@@ -66,24 +222,63 @@ class Client(object):
             @param forList: Indicates whether this request
                 is constructed by list, if so, response will
                 be resolved as a list correspondingly.
+            @param parser: Parser backend of this call, default is
+                getParser().
                 
             @type request: <soap.Request> or <soap.AuthenticatedRequest>
             @type forList: boolean
+            @type parser: <parsers.Parser>
             
             @return: Parsed response body returned by _parse()
-                <lxml.objectify.ObjectifiedElement>.
+                <lxml.objectify.ObjectifiedElement> (default backend).
         """
-        self.connection.request(
+        try:
+            return self._send(request, forList, parser)
+        except SessionExpired:
+            if not self.renewSession(request):
+                raise
+            return self._send(request, forList, parser)
+
+
+    def renewSession(self, request):
+        """ Renew the session a request was rejected for through the
+            session store (see useSessionStore), the request is given
+            the new session so that it can be sent again.
+
+            @param request: Request which raised SessionExpired.
+
+            @type request: <request.Request>
+
+            @return: True if renewed, False if there is no store to
+                renew it through (or the request is not authenticated).
+        """
+        if self.sessionStore is None or \
+           not isinstance(request, AuthenticatedRequest):
+            return False
+        store, username, password = self.sessionStore
+        store.renew(self, username, password, request.sessionId)
+        request.sessionId = self.sessionId
+        request.setSoapHeader(
+            'SessionHeader',
+            SessionHeader(self.sessionId).xml
+        )
+        return True
+
+
+    def _send(self, request, forList, parser):
+        payload = request.build()
+        started = time.time()
+        response = self.connection.send(
             request.method,
-            self.connection.path,
-            body = repr(request),
-            headers = request.headers
+            body = payload.body,
+            headers = payload.headers,
+            safe = request.safe
         )
-        response = self.connection.getresponse()
-        return self._parse(request, response, forList)
+        self.local.elapsed = time.time() - started
+        return self._parse(request, response, forList, parser)
 
 
-    def _parse(self, request, response, forList):
+    def _parse(self, request, response, forList, parser=None):
         """ Parse response data. Also take care of 
             compressed data (if debug is False).
             
@@ -97,32 +292,16 @@ class Client(object):
             @type response: string
             @type forList: boolean
             
-            @return: Parsed response body <lxml.objectify.ObjectifiedElement>.
+            @return: Parsed response body <lxml.objectify.ObjectifiedElement>
+                (default backend).
         """
         if response.getheader('Content-Encoding') == request.compressType:
             data = request.decompress(response.read())
         else:
             data = response.read()
-        xml = objectify.fromstring(data)
-        if sfdc.debug: print etree.tostring(xml)
-        # see if there's any Fault node first.
-        if hasattr(xml.Body, 'Fault'):
-            code = xml.find('//faultcode')
-            message = code.getnext()
-            faultcode = code.text.replace('sf:', '')
-            faultstring = message.text.replace('%s:' % faultcode, '')
-
-            if faultcode == 'INVALID_SESSION_ID':
-                raise SessionExpired(faultcode, faultstring)
-            elif faultcode.find('LOGIN') is not -1:
-                raise LoginFault(faultcode, faultstring)
-            else:
-                raise SFDCError(faultcode, faultstring)
-
-        # regular response body.
-        body = '//{%s}%s' % (namespace.partner, request.response)
-        kids = xml.find(body).getchildren()
-        return kids if forList else kids[0]
+        self.local.received = len(data)
+        if sfdc.debug: print data
+        return (parser or self.getParser()).parse(request, data, forList)
 
 
     def _append(self, parent, params, tag=None):
@@ -212,8 +391,10 @@ class Client(object):
         """
         request = AuthenticatedRequest(self.sessionId, 'create')
         request, forList = self._append(request, sObjects)
-        result = self.send(request, forList=forList)
-        return result
+        try:
+            return self._results(self.send(request, forList=forList))
+        finally:
+            self._invalidate(sObjects)
     
 
     def delete(self, ids):
@@ -239,10 +420,13 @@ class Client(object):
         """
         request = AuthenticatedRequest(self.sessionId, 'delete')
         request, forList = self._append(request, ids, tag='ids')
-        return self.send(request, forList=forList)
+        try:
+            return self._results(self.send(request, forList=forList))
+        finally:
+            self._invalidate(ids=ids)
 
 
-    def getDeleted(self, sObjectType, starDate, endDate):
+    def getDeleted(self, sObjectType, startDate, endDate):
         """Retrieves the list of individual objects that have been deleted within
             the given timespan for the specified object.
 
@@ -358,13 +542,21 @@ class Client(object):
         """
         if getattr(self, 'loginResult', None):
             return self.loginResult
+        self.useSession(self.openSession(username, password))
+        return self.loginResult
+
+
+    def openSession(self, username, password):
+        """ Log in, without using the new session (see useSession()).
+
+            @return: A LoginResult object, see login().
+        """
         request = Request('login')
         request.body.extend((
             Node('username', username).xml,
             Node('password', password).xml
         ))
-        self.useSession(self.send(request))
-        return self.loginResult
+        return self.send(request, parser=objectify)
     
     
     def merge(self, masterRecord, recordToMergeIds):
@@ -403,7 +595,10 @@ class Client(object):
             recordToMergeIds,
             tag = 'recordToMergeIds'
         )
-        return self.send(request, forList)
+        try:
+            return self.send(request, forList)
+        finally:
+            self._invalidate(masterRecord, recordToMergeIds)
     
     
     def process(self, processType):
@@ -463,13 +658,13 @@ class Client(object):
         return self.send(request)
 
     
-    def query(self, queryString, batchSize=500):
+    def query(self, queryString, batchSize=None):
         """ Executes a query against the specified object and returns data that
             matches the specified criteria.
 
             @param queryString: Query string that specifies the object to query.
             @param batchSize: Batch size for the number of records should be
-                returned. Default is 500.
+                returned. Default is 500, or the tuned one (see useQueryTuner()).
                 
             @type queryString: string
             @type batchSize: integer
@@ -495,20 +690,73 @@ class Client(object):
             @raise UnexpectedError: An unexpected error occurred. The error is not associated
                 with any other API fault.
         """
-        request = AuthenticatedRequest(self.sessionId, 'query')
-        request.setSoapHeader('QueryOptions', QueryOption(batchSize).xml)
-        request.body.append(Node('queryString', queryString).xml)
-        return self.send(request, forList=True)
+        parser = self.getParser()
+        if batchSize is None and self.queryTuner is None:
+            batchSize = 500
+        cache = self.cache
+        if cache is not None:
+            key = cache.key(queryString, batchSize) + (parser.name,)
+            result = cache.get(key)
+            if result is not None:
+                return result
+            generation = cache.generation
+
+        result = self._query('query', queryString, batchSize)
+        # only complete results, query locators do not live long enough.
+        if cache is not None and parser.text(result[0], 'done') == 'true':
+            cache.put(key, result, parser.children(result[0], 'records'),
+                      generation)
+        return result
+
+
+    def queryRecords(self, queryString, batchSize=None):
+        """ Executes a query and drains all its result pages through
+            queryMore(). Drained records are cached as a whole when
+            a cache is in use (see useCache()).
+
+            @param queryString: Query string.
+            @param batchSize: Batch size of each page, see query().
+
+            @type queryString: string
+            @type batchSize: integer
+
+            @return: sObject array of all matched records.
+        """
+        parser = self.getParser()
+        cache = self.cache
+        if cache is not None:
+            key = cache.key(queryString, batchSize) + ('records', parser.name)
+            records = cache.get(key)
+            if records is not None:
+                return records
+            generation = cache.generation
+
+        records = []
+        with self.parsing(parser):
+            result = self.query(queryString, batchSize)[0]
+            while True:
+                records.extend(parser.children(result, 'records'))
+                if parser.text(result, 'done') == 'true':
+                    break
+                result = self.queryMore(
+                    parser.text(result, 'queryLocator'),
+                    batchSize
+                )[0]
+        if cache is not None:
+            cache.put(key, records, records, generation)
+        return records
     
     
-    def queryAll(self, queryString):
+    def queryAll(self, queryString, batchSize=None):
         """ Retrieves data from specified objects, whether or not they have been deleted.
 
             @param queryString: Query string that specifies the object to query,
                 the fields to return, and any conditions for including a specific
                 object in the query.
+            @param batchSize: Batch size, see query().
                 
             @type queryString: string
+            @type batchSize: integer
 
             @return: A QueryResult object, which has the following properties.
                 queryLocator (String): A specialised string, similar to ID. Used in queryMore()
@@ -530,18 +778,19 @@ class Client(object):
             @raise UnexpectedError: An unexpected error occurred. The error is not associated
                 with any other API fault.                    
         """
-        request = AuthenticatedRequest(self.sessionId, 'queryAll')
-        request.body.append(Node('queryString', queryString).xml)
-        return self.send(request, forList=True)
+        return self._query('queryAll', queryString, batchSize)
     
     
-    def queryMore(self, queryLocator):
+    def queryMore(self, queryLocator, batchSize=None):
         """ Retrieves the next batch of objects from a query().
 
             @param queryLocator: Represents the server-side cursor that tracks the
                 current processing location in the query result set.
+            @param batchSize: Batch size, default is the tuned one if the query
+                was tuned (see useQueryTuner()), else Salesforce's.
             
             @type queryLocator: string
+            @type batchSize: integer
 
             @return: A QueryResult object, which has the following properties.
                 queryLocator (String): A specialised string, similar to ID. Used in queryMore()
@@ -561,9 +810,49 @@ class Client(object):
             @raise UnexceptedError: An unexpected error occurred. The error is not associated
                 with any other API fault.
         """
+        shape = None
+        if batchSize is None and self.queryTuner is not None:
+            shape = self.queryTuner.shapeOf(queryLocator)
+            if shape is not None:
+                batchSize = self.queryTuner.batchSize(shape)
         request = AuthenticatedRequest(self.sessionId, 'queryMore')
+        if batchSize is not None:
+            request.setSoapHeader('QueryOptions', QueryOption(batchSize).xml)
         request.body.append(Node('queryLocator', queryLocator).xml)
-        return self.send(request, forList=True)
+        result = self.send(request, forList=True)
+        if shape is not None:
+            self._observe(shape, result)
+        return result
+
+
+    def _query(self, action, queryString, batchSize):
+        """ Send a query()/queryAll() call, tuned if batchSize is None
+            and a tuner is in use.
+        """
+        shape = None
+        if batchSize is None and self.queryTuner is not None:
+            shape = soql.shape(queryString)
+            batchSize = self.queryTuner.batchSize(shape)
+        request = AuthenticatedRequest(self.sessionId, action)
+        if batchSize is not None:
+            request.setSoapHeader('QueryOptions', QueryOption(batchSize).xml)
+        request.body.append(Node('queryString', queryString).xml)
+        result = self.send(request, forList=True)
+        if shape is not None:
+            self._observe(shape, result)
+        return result
+
+
+    def _observe(self, shape, result):
+        """ Report the page this thread just fetched to the tuner. """
+        parser = self.getParser()
+        self.queryTuner.observe(
+            shape,
+            len(parser.children(result[0], 'records')),
+            getattr(self.local, 'received', 0),
+            getattr(self.local, 'elapsed', 0),
+            parser.text(result[0], 'queryLocator')
+        )
 
     
     def retrieve(self, fieldList, sObjectType, ids):
@@ -604,6 +893,36 @@ class Client(object):
         return self.send(request, forList=forList)
     
     
+    def lookup(self, sObjectType, fieldList, **criteria):
+        """ Simple filtered lookup, answered by the local replica (see
+            useReplica()) when the data is fresh and all fields are
+            replicated, otherwise by query().
+
+            @param sObjectType: Object to look up.
+            @param fieldList: Fields to be returned.
+            @param criteria: fieldname=value pairs, ANDed equalities.
+
+            @type sObjectType: string
+            @type fieldList: string array
+
+            @return: List of dictionaries of fieldname: value.
+        """
+        replica = self.replica
+        if replica is not None and replica.isFresh(sObjectType) \
+                and replica.supports(sObjectType, fieldList, criteria):
+            return replica.lookup(sObjectType, fieldList, criteria)
+
+        records = self.queryRecords(
+            soql.select(sObjectType, fieldList, criteria)
+        )
+        if replica is not None and sObjectType in replica.tables \
+                and replica.supports(sObjectType, fieldList, {}):
+            return [replica.convert(sObjectType, record, fieldList)
+                    for record in records]
+        return [dict((name, value) for name, value in toDict(record).items()
+                     if name in fieldList) for record in records]
+
+
     def search(self, search):
         """ Executes a text search in your organization's data.
 
@@ -647,7 +966,10 @@ class Client(object):
         """
         request = AuthenticatedRequest(self.sessionId, 'undelete')
         request, forList = self._append(request, ids, tag='ids')
-        return self.send(request, forList=forList)
+        try:
+            return self._results(self.send(request, forList=forList))
+        finally:
+            self._invalidate(ids=ids)
 
     
     def update(self, sObjects):
@@ -670,7 +992,10 @@ class Client(object):
         """
         request = AuthenticatedRequest(self.sessionId, 'update')
         request, forList = self._append(request, sObjects)
-        return self.send(request, forList=forList)
+        try:
+            return self._results(self.send(request, forList=forList))
+        finally:
+            self._invalidate(sObjects)
 
 
     def upsert(self, externalIDFieldName, sObjects):
@@ -696,16 +1021,22 @@ class Client(object):
                 For example, the object returned in the first index in the UpsertResult array
                 matches the object specified in the first index of the sObject[] array.
                 * NOTE * Single UpsertResult will be returned if parameter "sObjects"
-                if a SFDC ID (string).
+                if a SFDC ID (string). See bulk.BulkWriter.upsert() for large
+                inputs, holding the same external ID more than once.
 
             @raise InvalidSObject: An invalid sObject in a call.
             @raise UnexpectedError: An unexpected error occurred. The error is not associated
                     with any other API fault.
         """
         request = AuthenticatedRequest(self.sessionId, 'upsert')
-        request.body.append(Node('externalIDFieldName').xml)
+        request.body.append(
+            Node('externalIDFieldName', externalIDFieldName).xml
+        )
         request, forList = self._append(request, sObjects)
-        return self.send(request, forList=forList)
+        try:
+            return self._results(self.send(request, forList=forList))
+        finally:
+            self._invalidate(sObjects)
 
 
 ############################## Describer ##############################
@@ -899,8 +1230,8 @@ class Client(object):
                 with any other API fault.
         """
         request = AuthenticatedRequest(self.sessionId, 'getServerTimestamp')
-        response = self.send(request)
-        return util.getTime(response.timestamp.pyval)
+        response = self.send(request, parser=objectify)
+        return codec.parseDateTime(response.timestamp.text)
 
 
     def getUserInfo(self):
@@ -940,10 +1271,14 @@ class Client(object):
         return response.password
     
 
-    def sendEmail(self, base, messages):
-        """ Immediately sends an email message.
+    def sendEmail(self, messages, workers=4):
+        """ Immediately sends email messages. Messages are packed into
+            calls of 10 (the per call limit), calls are sent concurrently
+            through this client.
 
-            @param base (BaseEmail):
+            @param messages: <request.SingleEmailMessage>/<request.MassEmailMessage>,
+                or array of them. Arguments common to both (BaseEmail) are given
+                as keyword arguments of either:
                 bccSender (Boolean): Indicates whether the email sender receives a
                     copy of the email that is sent. For a mass email, the sender is
                     only copied on the first email sent.
@@ -964,7 +1299,7 @@ class Client(object):
                 templateId (ID/String): The ID of the template to be merged to create this email.
                 senderDisplayName (String): Optional. The name that appears on the from
                     line of the email.
-            @param messages:
+
                 SingleEmailMessage:
                     bccAddresses (String array): Optional. An array of blind
                         carbon copy addresses. The maximum allowed is five.
@@ -1036,8 +1371,11 @@ class Client(object):
                         to existing an Document passed in using the documentAttachtments
                         argument.
                     setBody (Base64): The attachment itself.
+            @param workers: Maximum number of calls sent at the same time.
 
-            @return: A list of SendEmailResult objects.
+            @return: A list of SendEmailResult objects, one per message in the
+                same order, single SendEmailResult will be returned if the parameter
+                is a single message.
                 success (Boolean): Indicates whether the email was successfully accepted for
                     delivery by the message transfer agent.
                 SendEmailError (Error array): If an error occurred during the call, a SendEmailError
@@ -1057,8 +1395,23 @@ class Client(object):
             @raise NO_MASS_MAIL_PERMISSION:
             @raise REQUIRED_FIELD_MISSING:
             @raise TEMPLATE_NOT_ACTIVE:
+            @raise SFDCError: The first fault of a call, calls not sent yet are
+                given up, messages of calls already sent are not recalled.
         """
-        raise UnimplementedError
+        if not isinstance(messages, (tuple, list)):
+            return self._sendEmail([messages])[0]
+        batches = chunk(messages, EMAIL_LIMIT)
+        if len(batches) <= 1:
+            return self._sendEmail(messages)
+        results = parallel(self._sendEmail, batches, workers)
+        return [result for batch in results for result in batch]
+
+
+    def _sendEmail(self, messages):
+        """ Send up to EMAIL_LIMIT messages in one call. """
+        request = AuthenticatedRequest(self.sessionId, 'sendEmail')
+        request.body.extend([message.xml for message in messages])
+        return self.send(request, forList=True)
     
     
 
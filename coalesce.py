@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2008, 2009 Xigital Solutions
+#
+# Written by Jim Zhan <jim@xigital.com>
+#
+# This file is part of SFDC-Python Salesforce python accessor.
+#
+""" Coalescing of retrieve-by-id calls issued by concurrent callers.
+
+    Usage:
+        loader = RetrieveLoader(client)
+        # from any number of threads:
+        account = loader.load('Account', ['Id', 'Name'], accountId)
+"""
+from threading import Lock, Timer
+from util import Future
+
+
+__author__ = 'Jim Zhan'
+__email__ = 'jim@xigital.com'
+
+
+# retrieve() accepts 2000 IDs at most.
+RETRIEVE_LIMIT = 2000
+
+
+class _Batch(object):
+    """ IDs collected for one (sObject type, field list). """
+    def __init__(self, key):
+        self.key = key
+        self.futures = {}
+        self.ids = []
+        self.timer = None
+
+
+class RetrieveLoader(object):
+    """ Collects retrieve-by-id requests for the same sObject type and
+        field list within a short window, deduplicates the IDs, and
+        issues one retrieve() for the whole batch. Requests for an ID
+        already in flight share its result.
+
+        @param client: Logged in client.
+        @param window: Seconds to wait for more requests before a batch
+            is sent.
+        @param maxBatch: Batch is sent immediately once it reaches this
+            number of IDs.
+
+        @type client: <client.Client>
+        @type window: float
+        @type maxBatch: integer
+    """
+    def __init__(self, client, window=0.005, maxBatch=RETRIEVE_LIMIT):
+        self.client = client
+        self.window = window
+        self.maxBatch = min(maxBatch, RETRIEVE_LIMIT)
+        self.lock = Lock()
+        self.pending = {}
+        self.inflight = {}
+        self.calls = 0
+
+
+    def submit(self, sObjectType, fieldList, recordId):
+        """ Queue a retrieve-by-id request.
+
+            @param sObjectType: Object to retrieve.
+            @param fieldList: Fields to retrieve.
+            @param recordId: ID of the record.
+
+            @type sObjectType: string
+            @type fieldList: string array
+            @type recordId: SFDC ID
+
+            @return: <util.Future> of the record (None if not accessible).
+        """
+        key = (sObjectType.lower(), tuple(fieldList))
+        ready = None
+        self.lock.acquire()
+        try:
+            future = self.inflight.get(key, {}).get(recordId)
+            if future is not None:
+                return future
+            batch = self.pending.get(key)
+            if batch is None:
+                batch = self.pending[key] = _Batch(key)
+                batch.sObjectType = sObjectType
+                batch.timer = Timer(self.window, self._flush, (batch,))
+                batch.timer.start()
+            future = batch.futures.get(recordId)
+            if future is None:
+                future = batch.futures[recordId] = Future()
+                batch.ids.append(recordId)
+                if len(batch.ids) >= self.maxBatch:
+                    batch.timer.cancel()
+                    ready = batch
+        finally:
+            self.lock.release()
+        if ready is not None:
+            self._flush(ready)
+        return future
+
+
+    def load(self, sObjectType, fieldList, recordId, timeout=None):
+        """ Retrieve a record by ID, blocks until its batch is back.
+
+            @return: sObject record, or None if not accessible.
+        """
+        return self.submit(sObjectType, fieldList, recordId).result(timeout)
+
+
+    def loadMany(self, sObjectType, fieldList, ids, timeout=None):
+        """ Retrieve records by IDs, in the same order as ids. """
+        futures = [self.submit(sObjectType, fieldList, item) for item in ids]
+        return [future.result(timeout) for future in futures]
+
+
+    def _flush(self, batch):
+        self.lock.acquire()
+        try:
+            if self.pending.get(batch.key) is not batch:
+                # already flushed by the other party (timer / size).
+                return
+            del self.pending[batch.key]
+            inflight = self.inflight.setdefault(batch.key, {})
+            inflight.update(batch.futures)
+            self.calls += 1
+        finally:
+            self.lock.release()
+
+        try:
+            try:
+                records = self.client.retrieve(
+                    list(batch.key[1]),
+                    batch.sObjectType,
+                    batch.ids
+                )
+                for recordId, record in zip(batch.ids, records):
+                    if record is not None and not record.getchildren():
+                        record = None
+                    batch.futures[recordId].set(record)
+                for future in batch.futures.values():
+                    if not future.done():
+                        future.set(None)
+            except Exception, e:
+                for future in batch.futures.values():
+                    if not future.done():
+                        future.fail(e)
+        finally:
+            self.lock.acquire()
+            try:
+                for recordId in batch.ids:
+                    inflight.pop(recordId, None)
+                if not inflight and self.inflight.get(batch.key) is inflight:
+                    del self.inflight[batch.key]
+            finally:
+                self.lock.release()
+
+
+if __name__ == '__main__':
+    pass
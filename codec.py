@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2008, 2009 Xigital Solutions
+#
+# Written by Jim Zhan <jim@xigital.com>
+#
+# This file is part of SFDC-Python Salesforce python accessor.
+#
+""" Codec for Salesforce's xsd:date & xsd:dateTime values.
+
+    Salesforce always talks in UTC, so every datetime handed out by this
+    module is a naive datetime in UTC; timezone-aware values are shifted
+    to UTC before they are formatted.
+"""
+import re
+from datetime import date, datetime, timedelta
+
+
+__author__ = 'Jim Zhan'
+__email__ = 'jim@xigital.com'
+
+
+dateRegx = re.compile(r'^(\d{4})-(\d{2})-(\d{2})(Z|[+-]\d{2}:\d{2})?$')
+datetimeRegx = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6})\d*)?'
+    r'(Z|[+-]\d{2}:\d{2})?$'
+)
+
+# maximum number of distinct values kept by each cache.
+CACHE_SIZE = 4096
+
+_cache = {
+    'date': {},
+    'datetime': {},
+    'formatted': {},
+}
+
+
+def _remember(cache, key, value):
+    """ Store value into given cache, the cache is simply flushed
+        once it grows up to CACHE_SIZE.
+    """
+    if len(cache) >= CACHE_SIZE:
+        cache.clear()
+    cache[key] = value
+    return value
+
+
+def _offset(zone):
+    """ Turn a timezone designator (Z, +08:00, -05:30) into timedelta. """
+    if not zone or zone == 'Z':
+        return None
+    hours, minutes = int(zone[1:3]), int(zone[4:6])
+    delta = timedelta(hours=hours, minutes=minutes)
+    return -delta if zone[0] == '-' else delta
+
+
+def clearCache():
+    """ Drop all cached values. """
+    for cache in _cache.values():
+        cache.clear()
+
+
+def parseDate(text):
+    """ Turn xsd:date string (2009-02-25) into date.
+
+        @param text: xsd:date value.
+
+        @type text: string
+
+        @return: <datetime.date> instance, None for blank value.
+
+        @raise ValueError: text is not a valid xsd:date.
+    """
+    if not text:
+        return None
+    cache = _cache['date']
+    try:
+        return cache[text]
+    except KeyError:
+        pass
+    match = dateRegx.match(text)
+    if match is None:
+        raise ValueError('Invalid xsd:date value: %r' % text)
+    year, month, day = match.group(1, 2, 3)
+    return _remember(cache, text, date(int(year), int(month), int(day)))
+
+
+def parseDateTime(text):
+    """ Turn xsd:dateTime string (2009-02-25T10:35:13.959Z) into datetime.
+        Fractional seconds and timezone designator are both optional,
+        values with an offset are shifted into UTC.
+
+        @param text: xsd:dateTime value.
+
+        @type text: string
+
+        @return: naive <datetime.datetime> instance in UTC,
+            None for blank value.
+
+        @raise ValueError: text is not a valid xsd:dateTime.
+    """
+    if not text:
+        return None
+    cache = _cache['datetime']
+    try:
+        return cache[text]
+    except KeyError:
+        pass
+    match = datetimeRegx.match(text)
+    if match is None:
+        raise ValueError('Invalid xsd:dateTime value: %r' % text)
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    microsecond = int(fraction.ljust(6, '0')) if fraction else 0
+    value = datetime(
+        int(year),
+        int(month),
+        int(day),
+        int(hour),
+        int(minute),
+        int(second),
+        microsecond
+    )
+    offset = _offset(zone)
+    if offset is not None:
+        value -= offset
+    return _remember(cache, text, value)
+
+
+def formatDate(value):
+    """ Turn date (or datetime) into xsd:date string.
+
+        @param value: Date to be formatted.
+
+        @type value: <datetime.date>
+
+        @return: xsd:date string (2009-02-25).
+    """
+    if isinstance(value, datetime):
+        value = toUTC(value).date()
+    return '%04d-%02d-%02d' % (value.year, value.month, value.day)
+
+
+def formatDateTime(value):
+    """ Turn datetime into xsd:dateTime string in UTC, naive values
+        are considered to be UTC already.
+
+        @param value: Datetime to be formatted.
+
+        @type value: <datetime.datetime>
+
+        @return: xsd:dateTime string (2009-02-25T10:35:13.959Z).
+    """
+    key = (value, value.utcoffset())
+    cache = _cache['formatted']
+    try:
+        return cache[key]
+    except KeyError:
+        pass
+    utc = toUTC(value)
+    text = '%04d-%02d-%02dT%02d:%02d:%02d.%03dZ' % (
+        utc.year,
+        utc.month,
+        utc.day,
+        utc.hour,
+        utc.minute,
+        utc.second,
+        utc.microsecond // 1000
+    )
+    return _remember(cache, key, text)
+
+
+def toUTC(value):
+    """ Shift a timezone-aware datetime into naive UTC datetime,
+        naive datetime will be returned as it is.
+    """
+    offset = value.utcoffset()
+    if offset is None:
+        return value
+    return value.replace(tzinfo=None) - offset
+
+
+def parseColumn(values, kind='datetime'):
+    """ Batch version of parseDate()/parseDateTime(), converts a whole
+        column of values at once. Repeated values are converted once.
+
+        @param values: Iterable of xsd:date/xsd:dateTime strings.
+        @param kind: Either 'date' or 'datetime'.
+
+        @type values: iterable
+        @type kind: string
+
+        @return: List of converted values, blank values turned into None.
+    """
+    parse = {'date': parseDate, 'datetime': parseDateTime}[kind]
+    seen = {}
+    result = []
+    append = result.append
+    for value in values:
+        try:
+            append(seen[value])
+        except KeyError:
+            converted = seen[value] = parse(value)
+            append(converted)
+    return result
+
+
+def formatColumn(values):
+    """ Batch version of formatDate()/formatDateTime(), dispatches on
+        the type of each value. None stays None.
+
+        @param values: Iterable of <datetime.date>/<datetime.datetime>.
+
+        @type values: iterable
+
+        @return: List of xsd:date/xsd:dateTime strings.
+    """
+    seen = {}
+    result = []
+    append = result.append
+    for value in values:
+        if value is None:
+            append(None)
+            continue
+        try:
+            append(seen[value])
+        except KeyError:
+            converted = seen[value] = formatValue(value)
+            append(converted)
+    return result
+
+
+def formatValue(value):
+    """ Format date/datetime into its xsd string representation. """
+    if isinstance(value, datetime):
+        return formatDateTime(value)
+    return formatDate(value)
+
+
+if __name__ == '__main__':
+    # benchmark against the former util.getTime() & Node's strftime path.
+    from timeit import Timer
+
+    def getTime(timestamp):
+        date, time = timestamp.split('T')
+        year, month, day = [int(item) for item in date.split('-')]
+        time = time.replace('Z', '').split(':')
+        hour, minute = int(time[0]), int(time[1])
+        second, microsecond = time[-1].split('.')
+        return datetime(year, month, day, hour, minute,
+                        int(second), int(microsecond))
+
+    column = ['2009-02-%02dT10:35:%02d.959Z' % (1 + i % 28, i % 60)
+              for i in xrange(10000)]
+    values = [getTime(item) for item in column]
+
+    def legacyParse():
+        [getTime(item) for item in column]
+
+    def legacyFormat():
+        [item.strftime('%Y-%m-%dT%H:%M:%S%z') for item in values]
+
+    def codecParse():
+        clearCache()
+        parseColumn(column)
+
+    def codecFormat():
+        clearCache()
+        formatColumn(values)
+
+    for name in ('legacyParse', 'codecParse', 'legacyFormat', 'codecFormat'):
+        timer = Timer('%s()' % name, 'from __main__ import %s' % name)
+        print '%-14s %.4fs' % (name, min(timer.repeat(3, 10)) / 10)
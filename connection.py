@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2008, 2009 Xigital Solutions
+#
+# Written by Jim Zhan <jim@xigital.com>
+#
+# This file is part of SFDC-Python Salesforce python accessor.
+#
+""" Keep-alive HTTP(S) connection which takes care of its own health:
+    idle and worn out connections are recycled, half-closed sockets are
+    detected before use, and dropped connections are re-established
+    transparently (see the [http] section of etc/salesforce.conf).
+"""
+import time
+import select
+import socket
+import weakref
+from threading import BoundedSemaphore, Lock, Thread
+from urlparse import urlparse
+from httplib import HTTPConnection, HTTPSConnection, HTTPException
+from config import http, sfdc
+
+
+__author__ = 'Jim Zhan'
+__email__ = 'jim@xigital.com'
+
+
+class _Response(object):
+    """ HTTP response with its content read already. """
+    def __init__(self, response, data):
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = dict(response.getheaders())
+        self.data = data
+
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+
+    def read(self):
+        return self.data
+
+
+class _StreamedResponse(object):
+    """ HTTP response read by the caller, bit by bit. The connection
+        stays locked until the response is closed.
+    """
+    def __init__(self, connection, response):
+        self.connection = connection
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+
+    def read(self, size=None):
+        return self.response.read(size) if size else self.response.read()
+
+
+    def close(self):
+        connection, self.connection = self.connection, None
+        if connection is None:
+            return
+        try:
+            # a socket with unread content can not be used any more.
+            if not self.response.isclosed() or \
+               self.response.getheader('connection', '').lower() == 'close':
+                connection.reconnect()
+        finally:
+            connection.lock.release()
+
+
+    def __del__(self):
+        self.close()
+
+
+class Connection(object):
+    """ Keep-alive connection to given server URL.
+
+        @param serverUrl: URL of the SOAP endpoint.
+        @param idleTimeout: Seconds the connection may stay idle.
+        @param maxRequests: Recycle after this many requests, 0 for never.
+        @param autoReconnect: Re-establish dropped connection & retry.
+
+        @type serverUrl: string
+        @type idleTimeout: integer
+        @type maxRequests: integer
+        @type autoReconnect: boolean
+    """
+    def __init__(self, serverUrl, idleTimeout=getattr(http, 'idle-timeout'),
+                 maxRequests=getattr(http, 'max-requests'),
+                 autoReconnect=getattr(http, 'auto-reconnect')):
+        protocol, host, path, params, query, fragment = urlparse(serverUrl)
+        factory = HTTPConnection if protocol == 'http' else HTTPSConnection
+        self.connection = factory(host)
+        self.connection.debuglevel = http.debuglevel if sfdc.debug else 0
+        self.path = path
+        self.idleTimeout = idleTimeout
+        self.maxRequests = maxRequests
+        self.autoReconnect = autoReconnect
+        self.lock = Lock()
+        self.requests = 0
+        self.reconnects = 0
+        self.lastUsed = time.time()
+
+
+    def isStale(self):
+        """ Whether the underlying socket must not be used any more:
+            idle for too long, served enough requests, or closed (or
+            sent something unexpected) by the other end.
+        """
+        sock = self.connection.sock
+        if sock is None:
+            return False
+        if self.idleTimeout and time.time() - self.lastUsed > self.idleTimeout:
+            return True
+        if self.maxRequests and self.requests >= self.maxRequests:
+            return True
+        try:
+            readable, writable, errors = select.select([sock], [], [sock], 0)
+        except (select.error, socket.error, ValueError):
+            return True
+        # nothing is expected from an idle keep-alive connection,
+        # being readable means EOF (or garbage).
+        return bool(readable or errors)
+
+
+    def reconnect(self):
+        """ Drop the socket, a new one is opened on the next request. """
+        self.connection.close()
+        self.requests = 0
+        self.reconnects += 1
+
+
+    def send(self, method, body, headers, safe=False, stream=False):
+        """ Send a request and read its response.
+
+            @param method: HTTP method.
+            @param body: Request content, written to the socket as it is,
+                or an iterable of chunks (see request.Stream), sent with
+                chunked transfer encoding if the headers say so.
+            @param headers: HTTP headers, dictionary or (name, value) pairs.
+            @param safe: Whether the request may be sent again once it
+                reached the server, i.e. it has no side effects.
+            @param stream: Leave the content to be read by the caller,
+                who must close() the response to release the connection.
+
+            @type method: string
+            @type body: string/iterable
+            @type headers: dictionary/tuple
+            @type safe: boolean
+            @type stream: boolean
+
+            @return: Response with its content read already, or to be
+                read if stream.
+        """
+        if isinstance(headers, dict):
+            headers = headers.items()
+        self.lock.acquire()
+        locked = True
+        try:
+            if self.isStale():
+                self.reconnect()
+            attempts = 2 if self.autoReconnect else 1
+            while True:
+                attempts -= 1
+                sent = False
+                try:
+                    self._request(method, body, headers)
+                    sent = True
+                    response = self.connection.getresponse()
+                    if stream:
+                        result = _StreamedResponse(self, response)
+                    else:
+                        result = _Response(response, response.read())
+                except (HTTPException, socket.error):
+                    self.reconnect()
+                    if attempts and (safe or not sent):
+                        continue
+                    raise
+                self.requests += 1
+                self.lastUsed = time.time()
+                if stream:
+                    # released by the response.
+                    locked = False
+                elif response.getheader('connection', '').lower() == 'close':
+                    self.reconnect()
+                return result
+        finally:
+            if locked:
+                self.lock.release()
+
+
+    def _request(self, method, body, headers):
+        """ Write headers, then the body straight to the socket, instead
+            of httplib's request() which concatenates both first.
+        """
+        connection = self.connection
+        connection.putrequest(method, self.path, skip_accept_encoding=True)
+        chunked = False
+        for name, value in headers:
+            connection.putheader(name, value)
+            if name.lower() == 'transfer-encoding':
+                chunked = value.lower() == 'chunked'
+        connection.endheaders()
+        if isinstance(body, basestring):
+            connection.send(body)
+        elif chunked:
+            for chunk in body:
+                if chunk:
+                    connection.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+            connection.send('0\r\n\r\n')
+        else:
+            for chunk in body:
+                connection.send(chunk)
+
+
+    def warm(self):
+        """ Re-open the socket ahead of use when it's stale or gone. """
+        if not self.lock.acquire(False):
+            # in use, warm enough.
+            return
+        try:
+            if self.connection.sock is None or self.isStale():
+                self.reconnect()
+                self.connection.connect()
+                self.lastUsed = time.time()
+        except (HTTPException, socket.error):
+            self.connection.close()
+        finally:
+            self.lock.release()
+
+
+    def close(self):
+        self.connection.close()
+
+
+class _PooledResponse(object):
+    """ Streamed response of a pooled connection, which goes back to
+        the pool once the response is closed.
+    """
+    def __init__(self, pool, connection, response):
+        self.pool = pool
+        self.connection = connection
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+
+    def read(self, size=None):
+        return self.response.read(size)
+
+
+    def close(self):
+        pool, self.pool = self.pool, None
+        if pool is None:
+            return
+        try:
+            self.response.close()
+        finally:
+            pool.release(self.connection)
+
+
+    def __del__(self):
+        self.close()
+
+
+class ConnectionPool(object):
+    """ Connections to one server URL, each call borrows a connection of
+        its own, so that a client can be shared by threads.
+
+        @param serverUrl: URL of the SOAP endpoint.
+        @param maxConnections: Maximum number of connections in use at
+            the same time, other calls wait for one to be released.
+
+        @type serverUrl: string
+        @type maxConnections: integer
+    """
+    def __init__(self, serverUrl,
+                 maxConnections=getattr(http, 'max-connections')):
+        self.serverUrl = serverUrl
+        self.maxConnections = maxConnections
+        self.slots = BoundedSemaphore(maxConnections)
+        self.lock = Lock()
+        self.idle = []
+        self.created = 0
+
+
+    def acquire(self):
+        """ Borrow an idle connection, or a new one. """
+        self.slots.acquire()
+        self.lock.acquire()
+        try:
+            if self.idle:
+                return self.idle.pop()
+            self.created += 1
+        finally:
+            self.lock.release()
+        return _register(Connection(self.serverUrl))
+
+
+    def release(self, connection):
+        self.lock.acquire()
+        try:
+            self.idle.append(connection)
+        finally:
+            self.lock.release()
+        self.slots.release()
+
+
+    def send(self, method, body, headers, safe=False, stream=False):
+        """ Send a request through a borrowed connection, see
+            Connection.send().
+        """
+        connection = self.acquire()
+        try:
+            response = connection.send(method, body, headers, safe, stream)
+        except:
+            self.release(connection)
+            raise
+        if stream:
+            return _PooledResponse(self, connection, response)
+        self.release(connection)
+        return response
+
+
+    def close(self):
+        """ Close idle connections. """
+        self.lock.acquire()
+        try:
+            for connection in self.idle:
+                connection.close()
+        finally:
+            self.lock.release()
+
+
+class KeepAlive(Thread):
+    """ Background thread warming registered connections every
+        interval seconds. Connections are weakly referenced.
+
+        @param interval: Seconds between two rounds.
+
+        @type interval: integer
+    """
+    def __init__(self, interval):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self.interval = interval
+        self.connections = weakref.WeakValueDictionary()
+        self.lock = Lock()
+
+
+    def register(self, connection):
+        self.lock.acquire()
+        try:
+            self.connections[id(connection)] = connection
+        finally:
+            self.lock.release()
+
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.lock.acquire()
+            try:
+                connections = self.connections.values()
+            finally:
+                self.lock.release()
+            for connection in connections:
+                connection.warm()
+
+
+_keepAlive = None
+
+
+def makeConnection(serverUrl=sfdc.address):
+    """ Create a pool of connections to given server URL, each of them
+        registered for background warming if keep-alive is configured.
+
+        @return: <ConnectionPool> instance.
+    """
+    return ConnectionPool(serverUrl)
+
+
+def _register(connection):
+    global _keepAlive
+    if getattr(http, 'keep-alive'):
+        if _keepAlive is None:
+            _keepAlive = KeepAlive(getattr(http, 'keep-alive'))
+            _keepAlive.start()
+        _keepAlive.register(connection)
+    return connection
+
+
+if __name__ == '__main__':
+    pass
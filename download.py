@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2008, 2009 Xigital Solutions
+#
+# Written by Jim Zhan <jim@xigital.com>
+#
+# This file is part of SFDC-Python Salesforce python accessor.
+#
+""" Streamed download of base64 fields (Attachment/Document Body,
+    ContentVersion VersionData...) straight to files: the response is
+    parsed while being read and base64 content is decoded on the fly,
+    so memory use does not depend on the size of the files.
+
+    Usage:
+        def sink(record, field):
+            return open('archive/%s' % record['Id'], 'wb')
+
+        downloader = BinaryDownloader(client)
+        for record in downloader.download(
+                'SELECT Id, Name, Body FROM Attachment', sink):
+            print record['Name'], record['Body'], 'bytes'
+"""
+import zlib
+from binascii import a2b_base64
+from xml.parsers.expat import ParserCreate
+from config import namespace
+from error import SessionExpired
+from parsers import fault
+from request import AuthenticatedRequest, Node, QueryOption
+
+
+__author__ = 'Jim Zhan'
+__email__ = 'jim@xigital.com'
+
+
+_nil = '%s nil' % namespace.xsi
+
+
+class Base64Decoder(object):
+    """ Decodes base64 text written piece by piece into a file.
+
+        @param target: Writable file-like object.
+
+        @type target: file
+    """
+    def __init__(self, target):
+        self.target = target
+        self.pending = ''
+        self.size = 0
+
+
+    def write(self, text):
+        text = self.pending + ''.join(text.split())
+        cut = len(text) - len(text) % 4
+        self.pending = text[cut:]
+        if cut:
+            data = a2b_base64(text[:cut])
+            self.size += len(data)
+            self.target.write(data)
+
+
+    def close(self):
+        """ Close the target file.
+
+            @raise ValueError: Truncated base64 content.
+        """
+        try:
+            if self.pending:
+                raise ValueError('Truncated base64 content')
+        finally:
+            self.target.close()
+
+
+class _ResultParser(object):
+    """ Incremental parser of query()/queryMore() responses. Records are
+        turned into dictionaries (see response.toDict), base64 fields are
+        decoded into the files returned by sink(record, field), and given
+        the number of bytes as value.
+    """
+    def __init__(self, fields, sink):
+        self.fields = fields
+        self.sink = sink
+        self.parser = ParserCreate(namespace_separator=' ')
+        self.parser.returns_unicode = False
+        self.parser.buffer_text = True
+        self.parser.buffer_size = 64 * 1024
+        self.parser.StartElementHandler = self._start
+        self.parser.EndElementHandler = self._end
+        self.parser.CharacterDataHandler = self._characters
+        self.stack = []
+        self.records = []
+        self.result = {}
+        self.record = None
+        self.recordDepth = None
+        # (depth, dictionary, key) the current text goes to.
+        self.capture = None
+        self.text = None
+        self.decoder = None
+
+
+    def feed(self, data, final=False):
+        self.parser.Parse(data, final)
+
+
+    def _start(self, name, attrs):
+        tag = name.split(' ')[-1]
+        parent = self.stack[-1] if self.stack else None
+        self.stack.append(tag)
+        depth = len(self.stack)
+        if self.record is None:
+            if tag == 'records' and parent == 'result':
+                self.record = {}
+                self.recordDepth = depth
+            elif parent == 'result' or tag in ('faultcode', 'faultstring'):
+                self._capture(depth, self.result, tag, attrs)
+        elif depth == self.recordDepth + 1:
+            self._capture(depth, self.record, tag, attrs)
+            if tag in self.fields and self.text is not None:
+                self.text = None
+                self.decoder = Base64Decoder(self.sink(self.record, tag))
+        elif depth == self.recordDepth + 2 and self.decoder is None:
+            # nested relationship records are skipped.
+            self.capture = self.text = None
+
+
+    def _capture(self, depth, target, key, attrs):
+        self.capture = (depth, target, key)
+        self.text = None if attrs.get(_nil) == 'true' else []
+
+
+    def _characters(self, data):
+        if self.capture is None or self.capture[0] != len(self.stack):
+            return
+        if self.decoder is not None:
+            self.decoder.write(data)
+        elif self.text is not None:
+            self.text.append(data)
+
+
+    def _end(self, name):
+        depth = len(self.stack)
+        self.stack.pop()
+        if self.capture is not None and self.capture[0] == depth:
+            depth, target, key = self.capture
+            if self.decoder is not None:
+                self.decoder.close()
+                value = self.decoder.size
+            else:
+                value = ''.join(self.text) if self.text is not None else None
+            # Id comes twice, keep the first non-nil one.
+            if value is not None or key not in target:
+                target[key] = value
+            self.capture = self.text = self.decoder = None
+        elif self.record is not None and depth == self.recordDepth:
+            self.records.append(self.record)
+            self.record = None
+
+
+class BinaryDownloader(object):
+    """ Runs queries selecting base64 fields, writing their decoded
+        content to files instead of keeping it in memory. Fields listed
+        before the base64 field in the query are available to the sink.
+
+        @param client: Logged in client.
+        @param fields: Names of base64 fields.
+        @param batchSize: QueryOptions batch size, Salesforce lowers it
+            anyway for queries selecting base64 fields.
+        @param blockSize: Bytes read from the response at a time.
+
+        @type client: <client.Client>
+        @type fields: string array
+        @type batchSize: integer
+        @type blockSize: integer
+    """
+    def __init__(self, client, fields=('Body', 'VersionData'),
+                 batchSize=200, blockSize=64 * 1024):
+        self.client = client
+        self.fields = frozenset(fields)
+        self.batchSize = batchSize
+        self.blockSize = blockSize
+
+
+    def download(self, queryString, sink):
+        """ Run a query, base64 fields are decoded into files.
+
+            @param queryString: Query selecting base64 field(s).
+            @param sink: Callable taking the record (dictionary of the
+                fields read so far) and the field name, returning a
+                writable file-like object, which is closed once the
+                field is written.
+
+            @type queryString: string
+            @type sink: callable
+
+            @return: Generator of records as dictionaries, base64 fields
+                given the number of bytes written.
+        """
+        request = AuthenticatedRequest(self.client.sessionId, 'query')
+        request.setSoapHeader('QueryOptions', QueryOption(self.batchSize).xml)
+        request.body.append(Node('queryString', queryString).xml)
+        while True:
+            result = {}
+            for record in self._records(request, sink, result):
+                yield record
+            if result.get('done') != 'false':
+                break
+            request = AuthenticatedRequest(self.client.sessionId, 'queryMore')
+            request.setSoapHeader(
+                'QueryOptions',
+                QueryOption(self.batchSize).xml
+            )
+            request.body.append(
+                Node('queryLocator', result['queryLocator']).xml
+            )
+
+
+    def _records(self, request, sink, result):
+        """ Records of a request, sent again once if the client renewed
+            its expired session (see Client.renewSession).
+        """
+        try:
+            for record in self._send(request, sink, result):
+                yield record
+        except SessionExpired:
+            if not self.client.renewSession(request):
+                raise
+            for record in self._send(request, sink, result):
+                yield record
+
+
+    def _send(self, request, sink, result):
+        """ Send a request, parse its response while reading it. """
+        payload = request.build()
+        response = self.client.connection.send(
+            request.method,
+            payload.body,
+            payload.headers,
+            safe = request.safe,
+            stream = True
+        )
+        try:
+            if response.getheader('Content-Encoding') == request.compressType:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                decompressor = None
+            parser = _ResultParser(self.fields, sink)
+            while True:
+                block = response.read(self.blockSize)
+                if decompressor is None:
+                    data = block
+                elif block:
+                    data = decompressor.decompress(block)
+                else:
+                    data = decompressor.flush()
+                parser.feed(data, not block)
+                for record in parser.records:
+                    yield record
+                del parser.records[:]
+                if not block:
+                    break
+        finally:
+            response.close()
+        if 'faultcode' in parser.result:
+            raise fault(
+                parser.result['faultcode'],
+                parser.result.get('faultstring') or ''
+            )
+        result.update(parser.result)
+
+
+if __name__ == '__main__':
+    pass
@@ -39,6 +39,12 @@ class SFDCError(Base):
     """ All unexpected errors returned by Salesforce """
 
 
+class ReplicationExpired(Base):
+    """ Replication start date is earlier than the earliestDateAvailable
+        returned by getDeleted(), deleted records may have been missed.
+    """
+
+
 class UnimplementedError(Exception):
     """ For those unimplemented methods """
 
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2008, 2009 Xigital Solutions
+#
+# Written by Jim Zhan <jim@xigital.com>
+#
+# This file is part of SFDC-Python Salesforce python accessor.
+#
+""" Partitioned, parallel extraction of one large query.
+
+    Usage:
+        extractor = PartitionedExtractor(client, workers=8)
+        for record in extractor.extract('SELECT Id, Name FROM Account',
+                                        partitions=8):
+            ...
+"""
+from threading import Event, Thread
+from Queue import Empty, Queue
+from codec import parseDateTime
+from offload import records
+from soql import addCondition, clauses, fromRegx, literal, mask
+
+
+__author__ = 'Jim Zhan'
+__email__ = 'jim@xigital.com'
+
+
+_DONE = object()
+
+
+def _value(record, field):
+    for child in record.iterchildren():
+        if child.tag.split('}')[-1] == field and child.text:
+            return child.text
+    return None
+
+
+def _recordId(record):
+    return _value(record, 'Id')
+
+
+class PartitionedExtractor(object):
+    """ Splits a query into disjoint slices by Id ranges or by
+        CreatedDate/SystemModstamp windows, and runs the slices on
+        parallel server side cursors.
+
+        @param client: Logged in client.
+        @param workers: Number of slices extracted at the same time.
+        @param batchSize: QueryOptions batch size of each cursor.
+        @param buffer: Pages buffered ahead of the consumer.
+        @param parser: Parse pages in worker processes, records are then
+            extracted as dictionaries (see response.toDict).
+
+        @type client: <client.Client>
+        @type workers: integer
+        @type batchSize: integer
+        @type buffer: integer
+        @type parser: <offload.ParserPool>
+    """
+    def __init__(self, client, workers=4, batchSize=2000, buffer=16,
+                 parser=None):
+        self.client = client
+        self.workers = workers
+        self.batchSize = batchSize
+        self.buffer = buffer
+        self.parser = parser
+
+
+    def _sample(self, queryString, field, partitions):
+        """ Values of field splitting the records matching the query into
+            partitions slices of even size, read by one scan of the field.
+        """
+        # the query selecting field only, its conditions kept.
+        start = fromRegx.search(mask(queryString)).start()
+        query = 'SELECT %s %s' % (field, queryString[start:].strip())
+        if field != 'Id':
+            query = addCondition(query, '%s != null' % field)
+        query = '%s ORDER BY %s' % (query, field)
+        result = self.client.query(query, self.batchSize)[0]
+        size = int(result.size.text)
+        # positions of the first record of each slice but the first.
+        marks = sorted(set(size * i // partitions
+                           for i in xrange(1, partitions)) - set([0]))
+        marks.reverse()
+        values = []
+        position = 0
+        while marks:
+            records = getattr(result, 'records', None)
+            for record in records if records is not None else ():
+                if marks and marks[-1] == position:
+                    values.append(_value(record, field))
+                    marks.pop()
+                position += 1
+            if result.done.text == 'true':
+                break
+            result = self.client.queryMore(result.queryLocator.text,
+                                           self.batchSize)[0]
+        return values
+
+
+    def partition(self, queryString, partitions, by='Id'):
+        """ Split a query into disjoint slices of about as many records,
+            their bounds sampled from the data by one scan of the field.
+
+            @param queryString: Query to be split, must not contain
+                ORDER BY, GROUP BY, LIMIT or OFFSET.
+            @param partitions: Number of slices.
+            @param by: Id, CreatedDate or SystemModstamp.
+
+            @type queryString: string
+            @type partitions: integer
+            @type by: string
+
+            @return: List of query strings.
+        """
+        unsupported = set(clauses(queryString)) & \
+            set(('ORDER BY', 'GROUP BY', 'LIMIT', 'OFFSET'))
+        if unsupported:
+            raise ValueError(
+                'Cannot partition a query with %s' % ', '.join(unsupported)
+            )
+        if partitions <= 1:
+            return [queryString]
+        bounds = self._sample(queryString, by, partitions)
+        if by != 'Id':
+            bounds = [parseDateTime(bound) for bound in bounds]
+        bounds = [literal(bound) for bound in bounds]
+        bounds = sorted(set(bounds))
+
+        queries = []
+        for index in xrange(len(bounds) + 1):
+            conditions = []
+            if index > 0:
+                conditions.append('%s >= %s' % (by, bounds[index - 1]))
+            if index < len(bounds):
+                conditions.append('%s < %s' % (by, bounds[index]))
+            queries.append(addCondition(queryString, ' AND '.join(conditions)))
+        return queries
+
+
+    def extract(self, queryString, partitions=None, by='Id'):
+        """ Extract all records matched by a query through parallel slices.
+            Records are streamed as soon as their pages arrive, so they
+            come in no particular order. Slicing by a date field, a record
+            modified during the extraction might show up in two slices,
+            such duplicates are dropped by Id.
+
+            @param queryString: Query to be extracted.
+            @param partitions: Number of slices, default is workers.
+            @param by: Id, CreatedDate or SystemModstamp.
+
+            @type queryString: string
+            @type partitions: integer
+            @type by: string
+
+            @return: Generator of sObject records, or dictionaries if
+                parsed in worker processes.
+        """
+        queries = self.partition(queryString, partitions or self.workers, by)
+        pages = Queue(self.buffer)
+        slices = Queue()
+        for query in queries:
+            slices.put(query)
+        # set once the consumer is gone (or failed), workers quit.
+        stopped = Event()
+
+        def work():
+            client = self.client
+            try:
+                while not stopped.isSet():
+                    try:
+                        query = slices.get_nowait()
+                    except Empty:
+                        return
+                    if self.parser is not None:
+                        for page in self.parser.pages(client, query,
+                                                      self.batchSize):
+                            pages.put(page)
+                            if stopped.isSet():
+                                return
+                        continue
+                    result = client.query(query, self.batchSize)[0]
+                    while not stopped.isSet():
+                        records = getattr(result, 'records', None)
+                        if records is not None:
+                            pages.put(list(records))
+                        if result.done.text == 'true':
+                            break
+                        result = client.queryMore(result.queryLocator.text,
+                                                  self.batchSize)[0]
+            except Exception, e:
+                pages.put(e)
+            finally:
+                pages.put(_DONE)
+
+        threads = [Thread(target=work)
+                   for i in xrange(min(self.workers, len(queries)))]
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+
+        seen = set() if by != 'Id' else None
+        running = len(threads)
+        try:
+            while running:
+                page = pages.get()
+                if page is _DONE:
+                    running -= 1
+                    continue
+                if isinstance(page, Exception):
+                    raise page
+                if self.parser is not None:
+                    page = records(page.get())
+                for record in page:
+                    if seen is not None:
+                        recordId = record.get('Id') \
+                            if self.parser is not None else _recordId(record)
+                        if recordId in seen:
+                            continue
+                        seen.add(recordId)
+                    yield record
+        finally:
+            stopped.set()
+            # workers blocked on a full queue get room to quit.
+            while running:
+                if pages.get() is _DONE:
+                    running -= 1
+            for thread in threads:
+                thread.join()
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2008, 2009 Xigital Solutions
+#
+# Written by Jim Zhan <jim@xigital.com>
+#
+# This file is part of SFDC-Python Salesforce python accessor.
+#
+""" Offloading of query response parsing to worker processes, so that
+    extraction is not capped by the one core the GIL leaves to parsing.
+    The raw (maybe gzipped) response bytes go to a worker, which sends
+    back the page as a compact (fields, rows) tuple; meanwhile the next
+    page is already requested, its query locator being picked from the
+    head of the response.
+
+    Usage:
+        with ParserPool() as parser:
+            extractor = PartitionedExtractor(client, parser=parser)
+            for record in extractor.extract('SELECT ... FROM Account'):
+                ...  # record is a dictionary, see response.toDict
+"""
+import re
+import zlib
+from multiprocessing import Pool
+from config import namespace
+from error import SessionExpired
+from parsers import fault
+from request import AuthenticatedRequest, Node, QueryOption
+
+
+__author__ = 'Jim Zhan'
+__email__ = 'jim@xigital.com'
+
+
+_doneRegx = re.compile(r'<(?:\w+:)?done>(\w+)</')
+_locatorRegx = re.compile(r'<(?:\w+:)?queryLocator>([^<]+)</')
+_records = '{%s}records' % namespace.partner
+_nil = '{%s}nil' % namespace.xsi
+# compressed bytes inflated to find done/queryLocator.
+HEAD_SIZE = 4096
+
+
+def _inflate(data, compressed, size=None):
+    if not compressed:
+        return data if size is None else data[:size * 8]
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if size is None:
+        return decompressor.decompress(data) + decompressor.flush()
+    return decompressor.decompress(data[:size])
+
+
+def peek(data, compressed):
+    """ Read done & queryLocator from the head of a query response,
+        without parsing it.
+
+        @return: (done, queryLocator) tuple, None if not found (e.g.
+            the response is a fault).
+    """
+    head = _inflate(data, compressed, HEAD_SIZE)
+    done = _doneRegx.search(head)
+    if done is None:
+        return None
+    locator = _locatorRegx.search(head)
+    return (done.group(1) == 'true', locator.group(1) if locator else None)
+
+
+def parsePage(data, compressed):
+    """ Parse a query()/queryMore() response, run in a worker process.
+
+        @param data: Raw response content.
+        @param compressed: Whether the content is gzipped.
+
+        @type data: string
+        @type compressed: boolean
+
+        @return: ('page', fields, rows, done, queryLocator) where fields
+            is a tuple of field names and rows a list of value tuples (see
+            response.toDict), or ('fault', faultcode, faultstring).
+    """
+    from lxml import etree
+    root = etree.fromstring(_inflate(data, compressed))
+    error = root.find('.//{%s}Fault' % namespace.soap)
+    if error is not None:
+        texts = dict((child.tag.split('}')[-1], child.text)
+                     for child in error.iterchildren())
+        return ('fault', texts.get('faultcode') or '',
+                texts.get('faultstring') or '')
+
+    fields = []
+    positions = {}
+    rows = []
+    result = root.find('.//{%s}result' % namespace.partner)
+    done = result.findtext('{%s}done' % namespace.partner) == 'true'
+    locator = result.findtext('{%s}queryLocator' % namespace.partner)
+    for record in result.iterchildren(_records):
+        row = [None] * len(fields)
+        for child in record.iterchildren():
+            if len(child):
+                # nested relationship records are skipped.
+                continue
+            name = child.tag.split('}')[-1]
+            if name == 'type':
+                continue
+            position = positions.get(name)
+            if position is None:
+                position = positions[name] = len(fields)
+                fields.append(name)
+                row.append(None)
+            # partner WSDL returns Id twice, the second might be blank.
+            if row[position] is None and child.get(_nil) != 'true':
+                row[position] = child.text
+        rows.append(tuple(row))
+    return ('page', tuple(fields), rows, done, locator or None)
+
+
+def records(page):
+    """ Records of a page returned by parsePage(), as dictionaries.
+
+        @raise SFDCError: The page is a fault.
+    """
+    if page[0] == 'fault':
+        raise fault(page[1], page[2])
+    fields = page[1]
+    for row in page[2]:
+        yield dict(zip(fields, row))
+
+
+class _Parsed(object):
+    """ Page parsed already, looks like an AsyncResult. """
+    def __init__(self, page):
+        self.page = page
+
+
+    def get(self, timeout=None):
+        return self.page
+
+
+class ParserPool(object):
+    """ Pool of worker processes parsing query responses.
+
+        @param processes: Number of processes, default is the number
+            of cores.
+
+        @type processes: integer
+    """
+    def __init__(self, processes=None):
+        self.pool = Pool(processes)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+    def submit(self, data, compressed):
+        """ Parse a raw response in a worker.
+
+            @return: <multiprocessing.pool.AsyncResult>, get() returns
+                what parsePage() does.
+        """
+        return self.pool.apply_async(parsePage, (data, compressed))
+
+
+    def pages(self, client, queryString, batchSize=2000):
+        """ Run a query, each page is parsed by a worker while the next
+            one is fetched.
+
+            @param client: Logged in client, used by this thread only.
+            @param queryString: Query to be run.
+            @param batchSize: QueryOptions batch size.
+
+            @type client: <client.Client>
+            @type queryString: string
+            @type batchSize: integer
+
+            @return: Generator of <multiprocessing.pool.AsyncResult> of
+                parsed pages, in order.
+        """
+        action, argument = 'query', Node('queryString', queryString)
+        renewed = False
+        while True:
+            request = AuthenticatedRequest(client.sessionId, action)
+            request.setSoapHeader('QueryOptions', QueryOption(batchSize).xml)
+            request.body.append(argument.xml)
+            payload = request.build()
+            response = client.connection.send(
+                request.method,
+                payload.body,
+                payload.headers,
+                safe = request.safe
+            )
+            data = response.read()
+            compressed = \
+                response.getheader('Content-Encoding') == request.compressType
+            head = peek(data, compressed)
+            if head is not None:
+                yield self.submit(data, compressed)
+                done, locator = head
+            else:
+                # fault, or something unexpected: parsed right away.
+                page = parsePage(data, compressed)
+                if page[0] == 'fault':
+                    error = fault(page[1], page[2])
+                    # sent again once, in the session the client renewed.
+                    if renewed or not isinstance(error, SessionExpired) or \
+                       not client.renewSession(request):
+                        raise error
+                    renewed = True
+                    continue
+                yield _Parsed(page)
+                done, locator = page[3:]
+            if done or not locator:
+                break
+            action, argument = 'queryMore', Node('queryLocator', locator)
+            renewed = False
+
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2008, 2009 Xigital Solutions
+#
+# Written by Jim Zhan <jim@xigital.com>
+#
+# This file is part of SFDC-Python Salesforce python accessor.
+#
+""" Response parser backends, see Client.useParser()/Client.parsing().
+
+    - ObjectifyParser: <lxml.objectify.ObjectifiedElement> trees, the
+      default, which the modules built on Client expect.
+    - EtreeParser: plain dictionaries built from an lxml.etree tree.
+    - ExpatParser: the same dictionaries, built with the standard
+      library's expat only, for environments without lxml.
+
+    Dictionaries: an element with children is a dictionary of its
+    children by local name, a name repeated becomes a list (but for
+    the Id of sObject records which comes twice, the first non-nil one
+    is kept); other elements are their text, None if nil or empty.
+    Use text()/children() of the backend to read results whatever the
+    backend is.
+"""
+from xml.parsers.expat import ParserCreate
+from config import namespace
+from error import LoginFault, SessionExpired, SFDCError, UnimplementedError
+
+
+__author__ = 'Jim Zhan'
+__email__ = 'jim@xigital.com'
+
+
+_soapBody = '{%s}Body' % namespace.soap
+_soapFault = '{%s}Fault' % namespace.soap
+
+
+def fault(faultcode, faultstring):
+    """ Exception of a SOAP Fault.
+
+        @param faultcode: Text of the faultcode node, e.g. sf:INVALID_FIELD.
+        @param faultstring: Text of the faultstring node.
+
+        @type faultcode: string
+        @type faultstring: string
+
+        @return: <error.SFDCError> instance (or subclass).
+    """
+    faultcode = faultcode.replace('sf:', '')
+    faultstring = faultstring.replace('%s:' % faultcode, '')
+    if faultcode == 'INVALID_SESSION_ID':
+        return SessionExpired(faultcode, faultstring)
+    elif faultcode.find('LOGIN') is not -1:
+        return LoginFault(faultcode, faultstring)
+    return SFDCError(faultcode, faultstring)
+
+
+class Parser(object):
+    """ Base class of parser backends. Subclasses implement document(),
+        fault handling is shared.
+    """
+    name = None
+
+    def parse(self, request, data, forList=False):
+        """ Parse a response.
+
+            @param request: Request answered by the response.
+            @param data: Response content, decompressed.
+            @param forList: Return all the children of the response
+                body, or the first one only.
+
+            @type request: <request.Request>
+            @type data: string
+            @type forList: boolean
+
+            @return: Parsed result(s).
+
+            @raise SFDCError: The response is a SOAP fault.
+        """
+        kind, value = self.document(data)
+        if kind == 'fault':
+            raise fault(*value)
+        return value if forList else value[0]
+
+
+    def document(self, data):
+        """ Returns ('fault', (faultcode, faultstring)), or ('body',
+            results) where results are the children of the response
+            body (e.g. <queryResponse>).
+        """
+        raise UnimplementedError
+
+
+    def text(self, node, name):
+        """ Text of a child of a result node, None if missing or nil. """
+        value = node.get(name)
+        return value if not isinstance(value, list) else value[0]
+
+
+    def children(self, node, name):
+        """ List of the (repeated) children of a result node. """
+        value = node.get(name)
+        if value is None:
+            return []
+        return value if isinstance(value, list) else [value]
+
+
+class ObjectifyParser(Parser):
+    """ <lxml.objectify.ObjectifiedElement> trees. """
+    name = 'objectify'
+
+    def document(self, data):
+        from lxml import objectify
+        xml = objectify.fromstring(data)
+        body = xml.find(_soapBody)
+        error = body.find(_soapFault)
+        if error is not None:
+            return ('fault', _faultTexts(error.iterchildren()))
+        # response element, e.g. <queryResponse>.
+        return ('body', body.getchildren()[0].getchildren())
+
+
+    def text(self, node, name):
+        child = getattr(node, name, None)
+        return child.text if child is not None else None
+
+
+    def children(self, node, name):
+        child = getattr(node, name, None)
+        return list(child) if child is not None else []
+
+
+def _faultTexts(children):
+    texts = {}
+    for child in children:
+        texts[child.tag.split('}')[-1]] = child.text
+    return (texts.get('faultcode') or '', texts.get('faultstring') or '')
+
+
+def _add(target, name, value):
+    """ Add a child value to a dictionary being built. """
+    if name not in target:
+        target[name] = value
+    elif name == 'Id':
+        # partner WSDL returns Id twice, the second might be blank.
+        if target[name] is None:
+            target[name] = value
+    elif isinstance(target[name], list):
+        target[name].append(value)
+    else:
+        target[name] = [target[name], value]
+
+
+class EtreeParser(Parser):
+    """ Plain dictionaries, from an lxml.etree tree. """
+    name = 'etree'
+
+    def document(self, data):
+        from lxml import etree
+        root = etree.fromstring(data)
+        body = root.find(_soapBody)
+        error = body.find(_soapFault)
+        if error is not None:
+            return ('fault', _faultTexts(error.iterchildren()))
+        names = {}
+        return ('body', [self._value(child, names) for child in body[0]])
+
+
+    def _value(self, element, names):
+        value = {}
+        for child in element:
+            tag = child.tag
+            name = names.get(tag)
+            if name is None:
+                name = names[tag] = tag.split('}')[-1]
+            # nil and empty elements have no text either.
+            item = self._value(child, names) if len(child) else child.text
+            if name in value:
+                _add(value, name, item)
+            else:
+                value[name] = item
+        return value
+
+
+class ExpatParser(Parser):
+    """ Plain dictionaries, standard library only. """
+    name = 'expat'
+
+    def document(self, data):
+        parser = ParserCreate(namespace_separator=' ')
+        parser.returns_unicode = False
+        parser.buffer_text = True
+        # frames: [local name, children dictionary or None, texts]
+        stack = [[None, {}, []]]
+        names = {}
+
+        def start(tag, attrs):
+            if stack[-1][1] is None:
+                stack[-1][1] = {}
+            name = names.get(tag)
+            if name is None:
+                name = names[tag] = tag.split(' ')[-1]
+            stack.append([name, None, []])
+
+        def end(tag):
+            name, children, texts = stack.pop()
+            if children is not None:
+                value = children
+            else:
+                # nil and empty elements have no text either.
+                value = ''.join(texts) or None
+            _add(stack[-1][1], name, value)
+
+        def characters(data):
+            stack[-1][2].append(data)
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = characters
+        parser.Parse(data, True)
+
+        body = stack[0][1]['Envelope']['Body']
+        error = body.get('Fault')
+        if error is not None:
+            return ('fault', (error.get('faultcode') or '',
+                              error.get('faultstring') or ''))
+        # response element, e.g. <queryResponse>, holds result(s).
+        response = body.values()[0] or {}
+        results = []
+        for value in response.values():
+            results.extend(value if isinstance(value, list) else [value])
+        return ('body', results)
+
+
+# default backend.
+objectify = ObjectifyParser()
+backends = (objectify, EtreeParser(), ExpatParser())
+
+
+def _corpus():
+    """ Query responses: (name, data) of narrow & wide pages. """
+    envelope = ('<?xml version="1.0" encoding="UTF-8"?>'
+        '<soapenv:Envelope xmlns:soapenv="%s" xmlns="%s" xmlns:sf="%s" '
+        'xmlns:xsi="%s"><soapenv:Body><queryResponse><result>'
+        '<done>true</done><queryLocator xsi:nil="true"/>%%s<size>%%d</size>'
+        '</result></queryResponse></soapenv:Body></soapenv:Envelope>') % (
+        namespace.soap, namespace.partner, namespace.sobject, namespace.xsi
+    )
+    corpus = []
+    for name, width, size in (('narrow', 3, 2000), ('wide', 200, 200)):
+        record = '<records xsi:type="sf:sObject"><sf:type>Account</sf:type>' \
+            '<sf:Id>001A0000001%04d</sf:Id>' + ''.join(
+                '<sf:Field%d__c>Value %d</sf:Field%d__c>' % (i, i, i)
+                for i in xrange(width)
+            ) + '</records>'
+        records = ''.join(record % i for i in xrange(size))
+        corpus.append((name, envelope % (records, size)))
+    return corpus
+
+
+if __name__ == '__main__':
+    from timeit import Timer
+    from request import Request
+    from response import toDict
+    request = Request('query')
+
+    def read(backend, data):
+        """ Parse, then read every field of every record. """
+        result = backend.parse(request, data)
+        for record in backend.children(result, 'records'):
+            if backend is objectify:
+                toDict(record)
+
+    for name, data in _corpus():
+        for backend in backends:
+            parse, total = [min(Timer(function).repeat(3, 5)) / 5 for function in (
+                lambda: backend.parse(request, data, True),
+                lambda: read(backend, data)
+            )]
+            print '%-8s %-10s parse %8.2f ms, parse & read %8.2f ms' % (
+                name, backend.name, parse * 1000, total * 1000
+            )
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2008, 2009 Xigital Solutions
+#
+# Written by Jim Zhan <jim@xigital.com>
+#
+# This file is part of SFDC-Python Salesforce python accessor.
+#
+""" Loading of related records of several sObject types at once. Each
+    record added to the plan gets a <Reference>, which other records use
+    as the value of their reference fields; the order of the types is
+    inferred from describeSObject(), and each type is created as soon as
+    the types it refers to are, independent types in parallel.
+
+    Usage:
+        plan = LoadPlanner(client)
+        acme = plan.add('Account', Name='Acme')
+        jim = plan.add('Contact', LastName='Zhan', AccountId=acme)
+        deal = plan.add('Opportunity', Name='Deal', AccountId=acme,
+                        StageName='Prospecting', CloseDate=date.today())
+        plan.add('OpportunityContactRole', OpportunityId=deal,
+                 ContactId=jim)
+        plan.run()
+        print acme.id, jim.id
+
+    References between records of one type (e.g. Account.ParentId), and
+    references closing a cycle between types, are set by an update()
+    once all the records are created.
+"""
+from threading import Event, Lock, Thread
+from bulk import BulkWriter
+from request import SObject
+
+
+__author__ = 'Jim Zhan'
+__email__ = 'jim@xigital.com'
+
+
+class Reference(object):
+    """ Record of a plan, to be created.
+
+        @ivar id: ID of the record once created, None if it failed.
+        @ivar result: SaveResult of the record, None if not sent.
+        @ivar error: Why the record was not sent (e.g. its parent
+            failed), or why setting its deferred references failed.
+    """
+    __slots__ = ('sObjectType', 'fields', 'id', 'result', 'error')
+
+    def __init__(self, sObjectType, fields):
+        self.sObjectType = sObjectType
+        self.fields = fields
+        self.id = None
+        self.result = None
+        self.error = None
+
+
+    def __repr__(self):
+        return '<Reference %s %s>' % (self.sObjectType, self.id)
+
+
+class LoadPlanner(object):
+    """ Plan of records to be created, see the module documentation.
+
+        @param client: Logged in client.
+        @param writer: Bulk writer creating records, one is made if None.
+
+        @type client: <client.Client>
+        @type writer: <bulk.BulkWriter>
+    """
+    def __init__(self, client, writer=None):
+        self.client = client
+        self.writer = writer or BulkWriter(client)
+        # sObject type: [<Reference>, ...], in the order added.
+        self.records = {}
+        self.lock = Lock()
+
+
+    def add(self, sObjectType, **fields):
+        """ Add a record, fields may refer to records of the plan.
+
+            @return: <Reference> of the record.
+        """
+        reference = Reference(sObjectType, fields)
+        self.lock.acquire()
+        try:
+            self.records.setdefault(sObjectType, []).append(reference)
+        finally:
+            self.lock.release()
+        return reference
+
+
+    def extend(self, sObjectType, rows):
+        """ Add records given as dictionaries of fields.
+
+            @return: <Reference> list.
+        """
+        return [self.add(sObjectType, **row) for row in rows]
+
+
+    def references(self, sObjectType):
+        """ Reference fields of an sObject type: field: set of types,
+            in lower case.
+        """
+        describe = self.client.describeSObject(sObjectType)
+        fields = {}
+        for field in describe.fields:
+            if field.type.text != 'reference':
+                continue
+            referenceTo = getattr(field, 'referenceTo', None)
+            fields[field.name.text] = set(
+                item.text.lower() for item in referenceTo
+            ) if referenceTo is not None else set()
+        return fields
+
+
+    def dependencies(self):
+        """ Types each type refers to in the plan, and the (type, field)
+            pairs deferred to an update().
+
+            @return: ({type: set of types}, set of (type, field)).
+
+            @raise ValueError: A record refers to a record of the plan
+                through a field which is not a reference to its type.
+        """
+        graph = {}
+        # (type, field): set of types referred to.
+        edges = {}
+        uses = {}
+        for sObjectType, records in self.records.items():
+            described = self.references(sObjectType)
+            graph[sObjectType] = set()
+            for record in records:
+                for name, value in record.fields.items():
+                    if not isinstance(value, Reference):
+                        continue
+                    if value.sObjectType.lower() not in described.get(name, ()):
+                        raise ValueError('%s.%s is no reference to %s' % (
+                            sObjectType, name, value.sObjectType
+                        ))
+                    key = (sObjectType, name)
+                    edges.setdefault(key, set()).add(value.sObjectType)
+                    uses[key] = uses.get(key, 0) + 1
+
+        # the most used references are kept, to defer as few as possible.
+        deferred = set()
+        for (sObjectType, name), targets in sorted(
+                edges.items(), key=lambda item: (-uses[item[0]], item[0])):
+            if sObjectType in targets:
+                deferred.add((sObjectType, name))
+                continue
+            # an edge closing a cycle is deferred.
+            if any(_reaches(graph, target, sObjectType) for target in targets):
+                deferred.add((sObjectType, name))
+                continue
+            graph[sObjectType].update(targets)
+        return graph, deferred
+
+
+    def run(self):
+        """ Create all the records, types in the order of their
+            references, then set deferred references.
+
+            @return: Dictionary of sObject type: <Reference> list.
+
+            @raise SFDCError: A batch failed, see bulk.BulkWriter.
+        """
+        graph, deferred = self.dependencies()
+        created = dict((sObjectType, Event()) for sObjectType in graph)
+        errors = []
+
+        def load(sObjectType):
+            try:
+                for dependency in graph[sObjectType]:
+                    created[dependency].wait()
+                if errors:
+                    return
+                self._create(sObjectType, deferred)
+            except Exception, e:
+                errors.append(e)
+            finally:
+                created[sObjectType].set()
+
+        threads = [Thread(target=load, args=(sObjectType,))
+                   for sObjectType in graph]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        for sObjectType in graph:
+            self._update(sObjectType, deferred)
+        return self.records
+
+
+    def _create(self, sObjectType, deferred):
+        sObjects = []
+        references = []
+        for reference in self.records[sObjectType]:
+            fields = self._resolve(reference, sObjectType, deferred, False)
+            if fields is not None:
+                sObjects.append(SObject(sObjectType, **fields))
+                references.append(reference)
+        results = self.writer.create(sObjects)
+        for reference, result in zip(references, results):
+            reference.result = result
+            if self.writer.succeeded(result):
+                reference.id = self.writer.recordId(result)
+
+
+    def _update(self, sObjectType, deferred):
+        sObjects = []
+        references = []
+        for reference in self.records[sObjectType]:
+            if reference.id is None:
+                continue
+            fields = self._resolve(reference, sObjectType, deferred, True)
+            if fields:
+                fields['Id'] = reference.id
+                sObjects.append(SObject(sObjectType, **fields))
+                references.append(reference)
+        if not sObjects:
+            return
+        results = self.writer.update(sObjects)
+        for reference, result in zip(references, results):
+            if not self.writer.succeeded(result):
+                reference.error = 'Deferred references not set'
+
+
+    def _resolve(self, reference, sObjectType, deferred, later):
+        """ Fields of a record, references replaced by IDs: the deferred
+            ones if later, the others if not. None if a parent failed.
+        """
+        fields = {}
+        for name, value in reference.fields.items():
+            isDeferred = (sObjectType, name) in deferred
+            if isinstance(value, Reference):
+                if isDeferred != later:
+                    continue
+                if value.id is None:
+                    reference.error = 'Parent %s not created' % name
+                    return None if not later else {}
+                value = value.id
+            elif later:
+                continue
+            fields[name] = value
+        return fields
+
+
+def _reaches(graph, start, goal):
+    """ Whether goal depends on start through the graph. """
+    seen = set()
+    stack = [start]
+    while stack:
+        node = stack.pop()
+        if node == goal:
+            return True
+        if node not in seen:
+            seen.add(node)
+            stack.extend(graph.get(node, ()))
+    return False
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2008, 2009 Xigital Solutions
+#
+# Written by Jim Zhan <jim@xigital.com>
+#
+# This file is part of SFDC-Python Salesforce python accessor.
+#
+""" Local SQLite replica of slowly changing sObjects.
+
+    Usage:
+        replica = Replica(client, '/var/lib/sfdc/replica.db', {
+            'User': ['Username', 'Email'],
+            'RecordType': ['DeveloperName'],
+        })
+        replica.refresh()
+        client.useReplica(replica)
+        client.lookup('User', ['Id', 'Name'], Username='jim@xigital.com')
+"""
+import sqlite3
+from threading import RLock
+from datetime import date, datetime, timedelta
+from codec import formatDate, formatDateTime, parseDateTime
+from response import toDict
+from soql import select
+from sync import Sink, SyncEngine, WatermarkStore
+
+
+__author__ = 'Jim Zhan'
+__email__ = 'jim@xigital.com'
+
+
+# describeSObject() field type: (SQLite column type, converter)
+fieldTypes = {
+    'boolean': ('INTEGER', lambda text: text == 'true'),
+    'int': ('INTEGER', int),
+    'double': ('REAL', float),
+    'currency': ('REAL', float),
+    'percent': ('REAL', float),
+}
+# field types not worth (or not possible) to be replicated.
+skippedTypes = ('base64', 'address', 'location')
+# text field types compared case-sensitively, as SOQL does.
+exactTypes = ('id', 'reference')
+
+
+def _convert(converter, text):
+    if text is None or text == '':
+        return None
+    if converter is None:
+        return unicode(text)
+    return converter(text)
+
+
+class _Table(object):
+    """ Replicated sObject type: its columns & converters. """
+    def __init__(self, sObjectType, fields, indexes):
+        self.name = sObjectType
+        self.fields = fields
+        self.indexes = indexes
+        self.kinds = dict(fields)
+        self.converters = dict(
+            (name, fieldTypes.get(kind, (None, None))[1])
+            for name, kind in fields
+        )
+
+
+    def row(self, record):
+        """ Turn a sObject into a row of column values. """
+        values = toDict(record)
+        return [_convert(self.converters[name], values.get(name))
+                for name, kind in self.fields]
+
+
+class _Watermarks(WatermarkStore):
+    """ Watermarks kept inside the replica database. """
+    def __init__(self, replica):
+        WatermarkStore.__init__(self)
+        self.replica = replica
+        for name, value in replica.execute(
+                'SELECT name, watermark FROM _watermarks'):
+            self.watermarks[name] = parseDateTime(value)
+
+
+    def save(self):
+        self.replica.executemany(
+            'INSERT OR REPLACE INTO _watermarks VALUES (?, ?)',
+            [(name, formatDateTime(value))
+             for name, value in self.watermarks.items()]
+        )
+
+
+class _ReplicaSink(Sink):
+    def __init__(self, replica):
+        self.replica = replica
+
+
+    def upsert(self, sObjectType, records):
+        self.replica.store(sObjectType, records)
+
+
+    def delete(self, sObjectType, ids):
+        self.replica.executemany(
+            'DELETE FROM "%s" WHERE Id = ?' % sObjectType,
+            [(item,) for item in ids]
+        )
+
+
+    def expired(self, sObjectType, watermark, earliestDateAvailable):
+        # deletes got purged, start it over.
+        self.replica.load(sObjectType)
+
+
+class Replica(object):
+    """ Mirrors configured sObject types into SQLite, tables are
+        derived from describeSObject() and kept fresh through the
+        sync engine.
+
+        @param client: Logged in client.
+        @param path: SQLite database file, ':memory:' is allowed.
+        @param sObjects: Dictionary of sObject type: fields to be indexed,
+            Id is always indexed.
+        @param maxAge: Data older than this is considered stale.
+
+        @type client: <client.Client>
+        @type path: string
+        @type sObjects: dictionary
+        @type maxAge: timedelta
+    """
+    def __init__(self, client, path, sObjects, maxAge=timedelta(minutes=15)):
+        self.client = client
+        self.sObjects = sObjects
+        self.maxAge = maxAge
+        self.lock = RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.execute(
+            'CREATE TABLE IF NOT EXISTS _watermarks '
+            '(name TEXT PRIMARY KEY, watermark TEXT)'
+        )
+        self.tables = {}
+        self.watermarks = _Watermarks(self)
+        self.engine = None
+
+
+    def execute(self, statement, params=()):
+        self.lock.acquire()
+        try:
+            rows = self.db.execute(statement, params).fetchall()
+            self.db.commit()
+            return rows
+        finally:
+            self.lock.release()
+
+
+    def executemany(self, statement, rows):
+        self.lock.acquire()
+        try:
+            self.db.executemany(statement, rows)
+            self.db.commit()
+        finally:
+            self.lock.release()
+
+
+    def table(self, sObjectType):
+        """ Describe the sObject type and create its table & indexes.
+
+            @return: <_Table> instance.
+        """
+        if sObjectType in self.tables:
+            return self.tables[sObjectType]
+        describe = self.client.describeSObject(sObjectType)
+        fields = [(field.name.text, field.type.text)
+                  for field in describe.fields
+                  if field.type.text not in skippedTypes]
+        table = _Table(sObjectType, fields, self.sObjects[sObjectType])
+        columns = ', '.join(
+            '"%s" %s%s' % (
+                name,
+                fieldTypes.get(kind, ('TEXT',))[0],
+                ' PRIMARY KEY' if name == 'Id' else ''
+            ) for name, kind in fields
+        )
+        self.execute('CREATE TABLE IF NOT EXISTS "%s" (%s)' % (
+            sObjectType, columns
+        ))
+        for name in table.indexes:
+            self.execute(
+                'CREATE INDEX IF NOT EXISTS "%s_%s" ON "%s" ("%s")' % (
+                    sObjectType, name, sObjectType, name
+                )
+            )
+        self.tables[sObjectType] = table
+        return table
+
+
+    def store(self, sObjectType, records):
+        """ Insert or replace records into the replica. """
+        table = self.table(sObjectType)
+        self.executemany(
+            'INSERT OR REPLACE INTO "%s" VALUES (%s)' % (
+                sObjectType, ', '.join(['?'] * len(table.fields))
+            ),
+            [table.row(record) for record in records]
+        )
+
+
+    def load(self, sObjectType):
+        """ (Re)load all records of given sObject type. The watermark
+            is taken before the query, so changes made during the load
+            will be replayed by the next refresh().
+        """
+        table = self.table(sObjectType)
+        watermark = self.client.getServerTimestamp()
+        self.execute('DELETE FROM "%s"' % sObjectType)
+        result = self.client.query(
+            select(sObjectType, [name for name, kind in table.fields])
+        )[0]
+        while True:
+            records = getattr(result, 'records', None)
+            if records is not None:
+                self.store(sObjectType, records)
+            if result.done.text == 'true':
+                break
+            result = self.client.queryMore(result.queryLocator.text)[0]
+        self.watermarks.set(sObjectType, watermark)
+
+
+    def refresh(self):
+        """ Bring all replicated sObject types up to date, types which
+            have never been loaded are fully loaded.
+        """
+        for sObjectType in self.sObjects:
+            self.table(sObjectType)
+            if self.watermarks.get(sObjectType) is None:
+                self.load(sObjectType)
+        if self.engine is None:
+            self.engine = SyncEngine(
+                self.client,
+                self.watermarks,
+                _ReplicaSink(self),
+                dict((sObjectType, [name for name, kind in table.fields])
+                     for sObjectType, table in self.tables.items())
+            )
+        self.engine.syncAll()
+
+
+    def isFresh(self, sObjectType):
+        """ Whether replicated data of given type is younger than maxAge. """
+        watermark = self.watermarks.get(sObjectType)
+        if watermark is None:
+            return False
+        return datetime.utcnow() - watermark <= self.maxAge
+
+
+    def supports(self, sObjectType, fieldList, criteria):
+        """ Whether a lookup can be answered by the replica. """
+        table = self.tables.get(sObjectType)
+        if table is None:
+            return False
+        columns = table.converters
+        for name in list(fieldList) + list(criteria):
+            if name not in columns:
+                return False
+        return True
+
+
+    def lookup(self, sObjectType, fieldList, criteria):
+        """ Select records from the replica, criteria are ANDed equalities.
+
+            @return: List of dictionaries.
+        """
+        kinds = self.tables[sObjectType].kinds
+        where = []
+        params = []
+        for name, value in sorted(criteria.items()):
+            if value is None:
+                where.append('"%s" IS NULL' % name)
+                continue
+            # dates are stored as the API returns them, xsd text.
+            if isinstance(value, datetime):
+                value = formatDateTime(value)
+            elif isinstance(value, date):
+                value = formatDate(value)
+            if isinstance(value, basestring) and \
+               kinds[name] not in exactTypes:
+                # SOQL compares strings regardless of case.
+                where.append('"%s" = ? COLLATE NOCASE' % name)
+            else:
+                where.append('"%s" = ?' % name)
+            params.append(value)
+        statement = 'SELECT %s FROM "%s"' % (
+            ', '.join('"%s"' % name for name in fieldList), sObjectType
+        )
+        if where:
+            statement += ' WHERE %s' % ' AND '.join(where)
+        booleans = [name for name in fieldList if kinds[name] == 'boolean']
+        result = []
+        for row in self.execute(statement, params):
+            record = dict(zip(fieldList, row))
+            for name in booleans:
+                if record[name] is not None:
+                    record[name] = bool(record[name])
+            result.append(record)
+        return result
+
+
+    def convert(self, sObjectType, record, fieldList):
+        """ Convert a sObject returned by the API the same way as a row
+            read from the replica.
+        """
+        values = toDict(record)
+        converters = self.tables[sObjectType].converters
+        return dict(
+            (name, _convert(converters[name], values.get(name)))
+            for name in fieldList
+        )
+
+
+if __name__ == '__main__':
+    pass
@@ -6,13 +6,22 @@
 #
 # This file is part of SFDC-Python Salesforce python accessor.
 #
-from copy import deepcopy
+import os
+import re
+import csv
+import zlib
+import struct
+import weakref
+from uuid import uuid4
+from threading import Lock
+from binascii import b2a_base64
 from gzip import GzipFile
 from lxml import etree
 from datetime import date, datetime
 from decimal import Decimal
 from StringIO import StringIO
 from util import Singleton
+from codec import formatDate, formatDateTime
 from config import sfdc, http, header, namespace
 
 __author__ = 'Jim Zhan'
@@ -34,7 +43,132 @@ __xml__ = ('''
 )).strip()
 
 
+# calls without side effects, safe to be sent again after a dropped connection.
+safeActions = (
+    'login', 'query', 'queryAll', 'queryMore', 'retrieve', 'search',
+    'getDeleted', 'getUpdated', 'getServerTimestamp', 'getUserInfo',
+    'describeGlobal', 'describeLayout', 'describeSObject', 'describeSObjects',
+    'describeSoftphoneLayout', 'describeTabs'
+)
+
+
+# base64 file values by placeholder token, nodes holding them keep them
+# alive (see SObject.files).
+_streams = weakref.WeakValueDictionary()
+
+
 ############################## COMMON ##############################
+class Base64File(object):
+    """ Value of a base64 field (Attachment/Document Body, email
+        attachment...) read lazily from a file. The node gets a short
+        placeholder, the content is only encoded while the request is
+        being sent, chunk by chunk, see Request.build().
+
+        @param source: Path, file object (read from its current position)
+            or memory-mapped region (mmap, buffer; a string is a path).
+        @param chunkSize: Bytes read & encoded at a time.
+
+        @type source: string/file/mmap
+        @type chunkSize: integer
+    """
+    def __init__(self, source, chunkSize=3 * 64 * 1024):
+        self.source = source
+        # encoded chunks can be concatenated only if a multiple of 3.
+        self.chunkSize = max(chunkSize // 3, 1) * 3
+        self.offset = source.tell() if hasattr(source, 'read') else 0
+        self.token = 'sfdc-base64-%s' % uuid4().hex
+        _streams[self.token] = self
+
+
+    def __len__(self):
+        """ Length of the base64 encoded content. """
+        if isinstance(self.source, basestring):
+            size = os.path.getsize(self.source)
+        elif hasattr(self.source, 'read'):
+            self.source.seek(0, os.SEEK_END)
+            size = self.source.tell() - self.offset
+        else:
+            size = len(self.source)
+        return (size + 2) // 3 * 4
+
+
+    def __iter__(self):
+        """ Base64 encoded content, chunk by chunk. Each iteration reads
+            from the beginning again, so a request can be resent.
+        """
+        if isinstance(self.source, basestring):
+            source = open(self.source, 'rb')
+        elif hasattr(self.source, 'read'):
+            source = self.source
+            source.seek(self.offset)
+        else:
+            source = None
+        try:
+            position = 0
+            while True:
+                if source is None:
+                    data = self.source[position:position + self.chunkSize]
+                    position += len(data)
+                else:
+                    data = source.read(self.chunkSize)
+                if not data:
+                    break
+                yield b2a_base64(data)[:-1]
+        finally:
+            if source is not None and source is not self.source:
+                source.close()
+
+
+def toText(value):
+    """ Text of a value in a request, Python's data types converted to
+        Salesforce's.
+    """
+    if isinstance(value, basestring):
+        # as it is, str() would fail on non-ASCII unicode.
+        return value
+    elif isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, (int, long, float, Decimal)):
+        return str(value)
+    elif isinstance(value, datetime):
+        return formatDateTime(value)
+    elif isinstance(value, date):
+        return formatDate(value)
+    elif isinstance(value, Base64File):
+        return value.token
+    return str(value)
+
+
+def _textOf(kind):
+    """ Converter of values of given type to text, chosen once per
+        column (see FieldTable.fromColumns()).
+    """
+    if issubclass(kind, basestring) or issubclass(kind, Base64File):
+        # sent as they are, files are encoded when the request is.
+        return None
+    if kind is bool:
+        return lambda value: 'true' if value else 'false'
+    if issubclass(kind, (int, long, float, Decimal)):
+        return str
+    if issubclass(kind, datetime):
+        return formatDateTime
+    if issubclass(kind, date):
+        return formatDate
+    return toText
+
+
+class _Null(object):
+    """ Value of a field to be cleared, see NULL. """
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'NULL'
+
+
+# value of a compact record's field sent in fieldsToNull.
+NULL = _Null()
+
+
 class Node(object):
     """ XML node class, all elements/headers must inherit from me.
         *NOTE* Python's data types will be automatically converted
@@ -49,24 +183,17 @@ class Node(object):
         @return XML node. <lxml.etree.Element> instance can be
             accessed via its 'xml' attribute.
     """
+    # class wide, nodes are many.
+    debug = sfdc.debug
+
     def __init__(self, tag, text=None, nsmap=None, attrib=None):
-        self.debug = sfdc.debug
         if isinstance(nsmap, dict):
             tag = '{%s}%s' % (nsmap.values()[0], tag)
             self.xml = etree.Element(tag, nsmap=nsmap, attrib=attrib)
         else:
             self.xml = etree.Element(tag, attrib=attrib)
-
-        if isinstance(text, bool):
-            self.xml.text = 'true' if text else 'false'
-        elif isinstance(text, (int, long, float, Decimal)):
-            self.xml.text = str(text)
-        elif isinstance(text, date):
-            self.xml.text = text.strftime(sfdc.datefmt)
-        elif isinstance(text, datetime):
-            self.xml.text = text.strftime(sfdc.datetimefmt)
-        elif text is not None:
-            self.xml.text = str(text)
+        if text is not None:
+            self.xml.text = toText(text)
 
 
     def __str__(self):
@@ -441,13 +568,380 @@ class SObject(Node):
     def __init__(self, recordType, root='sObjects', **params):
         Node.__init__(self, root)
         recordType = recordType.capitalize()
+        self.recordType = recordType
         kids = [Node('type', recordType, nsmap=SObject.nsmap).xml]
+        self.files = [value for value in params.values()
+                      if isinstance(value, Base64File)]
         for key, value in params.items():
             if key is not 'type':
                 kids.append(Node(key, value, nsmap=SObject.nsmap).xml)
         self.xml.extend(kids)
 
 
+    def get(self, field, default=None):
+        """ Text of a field, default if not set. """
+        value = self.xml.findtext('{%s}%s' % (namespace.sobject, field))
+        return default if value is None else value
+
+
+class TrackedSObject(object):
+    """ sObject remembering the values it was loaded with: handed to
+        update()/upsert() in place of an <SObject>, it sends the fields
+        changed since (and fieldsToNull for those cleared) only, along
+        with the key fields, so that unchanged values neither inflate
+        the payload nor fire field history & triggers.
+
+        Usage:
+            record = TrackedSObject.fromRecord(client.retrieve(...)[0])
+            record['Title'] = 'CEO'
+            record['Fax'] = None
+            client.update([record])
+            record.markSaved()
+
+        @param recordType: Record type.
+        @param keys: Fields sent whatever their value: Id, and the
+            external ID field for upsert().
+        @param loaded: Values loaded, fieldname: text.
+
+        @type recordType: string
+        @type keys: string array
+        @type loaded: dictionary
+    """
+    def __init__(self, recordType, keys=('Id',), **loaded):
+        self.recordType = recordType.capitalize()
+        self.keys = tuple(keys)
+        self.original = dict(loaded)
+        self.values = dict(loaded)
+
+
+    @classmethod
+    def fromRecord(cls, record, recordType=None, keys=('Id',)):
+        """ Track a record returned by query()/retrieve().
+
+            @param record: sObject record, element or dictionary.
+            @param recordType: Record type, default is the record's.
+        """
+        from response import toDict
+        if recordType is None:
+            if isinstance(record, dict):
+                recordType = record['type']
+            else:
+                recordType = record.findtext('{%s}type' % namespace.sobject)
+        return cls(recordType, keys, **toDict(record))
+
+
+    def __getitem__(self, field):
+        return self.values[field]
+
+
+    def __setitem__(self, field, value):
+        self.values[field] = value
+
+
+    def __delitem__(self, field):
+        # cleared, as setting None.
+        self.values[field] = None
+
+
+    def get(self, field, default=None):
+        """ Text of a field, default if not set. """
+        value = self.values.get(field)
+        if value is None:
+            return default
+        return toText(value)
+
+
+    @property
+    def files(self):
+        return [value for value in self.values.values()
+                if isinstance(value, Base64File)]
+
+
+    def changes(self):
+        """ Fields to be sent: (fieldname: value of the changed and key
+            fields, fieldnames cleared).
+        """
+        changed = {}
+        cleared = []
+        for field, value in self.values.items():
+            original = self.original.get(field)
+            if value is None:
+                if original is not None:
+                    cleared.append(field)
+            elif field in self.keys or isinstance(value, Base64File) or \
+                 toText(value) != original:
+                changed[field] = value
+        for field in self.keys:
+            if field not in changed and self.values.get(field) is not None:
+                changed[field] = self.values[field]
+        return changed, sorted(cleared)
+
+
+    def isDirty(self):
+        """ Whether fields changed since loaded (or saved). """
+        changed, cleared = self.changes()
+        return bool(cleared) or any(field not in self.keys
+                                    for field in changed)
+
+
+    def markSaved(self):
+        """ Take current values as the saved ones, e.g. once update()
+            succeeded.
+        """
+        self.original = dict(
+            (field, None if value is None else toText(value))
+            for field, value in self.values.items()
+        )
+
+
+    @property
+    def xml(self):
+        """ <sObjects> element of the changes, built on each access. """
+        changed, cleared = self.changes()
+        kids = [Node('type', self.recordType, nsmap=SObject.nsmap).xml]
+        kids.extend(Node('fieldsToNull', field, nsmap=SObject.nsmap).xml
+                    for field in cleared)
+        kids.extend(Node(field, value, nsmap=SObject.nsmap).xml
+                    for field, value in sorted(changed.items()))
+        element = Node('sObjects').xml
+        element.extend(kids)
+        return element
+
+
+    def __repr__(self):
+        return etree.tostring(self.xml)
+
+
+_sObjectType = '{%s}type' % namespace.sobject
+_fieldsToNull = '{%s}fieldsToNull' % namespace.sobject
+
+
+class FieldTable(object):
+    """ Fields of compact records of one type, shared by the records
+        which hold their values only (see CompactSObject).
+
+        Usage:
+            contacts = FieldTable('Contact')
+            records = [contacts.record(LastName=name, Email=email)
+                       for name, email in rows]
+            writer.create(records)
+
+        Records of tabular data are built a column at a time, values
+        turned into text once for all, with one converter per column:
+            records = contacts.fromColumns({'LastName': names,
+                                            'Birthdate': birthdates})
+            records = contacts.fromRows(('LastName', 'Birthdate'), rows)
+            records = contacts.fromCSV(open('contacts.csv', 'rb'))
+
+        @param recordType: Record type.
+        @param fields: Field names known upfront.
+
+        @type recordType: string
+        @type fields: string array
+    """
+    def __init__(self, recordType, fields=()):
+        self.recordType = recordType.capitalize()
+        self.fields = []
+        self.tags = []
+        self.positions = {}
+        self.lock = Lock()
+        for field in fields:
+            self.position(field)
+
+
+    def position(self, field):
+        """ Position of a field in the values of records, added if new. """
+        position = self.positions.get(field)
+        if position is not None:
+            return position
+        self.lock.acquire()
+        try:
+            position = self.positions.get(field)
+            if position is None:
+                self.tags.append('{%s}%s' % (namespace.sobject, field))
+                self.fields.append(field)
+                position = self.positions[field] = len(self.fields) - 1
+            return position
+        finally:
+            self.lock.release()
+
+
+    def record(self, **fields):
+        """ New <CompactSObject> of given field values. """
+        values = [None] * len(self.fields)
+        for field, value in sorted(fields.iteritems()):
+            position = self.position(field)
+            if position >= len(values):
+                values.extend([None] * (position + 1 - len(values)))
+            values[position] = value
+        return CompactSObject(self, tuple(values))
+
+
+    def fromColumns(self, columns, fields=None):
+        """ Records of columns of values, None (or NaN) values sent in
+            fieldsToNull. Each column is turned into text in one pass,
+            by a converter chosen from its first value: a column mixing
+            types is converted value by value.
+
+            @param columns: Dictionary of field: values, or arrays of
+                values of given fields (e.g. pandas'
+                frame.to_dict('list')).
+            @param fields: Field names of the arrays of columns.
+
+            @type columns: dictionary/array
+            @type fields: string array
+
+            @return: <CompactSObject> list, in the order of the values.
+        """
+        if fields is None:
+            fields, columns = zip(*sorted(columns.items())) or ((), ())
+        if len(fields) != len(columns):
+            raise ValueError('%d fields for %d columns' % (
+                len(fields), len(columns)
+            ))
+        positions = [self.position(field) for field in fields]
+        aligned = [()] * len(self.fields)
+        length = None
+        for position, column in zip(positions, columns):
+            column = _convert(column)
+            if length is not None and len(column) != length:
+                raise ValueError('Columns of different lengths')
+            length = len(column)
+            aligned[position] = column
+        if not length:
+            return []
+        # fields of the table not given are left out.
+        missing = (None,) * length
+        aligned = [column or missing for column in aligned]
+        return [CompactSObject(self, values) for values in zip(*aligned)]
+
+
+    def fromRows(self, fields, rows):
+        """ Records of rows of values, in the order of given fields, see
+            fromColumns().
+
+            @type fields: string array
+            @type rows: tuple array
+        """
+        rows = list(rows)
+        for row in rows:
+            if len(row) != len(fields):
+                raise ValueError('Row of %d values for %d fields' % (
+                    len(row), len(fields)
+                ))
+        columns = zip(*rows) if rows else [()] * len(fields)
+        return self.fromColumns(columns, fields)
+
+
+    def fromCSV(self, stream, encoding='utf-8', **options):
+        """ Records of a CSV stream, the first row of which holds the
+            field names. Values are sent as they are, empty ones in
+            fieldsToNull.
+
+            @param stream: File like object, opened in binary mode.
+            @param encoding: Encoding of the stream.
+            @param options: Options of csv.reader(), e.g. delimiter.
+
+            @type stream: file
+            @type encoding: string
+
+            @return: <CompactSObject> list, in the order of the rows.
+        """
+        reader = csv.reader(stream, **options)
+        try:
+            fields = [field.decode(encoding).strip() for field in reader.next()]
+        except StopIteration:
+            return []
+        # blank lines are skipped.
+        rows = [[value.decode(encoding) if value else None for value in row]
+                for row in reader if row]
+        return self.fromRows(fields, rows)
+
+
+def _convert(column):
+    """ Values of a column turned into text, None and NaN into NULL. """
+    convert = None
+    kind = None
+    converted = []
+    append = converted.append
+    for value in column:
+        # NaN is the only value unequal to itself.
+        if value is None or value != value:
+            append(NULL)
+            continue
+        if kind is None:
+            kind = type(value)
+            convert = _textOf(kind)
+        if type(value) is not kind:
+            append(value if isinstance(value, (basestring, Base64File))
+                   else toText(value))
+        elif convert is None:
+            append(value)
+        else:
+            append(convert(value))
+    return converted
+
+
+class CompactSObject(object):
+    """ sObject holding its values only, in the order of the fields of
+        its <FieldTable>: no element tree is kept, the <sObjects> element
+        is built when the record's batch is serialized. None values are
+        not sent, NULL ones are sent in fieldsToNull. Takes the place of
+        an <SObject> in create()/update()/upsert().
+
+        @param table: Fields of the record type.
+        @param values: Values, by position of the fields.
+
+        @type table: <FieldTable>
+        @type values: tuple
+    """
+    __slots__ = ('table', 'values')
+
+    def __init__(self, table, values):
+        self.table = table
+        self.values = values
+
+
+    recordType = property(lambda self: self.table.recordType)
+
+
+    def get(self, field, default=None):
+        """ Text of a field, default if not set. """
+        position = self.table.positions.get(field)
+        if position is None or position >= len(self.values):
+            return default
+        value = self.values[position]
+        if value is None or value is NULL:
+            return default
+        return value if isinstance(value, basestring) else toText(value)
+
+
+    @property
+    def files(self):
+        return [value for value in self.values if isinstance(value, Base64File)]
+
+
+    @property
+    def xml(self):
+        """ <sObjects> element, built on each access. """
+        element = etree.Element('sObjects', nsmap=SObject.nsmap)
+        etree.SubElement(element, _sObjectType).text = self.table.recordType
+        table = self.table
+        for position, value in enumerate(self.values):
+            if value is NULL:
+                etree.SubElement(element, _fieldsToNull).text = \
+                    table.fields[position]
+        for position, value in enumerate(self.values):
+            if value is not None and value is not NULL:
+                etree.SubElement(element, table.tags[position]).text = \
+                    value if isinstance(value, basestring) else toText(value)
+        return element
+
+
+    def __repr__(self):
+        return etree.tostring(self.xml)
+
+
 class LeadConvert(Node):
     """ LeacConvert complex object. For Salesforce's CORE call convertLead().
         This is also a <util.Record> like class which represent key-value pairs
@@ -529,9 +1023,21 @@ class LeadConvert(Node):
         ))
 
 
+def _repeat(tag, values):
+    """ Nodes of an array argument: one element per item, none for None. """
+    if values is None:
+        return []
+    if not isinstance(values, (tuple, list)):
+        values = [values]
+    return [Node(tag, value).xml for value in values]
+
+
 class BaseEmail(Node):
-    """ Base email object which will be used in both single and mass email.
+    """ Base email object which will be used in both single and mass email,
+        as an item of sendEmail()'s messages array. Optional arguments
+        left None are not sent.
 
+        @param xsiType: SingleEmailMessage or MassEmailMessage.
         @param bccSender: Indicates whether the email sender receives a
             copy of the email that is sent. For a mass mail, the sender
             is only copied on the first email sent.
@@ -561,6 +1067,7 @@ class BaseEmail(Node):
         @param sendDisplayName: Optional. The name that appears on the
             From line of the email.
 
+        @type xsiType: string
         @type bccSender: boolean
         @type saveAsActivity: boolean
         @type useSignature: boolean
@@ -570,23 +1077,27 @@ class BaseEmail(Node):
         @type templateId: SFDC ID (string)
         @type senderDisplayName: string
     """
-    def __init__(self, tag='Email', bccSender=False,
+    def __init__(self, xsiType, bccSender=False,
                  saveAsActivity=True, useSignature=True,
                  emailPriority='Normal', replyTo=None,
                  subject=None, templateId=None,
                  senderDisplayName=None):
-        Node.__init__(self, tag)
-        self.xml.extend((
-            Node('bccSender', bccSender).xml,
-            Node('saveAsActivity', saveAsActivity).xml,
-            Node('useSignature', useSignature).xml,
-            Node('emailPriority', emailPriority).xml,
-            Node('replyTo', replyTo).xml,
-            Node('subject', subject).xml,
-            Node('templateId', templateId).xml,
-            Node('senderDisplayName', senderDisplayName).xml
-        ))
-
+        Node.__init__(
+            self,
+            'messages',
+            attrib = {'{%s}type' % namespace.xsi: xsiType}
+        )
+        self.files = []
+        for tag, value in (
+                ('bccSender', bccSender),
+                ('emailPriority', emailPriority),
+                ('replyTo', replyTo),
+                ('saveAsActivity', saveAsActivity),
+                ('senderDisplayName', senderDisplayName),
+                ('subject', subject),
+                ('templateId', templateId),
+                ('useSignature', useSignature)):
+            self.xml.extend(_repeat(tag, value))
 
 
 class SingleEmailMessage(BaseEmail):
@@ -665,42 +1176,31 @@ class SingleEmailMessage(BaseEmail):
         @type targetObjectId: SFDC ID (string)
         @type toAddresses: string array
         @type whatId: SFDC ID (string)
+
+        Arguments of <BaseEmail> (subject, templateId...) are given
+        as keyword arguments.
     """
     def __init__(self, bccAddresses=None, ccAddresses=None,
                  charset=None, documentAttachments=None,
-                 fileAttachments=None, htmlBody=' ',
-                 plainTextBody=' ', targetObjectId=None,
-                 toAddresses=None, whatId=None):
-        BaseEmail.__init__(self, tag='SingleEmailMessage')
-
-        if isinstance(fileAttachments, (tuple, list)):
-            items = [item.xml for item in fileAttachments]
-            files = Node('fileAttachments')
-            files.xml.extend(items)
-        else:
-            files = Node('fileAttachments', fileAttachments) \
-                if fileAttachments else Node('fileAttachments')
- 
-        if isinstance(documentAttachments, (tuple, list)):
-            items = [item.xml for item in documentAttachments]
-            docs = Node('documentAttachments')
-            docs.xml.extend(items)
-        else:
-            docs = Node('documentAttachments', documentAttachments) \
-                if documentAttachments else Node('documentAttachments')
-
-        self.xml.extend([
-            Node('bccAddresses', bccAddresses).xml,
-            Node('ccAddresses', ccAddresses).xml,
-            Node('charset', charset).xml,
-            docs.xml,
-            files.xml,
-            Node('htmlBody', htmlBody).xml,
-            Node('plainTextBody', plainTextBody).xml,
-            Node('targetObjectId', targetObjectId).xml,
-            Node('toAddresses', toAddresses).xml,
-            Node('whatId', whatId).xml
-        ])
+                 fileAttachments=None, htmlBody=None,
+                 plainTextBody=None, targetObjectId=None,
+                 toAddresses=None, whatId=None, **base):
+        BaseEmail.__init__(self, 'SingleEmailMessage', **base)
+        if isinstance(fileAttachments, EmailFileAttachment):
+            fileAttachments = [fileAttachments]
+        for item in fileAttachments or ():
+            self.files.extend(item.files)
+
+        self.xml.extend(_repeat('bccAddresses', bccAddresses))
+        self.xml.extend(_repeat('ccAddresses', ccAddresses))
+        self.xml.extend(_repeat('charset', charset))
+        self.xml.extend(_repeat('documentAttachments', documentAttachments))
+        self.xml.extend([item.xml for item in fileAttachments or ()])
+        self.xml.extend(_repeat('htmlBody', htmlBody))
+        self.xml.extend(_repeat('plainTextBody', plainTextBody))
+        self.xml.extend(_repeat('targetObjectId', targetObjectId))
+        self.xml.extend(_repeat('toAddresses', toAddresses))
+        self.xml.extend(_repeat('whatId', whatId))
 
 
 class MassEmailMessage(BaseEmail):
@@ -742,14 +1242,16 @@ class MassEmailMessage(BaseEmail):
         @type description: string
         @type targetObjectIds: SFDC ID array (string array)
         @type whatIds: SFDC ID array (string array)
+
+        Arguments of <BaseEmail> (templateId...) are given as keyword
+        arguments.
     """
-    def __init__(self, targetObjectIds, whatIds=None, description=None):
-        BaseEmail.__init__(self, 'MassEmailMessage')
-        self.xml.extend([
-            Node('targetObjectIds', targetObjectIds).xml,
-            Node('whatIds', whatIds).xml,
-            Node('description', description).xml
-        ])
+    def __init__(self, targetObjectIds, whatIds=None, description=None,
+                 **base):
+        BaseEmail.__init__(self, 'MassEmailMessage', **base)
+        self.xml.extend(_repeat('description', description))
+        self.xml.extend(_repeat('targetObjectIds', targetObjectIds))
+        self.xml.extend(_repeat('whatIds', whatIds))
 
 
 class EmailFileAttachment(Node):
@@ -759,157 +1261,89 @@ class EmailFileAttachment(Node):
         @para body: The attachment itself.
 
         @type fileName: string
-        @type body: base64
+        @type body: base64/<Base64File>
     """
     def __init__(self, fileName, body):
-        Node.__init__(self, 'EmailFileAttachment')
+        Node.__init__(self, 'fileAttachments')
+        self.files = [body] if isinstance(body, Base64File) else []
         self.xml.extend((
             Node('fileName', fileName).xml,
             Node('body', body).xml
         ))
 
-############################## Email ##############################
-class Email(Node):
-    """ Base email message, for inheritance only.
-
-        @param bccSender: Indicates whether the email sender
-            receives a copy of the email that is sent.
-        @param saveAsActivity: The default value is True.
-            meaning the email is saved as an activity.
-            This argument only applies if the recipient
-            list is based on targetObjectId or targetObjectIds.
-            If HTML email tracking is enabled for the organization,
-            you will be able to track open rates.
-        @param useSignature: Indicates whether the email includes
-            an email signature if the user has one configured.
-            The default is True, meaning if the use has a
-            signature it is included in the email unless you
-            specify False.
-        @param emailPriority: Highest/High/Normal/Low/Lowest,
-            the default value is Normal.
-        @param replyTo: The email address that receives the message
-            when a recipient replies.
-        @param subject: The email subject line. If you are using an
-            email template and attempt to override the subject line,
-            an error message is returned.
-        @param templateId: The ID of the template to be merged to
-            create this email.
-        @param senderDisplayName: The name that appears on the
-            From line of the email.
+############################## XML Requests ##############################
+# gzip member header: magic, deflate, no flags, no mtime, no extra, unknown OS.
+_gzipHeader = '\037\213\010\000\000\000\000\000\000\377'
+
+
+def _gzip(chunks, level):
+    """ Compress chunks of data into a gzip member, chunk by chunk. """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    crc = size = 0
+    yield _gzipHeader
+    for chunk in chunks:
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+    yield struct.pack('<LL', crc & 0xffffffffL, size & 0xffffffffL)
+
+
+class Stream(object):
+    """ Request body sent chunk by chunk: serialized envelope parts
+        interleaved with <Base64File> contents, gzipped on the fly
+        unless level is None. Can be iterated more than once.
+
+        @param parts: Strings and <Base64File> instances.
+        @param level: Compression level, None for no compression.
+
+        @type parts: list
+        @type level: integer
+    """
+    def __init__(self, parts, level=None):
+        self.parts = parts
+        self.level = level
 
-        @type bccSender: string
-        @type saveAsActivity: boolean
-        @type useSignature: boolean
-        @type emailPriority: string
-        @type replyTo: string
-        @type subject: string
-        @type templateId: SFDC ID
-        @type senderDisplayName: string
 
-        @return: Constructed email message instance.
-    """
-    def __init__(self, tag='email', bccSender=None,
-                 saveAsActivity=True, useSignature=True,
-                 emailPriority='Normal', replyTo=None,
-                 subject=None, templateId=None,
-                 senderDisplayName=None):
+    def __len__(self):
+        """ Length of the uncompressed content. """
+        return sum(len(part) for part in self.parts)
 
-        Node.__init__(self, tag)
-        priority = emailPriority if emailPriority \
-                   in ('Highest', 'High', 'Normal', 'Low', 'Lowest') \
-                   else 'Normal'
-        self.xml.extend((
-            Node('bccSender', bccSender).xml,
-            Node('saveAsActivity', saveAsActivity).xml,
-            Node('useSignature', useSignature).xml,
-            Node('emailPriority', Priority).xml,
-            Node('replyTo', replyTo).xml,
-            Node('templateId', templateId).xml,
-            Node('senderDisplayName', senderDisplayName).xml
-        ))
 
+    def _chunks(self):
+        for part in self.parts:
+            if isinstance(part, Base64File):
+                for chunk in part:
+                    yield chunk
+            elif part:
+                yield part
 
-class SingleEmailMessage(Email):
-    """ Single email message, contains the arguments it uses
-        in addition to the base email arguments.
-
-        TODO: ATTACHEMENTS
-
-        @param bccAddresses: An array of blind carbon copy addresses.
-            This argument is allowed only when a template is not used.
-        @param ccAddresses: An array of carbon copy addresses.
-            The maximum allowed is five. This argument is allowed only
-            when a template is not used.
-        @param charset: the character set for the email. If this value
-            is null, the user's default value is used.
-        @param documentAttachments: An array listing the ID of each
-            Document you want to attach to the email. You can attach
-            multiple documents as long as the sive of all attachments
-            does not exceed 10MB.
-        @param fileAttachments: An array listing the file names of
-            binary and text files you want to attach to the email.
-            You can attach multiple files as long as the total size
-            of all attachments does not exceed 10MB.
-        @param htmlBody: The HTML version of the email, specified by
-            the sender. The value is encoded according to the specification
-            associated with the organization.
-        @param plainTextBody: The text version of the email, specified
-            by the sender.
-        @param targetObjectId: The object ID of the contact, lead, or
-            user the email will be sent to. The object ID you enter sets
-            the context and ensures that merge fields in the template
-            contain the correct data.
-        @param toAddresses: An array of email address you are sending
-            the email to, The maximum allowed is ten. This argument is
-            allowed only when a template is not used.
-        @param whatId: If you specify a contact for the targetObjectId
-            field, you can specify a whatId as well. This help to further
-            ensures that merge fields in the template contain the correct
-            data.
 
-        @type bccAddresses: string array
-        @type ccAddresses: string array
-        @type charset: string
-        @type documentAttachments: SFDC ID
-        @type fileAttachments: EmailFileAttachment
-        @type htmlBody: string
-        @type plainTextBody: string
-        @type targetObjectId: SFDC ID
-        @type whatId: SFDC ID
+    def __iter__(self):
+        if self.level is None:
+            return self._chunks()
+        return _gzip(self._chunks(), self.level)
 
-        @return: SingleEmailMessage (lxml.etree.Element)
+
+class Payload(object):
+    """ Final content of a request: body & HTTP headers, see Request.build().
+
+        @param body: Serialized (maybe compressed) request, or <Stream>
+            if it contains <Base64File> values.
+        @param headers: HTTP headers, (name, value) pairs.
+
+        @type body: string/<Stream>
+        @type headers: tuple
     """
-    def __init__(self, bccSender=None, saveAsActivity=True,
-                 useSignature=True, emailPriority='Normal',
-                 replyTo=None, subject=None,
-                 templateId=None, senderDisplayName=None,
-                 bccAddresses=None, ccAddresses=None,
-                 charset=None, documentAttachments=None,
-                 fileAttachments=None, htmlBody=' ',
-                 plainTextBody=' ', targetObjectId=None,
-                 whatId=None):
-
-        Email.__init__(self, 'SingleEmailMessage',
-            bccSender, saveAsActivity,
-            useSignature, emailPriority,
-            replyTo, subject,
-            templateId, senderDisplayName
-        )
-        bccAddresses = ','.join(bccAddresses) \
-                       if bccAddresses else None
-        ccAddresses = ','.join(ccAddresses) \
-                      if ccAddresses else None
-        self.xml.extend((
-            Node('bccAddresses', bccAddresses).xml,
-            Node('ccAddresses', ccAddresses).xml,
-            Node('charset', charset).xml,
-            Node('htmlBody', htmlBody).xml,
-            Node('plainTextBody', plainTextBody).xml,
-            Node('targetObjectId', targetObjectId).xml,
-            Node('whatId', whatId).xml
-        ))
-        
-############################## XML Requests ##############################
+    __slots__ = ('body', 'headers')
+
+    def __init__(self, body, headers):
+        self.body = body
+        self.headers = headers
+
+
 class Request(object):
     """ Base class of all XML requests. Initialise the empty XML etree
         with action's body, body content is to be appended.
@@ -925,8 +1359,12 @@ class Request(object):
         self.xml = etree.parse(StringIO(__xml__))
         self.body = etree.Element(action)
         self.xml.getroot()[-1].append(self.body)
-        self.headers = deepcopy(header)
+        self.headers = dict(header)
+        self.payload = None
+        # serialized request the payload was built from.
+        self.source = None
         self.name = action
+        self.safe = action in safeActions
         self.response = '%sResponse' % action
         self.encoding = sfdc.encoding
         self.compressType = http.compresstype
@@ -934,6 +1372,73 @@ class Request(object):
         self.debug = sfdc.debug
 
 
+    def build(self):
+        """ Serialize (and compress unless debug) the request. The payload
+            is cached as long as the request is left as it is, so the same
+            request can be sent again (e.g. retried over another
+            connection) without being compressed again; changes to the
+            request, its body included, are picked up. Request headers are
+            left untouched.
+
+            @return: <Payload> instance.
+        """
+        data = self._serialize()
+        if self.payload is None or data != self.source:
+            self.payload = self._pack(data)
+            self.source = data
+        return self.payload
+
+
+    def _serialize(self):
+        return etree.tostring(
+            self.xml,
+            xml_declaration = True,
+            encoding = self.encoding
+        )
+
+
+    def _pack(self, data):
+        """ <Payload> of the serialized request. """
+        headers = dict(self.headers)
+        streams = self._streams()
+        if streams:
+            parts = re.split('(%s)' % '|'.join(streams), data)
+            parts[1::2] = [streams[token] for token in parts[1::2]]
+            if self.debug:
+                data = Stream(parts)
+                headers['Accept-Encoding'] = 'identity'
+                headers.pop('Content-Encoding', None)
+                headers['Content-Length'] = str(len(data))
+            else:
+                # compressed length is unknown until it's all sent.
+                data = Stream(parts, http.compresslevel)
+                headers['Accept-Encoding'] = self.compressType
+                headers['Content-Encoding'] = self.compressType
+                headers['Transfer-Encoding'] = 'chunked'
+            return Payload(data, tuple(sorted(headers.items())))
+        if self.debug:
+            headers['Accept-Encoding'] = 'identity'
+            headers.pop('Content-Encoding', None)
+        else:
+            data = self.compress(data)
+            headers['Accept-Encoding'] = self.compressType
+            headers['Content-Encoding'] = self.compressType
+        headers['Content-Length'] = str(len(data))
+        return Payload(data, tuple(sorted(headers.items())))
+
+
+    def _streams(self):
+        """ <Base64File> values in the request, by placeholder token. """
+        if not _streams:
+            return {}
+        streams = {}
+        for element in self.body.iter():
+            stream = _streams.get(element.text) if element.text else None
+            if stream is not None:
+                streams[stream.token] = stream
+        return streams
+
+
     def addSoapHeader(self, header, namespace=namespace.partner):
         """ Append a node to SOAP Header.
 
@@ -947,6 +1452,7 @@ class Request(object):
             @type namespace: string
         """
         self.xml.getroot()[0].append(header)
+        self.payload = None
 
 
     def setSoapHeader(self, header, node, namespace=namespace.partner):
@@ -962,9 +1468,14 @@ class Request(object):
             @type node: lxml.etree.Element
             @type namespace: string
         """
-        element = self.xml.find('//{%s}%s' % (namespace, header))
-        if element:
-            self.xml.replace(element, node)
+        headers = self.xml.getroot()[0]
+        # nodes are appended unqualified, inheriting the default namespace.
+        element = headers.find(header)
+        if element is None:
+            element = headers.find('{%s}%s' % (namespace, header))
+        if element is not None:
+            headers.replace(element, node)
+            self.payload = None
         else:
             self.addSoapHeader(node)
 
@@ -978,15 +1489,7 @@ class Request(object):
 
             @return: Compressed raw XML data in string format.
         """
-        buffer = StringIO()
-        zdata = GzipFile(
-            mode = 'wb',
-            fileobj = buffer,
-            compresslevel = http.compresslevel
-        )
-        zdata.write(data)
-        zdata.close()
-        return buffer.getvalue()
+        return ''.join(_gzip((data,), http.compresslevel))
 
 
     def decompress(self, data):
@@ -1013,23 +1516,15 @@ class Request(object):
 
 
     def __repr__(self):
-        """ Constructed XML message, used to request from server. """
-        data = etree.tostring(
-            self.xml,
-            xml_declaration = True,
-            encoding = self.encoding
-        )
-        if self.debug:
-            self.headers['Accept-Encoding'] = 'identity'
-            if self.headers.has_key('Content-Encoding'):
-                del self.headers['Content-Encoding']
+        """ Constructed XML message, as it is sent to the server; the
+            payload is not cached (see build()).
+        """
+        data = self._serialize()
+        if self.payload is not None and data == self.source:
+            body = self.payload.body
         else:
-            data = self.compress(data)
-            self.headers['Accept-Encoding'] = self.compressType
-            self.headers['Content-Encoding'] = self.compressType   
-
-        self.headers['Content-Length'] = len(data)
-        return data
+            body = self._pack(data).body
+        return body if isinstance(body, str) else ''.join(body)
 
 
 class AuthenticatedRequest(Request):
@@ -1048,6 +1543,7 @@ class AuthenticatedRequest(Request):
     """
     def __init__(self, sessionId, action):
         Request.__init__(self, action)
+        self.sessionId = sessionId
         sessionHeader = SessionHeader(sessionId).xml
         self.setSoapHeader('SessionHeader', sessionHeader)
 
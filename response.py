@@ -26,10 +26,156 @@ class Error(object):
     """ Map <lxml.objectify.ObjectifiedElement> instance to
         standard Python class. Also take care of the type conversion.
     """
-    def __init__(self, error):
-        self.statusCode = error.statusCode.text
-        self.message = error.message.text
-        self.fields = error.fields.text.split(',')
+    __slots__ = ('statusCode', 'message', 'fields')
+
+    def __init__(self, error=None):
+        if error is not None:
+            self.statusCode, self.message, fields = _error(error)
+            self.fields = list(fields)
+
+
+def _error(error):
+    """ (statusCode, message, fields) of an Error element. """
+    statusCode = message = None
+    fields = []
+    for child in error.iterchildren():
+        tag = child.tag.split('}')[-1]
+        if tag == 'statusCode':
+            statusCode = child.text
+        elif tag == 'message':
+            message = child.text
+        elif tag == 'fields' and child.text:
+            fields.extend(child.text.split(','))
+    return (statusCode, message, tuple(fields))
+
+
+class Result(object):
+    """ One record's result in <Results>, a view holding no data. """
+    __slots__ = ('results', 'index')
+
+    def __init__(self, results, index):
+        self.results = results
+        self.index = index
+
+
+    id = property(lambda self: self.results.ids[self.index])
+    success = property(lambda self: bool(self.results.success[self.index]))
+    created = property(lambda self: bool(self.results.created[self.index]))
+    errors = property(lambda self: self.results.errors(self.index))
+
+
+    def __repr__(self):
+        return '<Result %s %s>' % (
+            self.id,
+            'success' if self.success else 'failed'
+        )
+
+
+class Results(object):
+    """ Compact SaveResult/UpsertResult/DeleteResult/UndeleteResult array,
+        stored column by column: IDs, success & created flags, and the
+        errors of failed records only, turned into <Error> on access.
+        Results of several calls can be gathered with extend().
+
+        @param results: Result elements returned by create(), update(),
+            upsert(), delete() or undelete().
+
+        @type results: <lxml.objectify.ObjectifiedElement> array
+    """
+    __slots__ = ('ids', 'success', 'created', 'failures')
+
+    def __init__(self, results=()):
+        self.ids = []
+        self.success = bytearray()
+        self.created = bytearray()
+        # index: ((statusCode, message, fields), ...)
+        self.failures = {}
+        self.extend(results)
+
+
+    def add(self, result):
+        """ Append one result element. """
+        recordId = None
+        success = created = False
+        errors = []
+        for child in result.iterchildren():
+            tag = child.tag.split('}')[-1]
+            if tag == 'id':
+                recordId = child.text
+            elif tag == 'success':
+                success = child.text == 'true'
+            elif tag == 'created':
+                created = child.text == 'true'
+            elif tag == 'errors':
+                errors.append(_error(child))
+        if errors:
+            self.failures[len(self.ids)] = tuple(errors)
+        self.ids.append(recordId)
+        self.success.append(success)
+        self.created.append(created)
+
+
+    def extend(self, results):
+        """ Append result elements, or another <Results>. """
+        if isinstance(results, Results):
+            offset = len(self.ids)
+            for index, errors in results.failures.items():
+                self.failures[offset + index] = errors
+            self.ids.extend(results.ids)
+            self.success.extend(results.success)
+            self.created.extend(results.created)
+        else:
+            for result in results:
+                self.add(result)
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.ids)
+        if not 0 <= index < len(self.ids):
+            raise IndexError(index)
+        return Result(self, index)
+
+
+    def __iter__(self):
+        for index in xrange(len(self.ids)):
+            yield Result(self, index)
+
+
+    def errors(self, index):
+        """ <Error> list of the record at index. """
+        errors = []
+        for statusCode, message, fields in self.failures.get(index, ()):
+            error = Error()
+            error.statusCode, error.message, error.fields = \
+                statusCode, message, list(fields)
+            errors.append(error)
+        return errors
+
+
+    def failed(self):
+        """ Indices of failed records. """
+        return [index for index, success in enumerate(self.success)
+                if not success]
+
+
+    def succeeded(self):
+        """ IDs of records written successfully. """
+        return [recordId for recordId, success in
+                zip(self.ids, self.success) if success]
+
+
+    def errorCounts(self):
+        """ Number of errors by statusCode. """
+        counts = {}
+        for errors in self.failures.itervalues():
+            for error in errors:
+                counts[error[0]] = counts.get(error[0], 0) + 1
+        return counts
 
 
 class LoginResult(object):
@@ -49,3 +195,29 @@ class LoginResult(object):
         self.userInfo = object.__new__(self)
         self.userInfo.accessibility = loginResult.userInfo.accessibility
         
+
+
+def toDict(record):
+    """ Turn a sObject returned by query()/retrieve() into dictionary
+        of fieldname: text pairs, nil fields are turned into None.
+        Nested relationship records are skipped.
+
+        @param record: sObject record.
+
+        @type record: <lxml.objectify.ObjectifiedElement>
+
+        @return: dictionary
+    """
+    if isinstance(record, dict):
+        # parsed by a dictionary backend already, see parsers.py.
+        return dict((name, value) for name, value in record.items()
+                    if name != 'type' and not isinstance(value, dict))
+    fields = {}
+    for child in record.iterchildren():
+        name = child.tag.split('}')[-1]
+        if name == 'type' or child.getchildren():
+            continue
+        # partner WSDL returns Id twice, the second one might be blank.
+        if fields.get(name) is None:
+            fields[name] = child.text
+    return fields
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2008, 2009 Xigital Solutions
+#
+# Written by Jim Zhan <jim@xigital.com>
+#
+# This file is part of SFDC-Python Salesforce python accessor.
+#
+""" Session stores, sharing the login of a username between the
+    processes of a host (and across restarts), see
+    Client.useSessionStore().
+
+    A process starting up uses the stored session, without calling
+    login(). When the session expires, one process logs in again while
+    the others wait for the lock, then pick the new session up.
+
+    Usage:
+        store = FileSessionStore('/var/run/sfdc/sessions')
+        client = Client()
+        client.useSessionStore(store, username, password)
+
+    Other backends (memcached, a database...) subclass SessionStore and
+    implement load()/save()/lock().
+"""
+import os
+import json
+import time
+import fcntl
+import tempfile
+from contextlib import contextmanager
+from lxml import etree, objectify
+from error import UnimplementedError
+
+
+__author__ = 'Jim Zhan'
+__email__ = 'jim@xigital.com'
+
+
+class SessionStore(object):
+    """ Base class of session stores. Sessions are kept by username, as
+        the loginResult of the login() call that opened them.
+    """
+    def load(self, username):
+        """ Stored loginResult of the username, or None.
+
+            @return: <lxml.objectify.ObjectifiedElement> instance.
+        """
+        raise UnimplementedError
+
+
+    def save(self, username, loginResult):
+        """ Store the loginResult of the username, None to drop it. """
+        raise UnimplementedError
+
+
+    def lock(self, username):
+        """ Context manager, held by one process (and thread) at a time,
+            while the username logs in.
+        """
+        raise UnimplementedError
+
+
+    def login(self, client, username, password):
+        """ Make the client use the stored session of the username, or
+            log in & store the session if there is none.
+
+            @param client: Client to be set up.
+            @param username: Login username.
+            @param password: Login password (and security token).
+
+            @type client: <client.Client>
+            @type username: string
+            @type password: string
+
+            @return: loginResult used by the client.
+        """
+        loginResult = self.load(username)
+        if loginResult is None:
+            with self.lock(username):
+                # logged in by someone else while waiting.
+                loginResult = self.load(username)
+                if loginResult is None:
+                    loginResult = client.openSession(username, password)
+                    self.save(username, loginResult)
+        # threads of the client may have picked the new session up.
+        if client.sessionId != loginResult.sessionId.pyval:
+            client.useSession(loginResult)
+        return loginResult
+
+
+    def renew(self, client, username, password, sessionId):
+        """ Replace an expired session: log in again, unless another
+            process (or thread) did already.
+
+            @param sessionId: The expired session ID.
+
+            @type sessionId: string
+
+            @return: loginResult used by the client.
+        """
+        with self.lock(username):
+            loginResult = self.load(username)
+            if loginResult is None or \
+               loginResult.sessionId.pyval == sessionId:
+                loginResult = client.openSession(username, password)
+                self.save(username, loginResult)
+        # threads of the client may have picked the new session up.
+        if client.sessionId != loginResult.sessionId.pyval:
+            client.useSession(loginResult)
+        return loginResult
+
+
+class FileSessionStore(SessionStore):
+    """ Sessions kept in a local file, readable by the owner only. The
+        file is replaced as a whole so that readers need no lock; logins
+        are serialized with flock() on a companion .lock file.
+
+        @param path: Path of the session file.
+
+        @type path: string
+    """
+    def __init__(self, path):
+        self.path = path
+
+
+    def _read(self):
+        try:
+            source = open(self.path, 'rb')
+        except IOError:
+            return {}
+        try:
+            return json.load(source)
+        except ValueError:
+            # garbled, sessions are opened again.
+            return {}
+        finally:
+            source.close()
+
+
+    def load(self, username):
+        entry = self._read().get(username)
+        if entry is None:
+            return None
+        return objectify.fromstring(entry['loginResult'].encode('utf-8'))
+
+
+    def save(self, username, loginResult):
+        sessions = self._read()
+        if loginResult is None:
+            sessions.pop(username, None)
+        else:
+            sessions[username] = {
+                'loginResult': etree.tostring(loginResult),
+                'saved': time.time()
+            }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        descriptor, name = tempfile.mkstemp(dir=directory, prefix='.session')
+        try:
+            target = os.fdopen(descriptor, 'wb')
+            try:
+                json.dump(sessions, target)
+            finally:
+                target.close()
+            os.rename(name, self.path)
+        except:
+            os.remove(name)
+            raise
+
+
+    @contextmanager
+    def lock(self, username):
+        # one lock file for all the usernames, logins are rare.
+        descriptor = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0600)
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(descriptor)
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2008, 2009 Xigital Solutions
+#
+# Written by Jim Zhan <jim@xigital.com>
+#
+# This file is part of SFDC-Python Salesforce python accessor.
+#
+""" Helpers to build SOQL query strings. """
+import re
+from datetime import date, datetime
+from decimal import Decimal
+from codec import formatDate, formatDateTime
+
+
+__author__ = 'Jim Zhan'
+__email__ = 'jim@xigital.com'
+
+
+stringRegx = re.compile(r"('(?:[^'\\]|\\.)*')")
+fromRegx = re.compile(r'\bFROM\s+(\w+)', re.IGNORECASE)
+pathRegx = re.compile(r'\b(\w+)\.\w+')
+spaceRegx = re.compile(r'\s+')
+whereRegx = re.compile(r'\bWHERE\b', re.IGNORECASE)
+tailRegx = re.compile(
+    r'\b(ORDER\s+BY|GROUP\s+BY|HAVING|LIMIT|OFFSET|FOR|WITH|UPDATE)\b',
+    re.IGNORECASE
+)
+
+
+def literal(value):
+    """ Turn Python value into SOQL literal.
+
+        @param value: Value to be used in a WHERE clause.
+
+        @type value: None/boolean/number/date/datetime/string
+
+        @return: SOQL literal in string.
+    """
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, long, float, Decimal)):
+        return str(value)
+    if isinstance(value, datetime):
+        return formatDateTime(value)
+    if isinstance(value, date):
+        return formatDate(value)
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return "'%s'" % str(value).replace('\\', '\\\\').replace("'", "\\'")
+
+
+def select(sObjectType, fieldList, criteria=None):
+    """ Build a simple SELECT statement, criteria are ANDed equalities.
+
+        @param sObjectType: Object to query.
+        @param fieldList: Fields to be selected.
+        @param criteria: Dictionary of fieldname: value.
+
+        @type sObjectType: string
+        @type fieldList: string array
+        @type criteria: dictionary
+
+        @return: SOQL query string.
+    """
+    query = 'SELECT %s FROM %s' % (', '.join(fieldList), sObjectType)
+    if criteria:
+        query += ' WHERE %s' % ' AND '.join(
+            '%s = %s' % (key, literal(value))
+            for key, value in sorted(criteria.items())
+        )
+    return query
+
+
+def normalize(query):
+    """ Normalize a query string so that equivalent queries share the
+        same key: whitespace outside string literals is collapsed.
+
+        @param query: SOQL query string.
+
+        @type query: string
+
+        @return: Normalized query string.
+    """
+    parts = stringRegx.split(query.strip())
+    for index in xrange(0, len(parts), 2):
+        parts[index] = spaceRegx.sub(' ', parts[index])
+    return ''.join(parts)
+
+
+def sObjectTypes(query):
+    """ sObject types a query (might) read from, in lower case. Besides
+        objects after FROM, relationship names are included as well,
+        with their likely object names (Contacts -> contact,
+        Parent__r -> parent__c), so results err on the side of
+        including too many.
+
+        @param query: SOQL query string.
+
+        @type query: string
+
+        @return: Set of sObject types.
+    """
+    code = ' '.join(stringRegx.split(query)[::2])
+    names = fromRegx.findall(code) + pathRegx.findall(code)
+    types = set()
+    for name in names:
+        name = name.lower()
+        types.add(name)
+        if name.endswith('__r'):
+            types.add(name[:-3] + '__c')
+        elif name.endswith('s'):
+            types.add(name[:-1])
+    return types
+
+
+def mask(query):
+    """ Blank out string literals and parenthesized sub-clauses (with
+        spaces, so positions are kept), leaving top level clauses only.
+    """
+    chars = list(query)
+    depth = 0
+    quoted = escaped = False
+    for index, char in enumerate(chars):
+        if quoted:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == "'":
+                quoted = False
+            chars[index] = ' '
+        elif char == "'":
+            quoted = True
+            chars[index] = ' '
+        elif char == '(':
+            depth += 1
+            chars[index] = ' '
+        elif char == ')':
+            depth -= 1
+            chars[index] = ' '
+        elif depth:
+            chars[index] = ' '
+    return ''.join(chars)
+
+
+def sObjectType(query):
+    """ The sObject type a query selects from (top level FROM). """
+    match = fromRegx.search(mask(query))
+    return match.group(1) if match else None
+
+
+def shape(query):
+    """ Shape of a query: its normalized SELECT list & FROM clause, which
+        decide how wide the rows are whatever the conditions.
+    """
+    query = normalize(query)
+    masked = mask(query)
+    start = fromRegx.search(masked)
+    start = start.end() if start else 0
+    end = [match.start() for match in
+           (whereRegx.search(masked, start), tailRegx.search(masked, start))
+           if match is not None]
+    return query[:min(end)].rstrip() if end else query
+
+
+def clauses(query):
+    """ Top level clauses following WHERE, in upper case (ORDER BY, LIMIT ...). """
+    return [' '.join(item.upper().split())
+            for item in tailRegx.findall(mask(query))]
+
+
+def addCondition(query, condition):
+    """ AND a condition into the top level WHERE clause of a query.
+
+        @param query: SOQL query string.
+        @param condition: Condition to be added, e.g. "Id >= '001...'".
+
+        @type query: string
+        @type condition: string
+
+        @return: New query string.
+    """
+    masked = mask(query)
+    tail = tailRegx.search(masked, fromRegx.search(masked).end())
+    end = tail.start() if tail else len(query)
+    where = whereRegx.search(masked)
+    if where is None:
+        result = '%s WHERE %s %s' % (
+            query[:end].rstrip(), condition, query[end:]
+        )
+    else:
+        result = '%s (%s) AND %s %s' % (
+            query[:where.end()],
+            query[where.end():end].strip(),
+            condition,
+            query[end:]
+        )
+    return result.rstrip()
+
+
+if __name__ == '__main__':
+    pass
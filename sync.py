@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2008, 2009 Xigital Solutions
+#
+# Written by Jim Zhan <jim@xigital.com>
+#
+# This file is part of SFDC-Python Salesforce python accessor.
+#
+""" Incremental replication built on top of getUpdated() & getDeleted().
+
+    Usage:
+        engine = SyncEngine(
+            client,
+            FileWatermarkStore('/var/lib/sfdc/watermarks'),
+            MySink(),
+            {'Account': ['Id', 'Name'], 'Contact': ['Id', 'Email']}
+        )
+        engine.run(interval=300)
+"""
+import os
+import time
+from threading import Lock
+from datetime import timedelta
+from ConfigParser import ConfigParser
+from codec import formatDateTime, parseDateTime
+from error import ReplicationExpired, UnimplementedError
+from util import chunk, parallel
+
+
+__author__ = 'Jim Zhan'
+__email__ = 'jim@xigital.com'
+
+
+# getUpdated()/getDeleted() accept 30 days at most, and ignore seconds.
+MAX_SPAN = timedelta(days=30)
+MIN_SPAN = timedelta(minutes=1)
+# retrieve() accepts 2000 IDs at most.
+RETRIEVE_LIMIT = 2000
+
+
+def _result(response):
+    """ getUpdated()/getDeleted() are resolved as list by Client. """
+    if isinstance(response, (tuple, list)):
+        return response[0]
+    return response
+
+
+def _values(element, tag):
+    """ All children of element named as tag (might be none at all). """
+    children = getattr(element, tag, None)
+    return [] if children is None else list(children)
+
+
+############################## Watermarks ##############################
+class WatermarkStore(object):
+    """ In-memory watermark store, keeps the latest date (UTC) covered
+        by the replication of each sObject type.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.watermarks = {}
+
+
+    def get(self, sObjectType):
+        """ Returns the watermark of given sObject type, or None. """
+        return self.watermarks.get(sObjectType)
+
+
+    def set(self, sObjectType, value):
+        """ Record the watermark of given sObject type.
+
+            @param sObjectType: sObject type.
+            @param value: Latest date covered, in UTC.
+
+            @type sObjectType: string
+            @type value: datetime
+        """
+        self.lock.acquire()
+        try:
+            self.watermarks[sObjectType] = value
+            self.save()
+        finally:
+            self.lock.release()
+
+
+    def save(self):
+        """ Persist watermarks, nothing to do for memory store. """
+
+
+class FileWatermarkStore(WatermarkStore):
+    """ Watermark store persisted into an INI file, which is replaced
+        atomically on each update so that a crash never leaves a
+        half-written file behind.
+
+        @param path: Path of the watermarks file.
+
+        @type path: string
+    """
+    section = 'watermarks'
+
+    def __init__(self, path):
+        WatermarkStore.__init__(self)
+        self.path = path
+        parser = ConfigParser()
+        parser.optionxform = str
+        parser.read(path)
+        if parser.has_section(self.section):
+            for key, value in parser.items(self.section):
+                self.watermarks[key] = parseDateTime(value)
+
+
+    def save(self):
+        parser = ConfigParser()
+        parser.optionxform = str
+        parser.add_section(self.section)
+        for key, value in sorted(self.watermarks.items()):
+            parser.set(self.section, key, formatDateTime(value))
+        temp = '%s.tmp' % self.path
+        stream = open(temp, 'w')
+        try:
+            parser.write(stream)
+            stream.flush()
+            os.fsync(stream.fileno())
+        finally:
+            stream.close()
+        os.rename(temp, self.path)
+
+
+############################## Sinks ##############################
+class Sink(object):
+    """ Destination of replicated changes, must be inherited. """
+    def upsert(self, sObjectType, records):
+        """ Receive records created or updated since the last sync.
+
+            @param sObjectType: sObject type.
+            @param records: sObjects returned by retrieve().
+
+            @type sObjectType: string
+            @type records: <lxml.objectify.ObjectifiedElement> array
+        """
+        raise UnimplementedError
+
+
+    def delete(self, sObjectType, ids):
+        """ Receive IDs of records deleted since the last sync.
+
+            @param sObjectType: sObject type.
+            @param ids: IDs of deleted records.
+
+            @type sObjectType: string
+            @type ids: SFDC ID array
+        """
+        raise UnimplementedError
+
+
+    def expired(self, sObjectType, watermark, earliestDateAvailable):
+        """ Called when deleted records older than the watermark have
+            been purged, so the sink has to be fully reloaded.
+
+            @raise ReplicationExpired: By default.
+        """
+        raise ReplicationExpired(
+            'INVALID_REPLICATION_DATE',
+            '%s watermark %s is earlier than %s' % (
+                sObjectType,
+                formatDateTime(watermark),
+                formatDateTime(earliestDateAvailable)
+            )
+        )
+
+
+############################## Engine ##############################
+class SyncEngine(object):
+    """ Replicates changes of the configured sObject types into a sink.
+
+        @param client: Logged in client.
+        @param store: Where watermarks are kept.
+        @param sink: Where changes go.
+        @param fieldLists: Fields to retrieve for each sObject type.
+        @param span: Maximum timespan of each getUpdated()/getDeleted().
+        @param workers: Number of concurrent retrieve() calls.
+
+        @type client: <client.Client>
+        @type store: <WatermarkStore>
+        @type sink: <Sink>
+        @type fieldLists: dictionary
+        @type span: timedelta
+        @type workers: integer
+    """
+    def __init__(self, client, store, sink, fieldLists,
+                 span=MAX_SPAN, workers=4):
+        self.client = client
+        self.store = store
+        self.sink = sink
+        self.fieldLists = fieldLists
+        self.span = min(span, MAX_SPAN)
+        self.workers = workers
+
+
+    def sync(self, sObjectType, endDate=None):
+        """ Replicate changes of one sObject type from its watermark up
+            to endDate. The first sync of a type only records the
+            watermark, initial loading is up to the caller.
+
+            @param sObjectType: sObject type.
+            @param endDate: Replicate up to this date (UTC), default is
+                the current server timestamp.
+
+            @type sObjectType: string
+            @type endDate: datetime
+
+            @return: Tuple of (number of upserted, number of deleted).
+        """
+        if endDate is None:
+            endDate = self.client.getServerTimestamp()
+        startDate = self.store.get(sObjectType)
+        if startDate is None:
+            self.store.set(sObjectType, endDate)
+            return (0, 0)
+
+        upserted = deleted = 0
+        while endDate - startDate >= MIN_SPAN:
+            windowEnd = min(startDate + self.span, endDate)
+            updates = _result(
+                self.client.getUpdated(sObjectType, startDate, windowEnd)
+            )
+            deletes = _result(
+                self.client.getDeleted(sObjectType, startDate, windowEnd)
+            )
+            earliest = getattr(deletes, 'earliestDateAvailable', None)
+            if earliest is not None and earliest.text:
+                earliest = parseDateTime(earliest.text)
+                if earliest > startDate:
+                    self.sink.expired(sObjectType, startDate, earliest)
+                    # the sink might have reloaded & moved the watermark.
+                    startDate = max(self.store.get(sObjectType), earliest)
+                    self.store.set(sObjectType, startDate)
+                    continue
+
+            ids = [item.text for item in _values(updates, 'ids')]
+            if ids:
+                upserted += self.hydrate(sObjectType, ids)
+            removed = [item.id.text for item in _values(deletes, 'deletedRecords')]
+            if removed:
+                self.sink.delete(sObjectType, removed)
+                deleted += len(removed)
+
+            covered = min(
+                parseDateTime(updates.latestDateCovered.text),
+                parseDateTime(deletes.latestDateCovered.text)
+            )
+            if covered <= startDate:
+                # some process within the window is not completed yet.
+                break
+            startDate = covered
+            self.store.set(sObjectType, startDate)
+        return (upserted, deleted)
+
+
+    def hydrate(self, sObjectType, ids):
+        """ Retrieve changed records in batches (concurrently) and hand
+            them to the sink.
+
+            @return: Number of records handed to the sink.
+        """
+        fieldList = self.fieldLists[sObjectType]
+
+        def retrieve(batch):
+            records = self.client.retrieve(fieldList, sObjectType, batch)
+            return [record for record in records
+                    if record is not None and record.getchildren()]
+
+        batches = parallel(
+            retrieve,
+            chunk(ids, RETRIEVE_LIMIT),
+            workers = self.workers
+        )
+        count = 0
+        for records in batches:
+            if records:
+                self.sink.upsert(sObjectType, records)
+                count += len(records)
+        return count
+
+
+    def syncAll(self):
+        """ Sync all configured sObject types once.
+
+            @return: Dictionary of sObject type: (upserted, deleted).
+        """
+        endDate = self.client.getServerTimestamp()
+        return dict(
+            (sObjectType, self.sync(sObjectType, endDate))
+            for sObjectType in self.fieldLists
+        )
+
+
+    def run(self, interval=300, rounds=None):
+        """ Poll for changes every interval seconds.
+
+            @param interval: Seconds between two polls.
+            @param rounds: Stop after this many polls, run forever if None.
+
+            @type interval: integer
+            @type rounds: integer
+        """
+        count = 0
+        while rounds is None or count < rounds:
+            self.syncAll()
+            count += 1
+            if rounds is None or count < rounds:
+                time.sleep(interval)
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+""" Server side stand-ins shared by the tests: SOAP envelopes, HTTP
+    responses and connections answering a Client without network.
+    Imported once the path of the package is set up.
+"""
+import re
+from StringIO import StringIO
+from request import Request
+
+
+ENVELOPE = '''<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
+ xmlns="urn:partner.soap.sforce.com" xmlns:sf="urn:sobject.partner.soap.sforce.com"
+ xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<soapenv:Body>%s</soapenv:Body></soapenv:Envelope>'''
+
+FAULT = ENVELOPE % '''<soapenv:Fault><faultcode>sf:INVALID_SESSION_ID</faultcode>
+<faultstring>INVALID_SESSION_ID: Invalid Session ID</faultstring></soapenv:Fault>'''
+
+
+def envelope(action, result):
+    """ Response envelope of an action, result is the XML it returns. """
+    return ENVELOPE % ('<%sResponse>%s</%sResponse>' % (action, result, action))
+
+
+class Response(StringIO):
+    """ HTTP response of given content, gzipped if compressed. """
+    def __init__(self, data, compressed=False):
+        if compressed:
+            data = Request('query').compress(data)
+        StringIO.__init__(self, data)
+        self.encoding = 'gzip' if compressed else None
+
+    def getheader(self, name, default=None):
+        if name == 'Content-Encoding' and self.encoding:
+            return self.encoding
+        return default
+
+
+class Connection(object):
+    """ Connection of a Client, keeps the (uncompressed) bodies & actions
+        of the requests sent, and answers them through answer().
+    """
+    path = '/services/Soap/u/15.0'
+
+    def __init__(self):
+        self.bodies = []
+        self.calls = []
+
+    def send(self, method, body, headers, safe=False, stream=False):
+        if dict(headers).get('Content-Encoding') == 'gzip':
+            body = Request('query').decompress(body)
+        action = re.search(r'<soap:Body><(\w+)', body).group(1)
+        self.bodies.append(body)
+        self.calls.append(action)
+        response = self.answer(action, body)
+        if isinstance(response, basestring):
+            response = Response(response)
+        return response
+
+    def answer(self, action, body):
+        """ Response (or its content) to a request. """
+        raise NotImplementedError
+
+
+class PageConnection(Connection):
+    """ Answers requests with given responses (or contents), in order. """
+    def __init__(self, pages):
+        Connection.__init__(self)
+        self.pages = pages
+
+    def answer(self, action, body):
+        return self.pages.pop(0)
+
+
+class CannedConnection(Connection):
+    """ Answers each action with its result, formatted with values. """
+    def __init__(self, results, **values):
+        Connection.__init__(self)
+        self.results = results
+        self.values = values
+
+    def answer(self, action, body):
+        return envelope(action, self.results[action] % self.values)
+
+
+class RenewingStore(object):
+    """ Session store renewing expired sessions as S2, S3... """
+    def __init__(self):
+        self.renewed = []
+
+    def renew(self, client, username, password, sessionId):
+        self.renewed.append(sessionId)
+        client.sessionId = 'S%d' % (len(self.renewed) + 1)
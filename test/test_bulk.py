@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+from sys import path
+from os.path import abspath, dirname, join
+path.insert(0, abspath(join(dirname(__file__), '..')))
+import time
+from threading import Lock
+from StringIO import StringIO
+from unittest import TestCase, main
+from lxml import objectify
+from bulk import BulkWriter, _Pending, _codes, collapse, mergeFields
+from client import Client
+from error import SFDCError
+from request import Base64File, FieldTable, SObject, TrackedSObject
+from tuning import BatchController
+
+
+ID = '{urn:sobject.partner.soap.sforce.com}Id'
+
+RESULT = '''<result xmlns="urn:partner.soap.sforce.com"><id>%s</id>
+<success>true</success></result>'''
+
+LOCKED = '''<result xmlns="urn:partner.soap.sforce.com"><errors>
+<message>unable to obtain exclusive access to this record</message>
+<statusCode>UNABLE_TO_LOCK_ROW</statusCode></errors><id/>
+<success>false</success></result>'''
+
+
+class BulkClient(Client):
+    """ Rejects records of batches larger than limit on lock contention,
+        or fails the whole batch if timeout is set.
+    """
+    lock = Lock()
+    calls = []
+    limit = 50
+    timeout = False
+    fault = None
+
+    def update(self, sObjects):
+        self.lock.acquire()
+        try:
+            self.calls.append(len(sObjects))
+        finally:
+            self.lock.release()
+        if self.fault is not None:
+            raise SFDCError(self.fault, 'Failed')
+        if len(sObjects) > self.limit:
+            if self.timeout:
+                raise SFDCError('REQUEST_RUNNING_TOO_LONG', 'Too long')
+            return [objectify.fromstring(LOCKED) for sObject in sObjects]
+        return [objectify.fromstring(RESULT % sObject.xml.findtext(ID))
+                for sObject in sObjects]
+
+
+class GroupClient(Client):
+    """ Counts batches writing children of the same parent at once. """
+    lock = Lock()
+    active = set()
+    batches = []
+    overlaps = 0
+
+    def update(self, sObjects):
+        parents = set(sObject.get('AccountId') for sObject in sObjects)
+        self.lock.acquire()
+        try:
+            GroupClient.overlaps += len(parents & self.active)
+            self.active.update(parents)
+            self.batches.append(parents)
+        finally:
+            self.lock.release()
+        time.sleep(0.002)
+        self.lock.acquire()
+        try:
+            self.active.difference_update(parents)
+        finally:
+            self.lock.release()
+        return [objectify.fromstring(RESULT % sObject.get('Id'))
+                for sObject in sObjects]
+
+
+class UpsertClient(Client):
+    """ Fails batches holding an external ID twice, or already sent. """
+    lock = Lock()
+    seen = set()
+
+    def upsert(self, externalIDFieldName, sObjects):
+        values = [sObject.get(externalIDFieldName) for sObject in sObjects]
+        self.lock.acquire()
+        try:
+            if len(set(values)) != len(values) or self.seen & set(values):
+                raise SFDCError('DUPLICATE_VALUE', 'Duplicate')
+            self.seen.update(values)
+        finally:
+            self.lock.release()
+        return [objectify.fromstring(RESULT % sObject.get('LastName'))
+                for sObject in sObjects]
+
+    def send(self, request, forList=False):
+        return [repr(request)]
+
+
+class TestBatchController(TestCase):
+    def testGrowth(self):
+        controller = BatchController(batchSize=180, concurrency=1)
+        controller.succeeded(1)
+        controller.succeeded(1)
+        self.assertEqual(controller.batchSize, 200)
+        controller.succeeded(1)
+        self.assertEqual(controller.concurrency, 2)
+        # slow calls do not grow.
+        controller.succeeded(60)
+        controller.succeeded(60)
+        self.assertEqual(controller.concurrency, 2)
+
+    def testBackOff(self):
+        controller = BatchController(concurrency=4)
+        controller.contended(0)
+        self.assertEqual((controller.batchSize, controller.concurrency),
+                         (100, 2))
+        # a call started before the decrease does not count.
+        controller.contended(0)
+        self.assertEqual(controller.batchSize, 100)
+
+
+class TestBulkWriter(TestCase):
+    def setUp(self):
+        del BulkClient.calls[:]
+        BulkClient.timeout = False
+        BulkClient.fault = None
+        self.records = [SObject('Contact', Id='003%012d' % i, Title='CEO')
+                        for i in xrange(400)]
+
+    def testLockContention(self):
+        writer = BulkWriter(BulkClient())
+        results = writer.update(self.records)
+        self.assertTrue(all(writer.succeeded(result) for result in results))
+        self.assertEqual(results[7].id.text, '003%012d' % 7)
+        controller = writer.controller(('update', 'Contact'))
+        self.assertTrue(controller.batchSize < 100)
+        # contention is remembered for the next call.
+        del BulkClient.calls[:]
+        writer.update(self.records)
+        self.assertTrue(max(BulkClient.calls) < 100)
+
+    def testTimeout(self):
+        BulkClient.timeout = True
+        writer = BulkWriter(BulkClient())
+        results = writer.update(self.records)
+        self.assertEqual([result.id.text for result in results],
+                         ['003%012d' % i for i in xrange(400)])
+
+    def testRetriesExhausted(self):
+        writer = BulkWriter(BulkClient(), retries=0)
+        results = writer.update(self.records)
+        self.assertFalse(writer.succeeded(results[0]))
+
+    def testFault(self):
+        BulkClient.fault = 'INVALID_FIELD'
+        writer = BulkWriter(BulkClient())
+        self.assertRaises(SFDCError, writer.update, self.records)
+
+    def testContentionCodes(self):
+        self.assertEqual(_codes('UNABLE_TO_LOCK_ROW'),
+                         frozenset(['UNABLE_TO_LOCK_ROW']))
+        self.assertRaises(KeyError, _codes, 'UNABLE_TO_LOCK_ROWS')
+
+
+class TestGrouping(TestCase):
+    def testPending(self):
+        pending = _Pending(['a', 'b', 'a', None, 'c', 'c', 'c'])
+        self.assertEqual(pending.take(3), [(0, 0), (2, 0), (1, 0)])
+        # c does not fit, None does.
+        self.assertEqual(pending.take(2), [(3, 0)])
+        self.assertEqual(pending.take(2), [(4, 0), (5, 0)])
+        # rest of c waits for its running batch.
+        self.assertEqual(pending.take(2), [])
+        pending.done([(4, 0), (5, 0)], [(5, 1)])
+        self.assertEqual(pending.take(5), [(6, 0), (5, 1)])
+        self.assertEqual(len(pending), 0)
+
+    def testParentsNotShared(self):
+        GroupClient.overlaps = 0
+        del GroupClient.batches[:]
+        records = [SObject('Contact', Id='003%012d' % i,
+                           AccountId='001%012d' % (i % 40))
+                   for i in xrange(800)]
+        writer = BulkWriter(GroupClient(), controller=lambda:
+                            BatchController(concurrency=8))
+        results = writer.update(records, groupBy='AccountId')
+        self.assertEqual(len(results), 800)
+        self.assertEqual(GroupClient.overlaps, 0)
+        # 20 children by parent, 10 parents by batch.
+        self.assertEqual(len(GroupClient.batches), 4)
+
+
+class TestUpsert(TestCase):
+    def setUp(self):
+        UpsertClient.seen.clear()
+
+    def testCollapse(self):
+        records = [SObject('Contact', Email__c=email, LastName=name)
+                   for email, name in (('a', 'A1'), ('b', 'B'), ('a', 'A2'))]
+        records.append(SObject('Contact', LastName='C'))
+        unique, positions = collapse(records, 'Email__c')
+        self.assertEqual([item.get('LastName') for item in unique],
+                         ['A2', 'B', 'C'])
+        self.assertEqual(positions, [0, 1, 0, 2])
+
+    def testCollapseIgnoresCase(self):
+        records = [SObject('Contact', Email__c=email)
+                   for email in ('jim@xigital.com', 'Jim@Xigital.com')]
+        unique, positions = collapse(records, 'Email__c')
+        self.assertEqual(positions, [0, 0])
+        unique, positions = collapse(records, 'Email__c', caseSensitive=True)
+        self.assertEqual(positions, [0, 1])
+
+    def testMergeFields(self):
+        first = SObject('Contact', Email__c='a', LastName='A', Title='CEO')
+        merged = mergeFields(
+            first, SObject('Contact', Email__c='a', LastName='B')
+        )
+        self.assertEqual((merged.get('LastName'), merged.get('Title')),
+                         ('B', 'CEO'))
+        self.assertEqual(first.get('LastName'), 'A')
+        body = Base64File(StringIO('data'))
+        merged = mergeFields(SObject('Attachment', Name='a'),
+                             SObject('Attachment', Body=body))
+        self.assertEqual(merged.files, [body])
+
+    def testMergeTracked(self):
+        first = TrackedSObject('Contact', ('Email__c',), Email__c='a',
+                               LastName='A', Title='CEO', Fax='1')
+        first['Title'] = 'CTO'
+        second = TrackedSObject('Contact', ('Email__c',), Email__c='a',
+                                LastName='A')
+        second['LastName'] = 'B'
+        merged = mergeFields(first, second)
+        self.assertTrue(isinstance(merged, TrackedSObject))
+        self.assertEqual(merged.changes(), (
+            {'Email__c': 'a', 'LastName': 'B', 'Title': 'CTO'}, []
+        ))
+        # the records merged are left alone.
+        self.assertEqual(first.changes(),
+                         ({'Email__c': 'a', 'Title': 'CTO'}, []))
+
+    def testMergeMixed(self):
+        self.assertRaises(ValueError, mergeFields,
+                          SObject('Contact', LastName='A'),
+                          TrackedSObject('Contact', LastName='B'))
+        self.assertRaises(ValueError, mergeFields,
+                          SObject('Contact', LastName='A'),
+                          SObject('Lead', LastName='B'))
+
+    def testMergeCompact(self):
+        table = FieldTable('Contact')
+        merged = mergeFields(
+            table.record(Email__c='a', LastName='A', Title='CEO'),
+            table.record(Email__c='a', LastName='B', Phone='1')
+        )
+        self.assertEqual(
+            [merged.get(field) for field in ('LastName', 'Title', 'Phone')],
+            ['B', 'CEO', '1']
+        )
+
+    def testMergeCompactTables(self):
+        first = FieldTable('Contact', ['LastName', 'Title'])
+        second = FieldTable('Contact', ['Phone', 'LastName'])
+        merged = mergeFields(first.record(LastName='A', Title='CEO'),
+                             second.record(Phone='1', LastName='B'))
+        self.assertTrue(merged.table is first)
+        self.assertEqual(
+            [merged.get(field) for field in ('LastName', 'Title', 'Phone')],
+            ['B', 'CEO', '1']
+        )
+
+    def testDuplicatesMerged(self):
+        records = [SObject('Contact', Email__c='%d@x.com' % (i % 300),
+                           LastName='Zhan %d' % i) for i in xrange(900)]
+        writer = BulkWriter(UpsertClient(), controller=lambda:
+                            BatchController(batchSize=50, concurrency=4))
+        results = writer.upsert('Email__c', records)
+        self.assertEqual(len(UpsertClient.seen), 300)
+        # last one wins, shared by duplicates.
+        self.assertEqual(results[5].id.text, 'Zhan 605')
+        self.assertTrue(results[5] is results[305])
+
+    def testExternalIDFieldName(self):
+        client = UpsertClient()
+        body = Client.upsert(client, 'Email__c', [SObject('Contact')])[0]
+        self.assertTrue('<externalIDFieldName>Email__c</' in body)
+
+
+if __name__ == '__main__':
+    main()
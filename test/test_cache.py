@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from sys import path
+from os.path import abspath, dirname, join
+path.insert(0, abspath(join(dirname(__file__), '..')))
+from unittest import TestCase, main
+from lxml import objectify
+from cache import QueryCache
+from client import Client
+from request import SObject
+
+
+QUERY = '''<result xmlns:sf="urn:sobject.partner.soap.sforce.com">
+<done>true</done><queryLocator/>
+<records><sf:type>Account</sf:type><sf:Id>001A</sf:Id><sf:Id>001A</sf:Id></records>
+<size>1</size></result>'''
+
+
+class TestQueryCache(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.client.useCache(QueryCache(ttl=60, maxSize=2))
+        self.sent = []
+
+        def send(request, forList=False):
+            self.sent.append(request.name)
+            if request.name == 'query':
+                return [objectify.fromstring(QUERY)]
+            return []
+        self.client.send = send
+
+    def testHit(self):
+        self.client.query('SELECT Id FROM Account')
+        self.client.query('SELECT  Id\n FROM Account')
+        self.assertEqual(self.sent, ['query'])
+        self.client.query('SELECT Id FROM Account', batchSize=200)
+        self.assertEqual(self.sent, ['query', 'query'])
+
+    def testInvalidateOnDML(self):
+        self.client.query('SELECT Id FROM Account')
+        self.client.update(SObject('Contact', Id='003A'))
+        self.client.query('SELECT Id FROM Account')
+        self.assertEqual(self.sent, ['query', 'update'])
+        self.client.update(SObject('Account', Id='001A'))
+        self.client.query('SELECT Id FROM Account')
+        self.assertEqual(self.sent, ['query', 'update', 'update', 'query'])
+
+    def testInvalidateById(self):
+        self.client.queryRecords('SELECT Id FROM Account')
+        self.client.delete('001B')
+        self.client.queryRecords('SELECT Id FROM Account')
+        self.assertEqual(self.sent, ['query', 'delete', 'query'])
+
+    def testInvalidatedInFlight(self):
+        send = self.client.send
+
+        def update(request, forList=False):
+            # an update lands while the query runs.
+            self.client.cache.invalidate(['Account'])
+            return send(request, forList)
+        self.client.send = update
+        self.client.query('SELECT Id FROM Account')
+        self.client.send = send
+        self.client.query('SELECT Id FROM Account')
+        self.assertEqual(self.sent, ['query', 'query'])
+
+    def testCopies(self):
+        records = self.client.queryRecords('SELECT Id FROM Account')
+        records[0].Name = 'Changed'
+        del records[:]
+        records = self.client.queryRecords('SELECT Id FROM Account')
+        self.assertEqual(len(records), 1)
+        self.assertFalse(hasattr(records[0], 'Name'))
+        self.assertEqual(self.sent, ['query'])
+
+    def testEviction(self):
+        cache = self.client.cache
+        for name in ('Account', 'Contact', 'Lead'):
+            self.client.query('SELECT Id FROM %s' % name)
+        self.assertEqual(len(cache.entries), 2)
+        self.assertEqual(cache.get(cache.key('SELECT Id FROM Account', 500)), None)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,19 @@
 from sys import path
 from os.path import abspath, dirname, join
 path.insert(0, abspath(join(dirname(__file__), '..')))
+import re
+import time
+import zlib
+from threading import Lock, Thread
 from unittest import TestCase, main
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from lxml import objectify
 from config import sfdc
 from client import Client
+from request import SingleEmailMessage
+from response import toDict
+from support import envelope
 
 
 class TestClient(TestCase):
@@ -103,4 +113,125 @@ class TestClient(TestCase):
         pass
     
     def setPassword(self):
-        pass
\ No newline at end of file
+        pass
+
+
+class EmailClient(Client):
+    """ Answers sendEmail() with the toAddresses of each message. """
+    calls = []
+    lock = Lock()
+
+    def send(self, request, forList=False):
+        time.sleep(0.01)
+        self.lock.acquire()
+        try:
+            self.calls.append(len(request.body))
+        finally:
+            self.lock.release()
+        return [message.findtext('toAddresses') for message in request.body]
+
+
+class TestSendEmail(TestCase):
+    def setUp(self):
+        del EmailClient.calls[:]
+        self.client = EmailClient()
+
+    def testBatched(self):
+        messages = [SingleEmailMessage(toAddresses=['%d@x.com' % i],
+                                       subject='Hi', plainTextBody='Hello')
+                    for i in xrange(25)]
+        cloned = []
+        self.client.clone = lambda: cloned.append(1)
+        results = self.client.sendEmail(messages)
+        self.assertEqual(results, ['%d@x.com' % i for i in xrange(25)])
+        self.assertEqual(sorted(EmailClient.calls), [5, 10, 10])
+        # calls share the client.
+        self.assertEqual(cloned, [])
+
+    def testSingle(self):
+        message = SingleEmailMessage(toAddresses='a@x.com')
+        self.assertEqual(self.client.sendEmail(message), 'a@x.com')
+
+
+RESULT = '''<result xsi:type="QueryResult">
+<done>true</done><queryLocator xsi:nil="true"/>
+<records xsi:type="sf:sObject"><sf:type>Account</sf:type><sf:Id>001A</sf:Id>
+<sf:Name>%s</sf:Name><sf:Description>%s</sf:Description></records>
+<size>1</size></result>'''
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    """ Answers query() with a record named after the queryString,
+        described with the sessionId of the request.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        name = re.search(r'<queryString>([^<]*)</', data).group(1)
+        session = re.search(r'<sessionId>([^<]*)</', data).group(1)
+        # slow enough for calls to overlap.
+        time.sleep(0.005)
+        content = envelope('query', RESULT % (name, session))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestThreadSafety(TestCase):
+    def setUp(self):
+        self.server = ThreadingServer(('127.0.0.1', 0), EchoHandler)
+        thread = Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        url = 'http://127.0.0.1:%d/services/Soap/u/15.0' % \
+            self.server.server_address[1]
+        self.client = Client()
+        self.client.useSession(objectify.fromstring(
+            '<result><serverUrl>%s</serverUrl>'
+            '<sessionId>SESSION</sessionId></result>' % url
+        ))
+
+    def tearDown(self):
+        self.client.connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testSharedClient(self):
+        errors = []
+
+        def run(worker):
+            try:
+                for i in xrange(20):
+                    name = 'w%d-%d' % (worker, i)
+                    record = toDict(self.client.query(name)[0].records)
+                    if record['Name'] != name or \
+                       record['Description'] != 'SESSION':
+                        errors.append((name, record['Name']))
+            except Exception, e:
+                errors.append(e)
+
+        threads = [Thread(target=run, args=(worker,)) for worker in xrange(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        pool = self.client.connection
+        self.assertTrue(1 < pool.created <= pool.maxConnections)
+        self.assertEqual(len(pool.idle), pool.created)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from sys import path
+from os.path import abspath, dirname, join
+path.insert(0, abspath(join(dirname(__file__), '..')))
+from threading import Lock
+from unittest import TestCase, main
+from lxml import objectify
+from coalesce import RetrieveLoader
+from util import parallel
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.calls = []
+
+    def clone(self):
+        return self
+
+    def retrieve(self, fieldList, sObjectType, ids):
+        self.lock.acquire()
+        self.calls.append(list(ids))
+        self.lock.release()
+        return [objectify.fromstring('<records><Id>%s</Id></records>' % item)
+                for item in ids]
+
+
+class TestRetrieveLoader(TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+
+    def testCoalesce(self):
+        loader = RetrieveLoader(self.client, window=0.05)
+        ids = ['001%03d' % (i % 10) for i in xrange(40)]
+        records = parallel(
+            lambda item: loader.load('Account', ['Id'], item, timeout=5),
+            ids,
+            workers = 40
+        )
+        self.assertEqual([record.Id.text for record in records], ids)
+        self.assertEqual(len(self.client.calls), 1)
+        self.assertEqual(sorted(self.client.calls[0]), sorted(set(ids)))
+
+    def testMaxBatch(self):
+        loader = RetrieveLoader(self.client, window=10, maxBatch=3)
+        records = loader.loadMany('Account', ['Id'], ['1', '2', '3'], timeout=5)
+        self.assertEqual(len(records), 3)
+        self.assertEqual(self.client.calls, [['1', '2', '3']])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from sys import path
+from os.path import abspath, dirname, join
+path.insert(0, abspath(join(dirname(__file__), '..')))
+from datetime import date, datetime, timedelta, tzinfo
+from unittest import TestCase, main
+import codec
+
+
+class FixedOffset(tzinfo):
+    def __init__(self, minutes):
+        self.offset = timedelta(minutes=minutes)
+
+    def utcoffset(self, dt):
+        return self.offset
+
+    def dst(self, dt):
+        return timedelta(0)
+
+
+class TestCodec(TestCase):
+    def setUp(self):
+        codec.clearCache()
+
+    def testParseDateTime(self):
+        self.assertEqual(
+            codec.parseDateTime('2009-02-25T10:35:13.959Z'),
+            datetime(2009, 2, 25, 10, 35, 13, 959000)
+        )
+
+    def testParseDateTimeWithoutFraction(self):
+        self.assertEqual(
+            codec.parseDateTime('2009-02-25T10:35:13Z'),
+            datetime(2009, 2, 25, 10, 35, 13)
+        )
+
+    def testParseDateTimeWithOffset(self):
+        self.assertEqual(
+            codec.parseDateTime('2009-02-25T10:35:13.000+08:00'),
+            datetime(2009, 2, 25, 2, 35, 13)
+        )
+
+    def testParseInvalid(self):
+        self.assertRaises(ValueError, codec.parseDateTime, '2009-02-25 10:35')
+        self.assertRaises(ValueError, codec.parseDate, '25/02/2009')
+
+    def testParseDate(self):
+        self.assertEqual(codec.parseDate('2009-02-25'), date(2009, 2, 25))
+        self.assertEqual(codec.parseDate(None), None)
+
+    def testFormatDateTime(self):
+        self.assertEqual(
+            codec.formatDateTime(datetime(2009, 2, 25, 10, 35, 13, 959000)),
+            '2009-02-25T10:35:13.959Z'
+        )
+        aware = datetime(2009, 2, 25, 18, 35, 13, tzinfo=FixedOffset(480))
+        self.assertEqual(codec.formatDateTime(aware), '2009-02-25T10:35:13.000Z')
+
+    def testColumns(self):
+        column = ['2009-02-25T10:35:13.000Z', None, '2009-02-25T10:35:13.000Z']
+        values = codec.parseColumn(column)
+        self.assertEqual(values[1], None)
+        self.assertEqual(values[0], values[2])
+        self.assertEqual(
+            codec.formatColumn(values + [date(2009, 2, 25)]),
+            column + ['2009-02-25']
+        )
+
+
+if __name__ == '__main__':
+    main()
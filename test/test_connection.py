@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from sys import path
+from os.path import abspath, dirname, join
+path.insert(0, abspath(join(dirname(__file__), '..')))
+import time
+from threading import Thread
+from httplib import HTTPException
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase, main
+from connection import Connection, ConnectionPool
+
+
+class DroppingHandler(BaseHTTPRequestHandler):
+    """ Answers as keep-alive, then silently drops the connection. """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('ok')
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class TestConnection(TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), DroppingHandler)
+        thread = Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/services/Soap/u/15.0' % \
+            self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def send(self, connection, safe=True):
+        return connection.send('POST', 'x', {'Content-Length': '1'}, safe).read()
+
+    def testHalfClosedSocketDetected(self):
+        connection = Connection(self.url)
+        self.assertEqual(self.send(connection), 'ok')
+        time.sleep(0.1)
+        self.assertTrue(connection.isStale())
+        self.assertEqual(self.send(connection), 'ok')
+        self.assertEqual(connection.reconnects, 1)
+
+    def testSafeCallRetried(self):
+        connection = Connection(self.url)
+        connection.isStale = lambda: False
+        self.send(connection)
+        time.sleep(0.1)
+        self.assertEqual(self.send(connection), 'ok')
+
+    def testUnsafeCallNotRetried(self):
+        connection = Connection(self.url)
+        connection.isStale = lambda: False
+        self.send(connection)
+        time.sleep(0.1)
+        try:
+            self.send(connection, safe=False)
+        except (HTTPException, IOError):
+            pass
+        # a write failing before the request went out is retried, the
+        # server drops that connection too: let the stale check see it.
+        del connection.isStale
+        time.sleep(0.1)
+        self.assertEqual(self.send(connection, safe=False), 'ok')
+
+    def testStreamedResponseReleasesConnection(self):
+        connection = Connection(self.url)
+        response = connection.send('POST', 'x', {'Content-Length': '1'},
+                                   stream=True)
+        self.assertTrue(connection.lock.locked())
+        self.assertEqual(response.read(1), 'o')
+        response.close()
+        self.assertFalse(connection.lock.locked())
+        self.assertEqual(self.send(connection), 'ok')
+
+    def testRecycleAfterMaxRequests(self):
+        connection = Connection(self.url, maxRequests=1)
+        connection.requests = 1
+        connection.connection.connect()
+        self.assertTrue(connection.isStale())
+
+
+    def testPoolStreamedResponse(self):
+        pool = ConnectionPool(self.url, maxConnections=2)
+        response = pool.send('POST', 'x', {'Content-Length': '1'},
+                             stream=True)
+        self.assertEqual(self.send(pool), 'ok')
+        self.assertEqual(pool.created, 2)
+        self.assertEqual(response.read(), 'ok')
+        response.close()
+        self.assertEqual(len(pool.idle), 2)
+        self.assertEqual(self.send(pool), 'ok')
+        self.assertEqual(pool.created, 2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from sys import path
+from os.path import abspath, dirname, join
+path.insert(0, abspath(join(dirname(__file__), '..')))
+import os
+from base64 import b64encode
+from StringIO import StringIO
+from unittest import TestCase, main
+from client import Client
+from download import BinaryDownloader
+from error import SessionExpired
+from support import ENVELOPE, FAULT, PageConnection, RenewingStore, Response
+
+
+RECORD = '''<records xsi:type="sf:sObject"><sf:type>Attachment</sf:type>
+<sf:Id>%s</sf:Id><sf:Id>%s</sf:Id><sf:Name>%s.bin</sf:Name>
+<sf:Owner xsi:type="sf:sObject"><sf:type>User</sf:type><sf:Id xsi:nil="true"/>
+<sf:Name>Jim</sf:Name></sf:Owner><sf:Body>%s</sf:Body></records>'''
+
+
+class Sink(object):
+    def __init__(self):
+        self.files = {}
+
+    def __call__(self, record, field):
+        target = self.files[record['Id']] = StringIO()
+        target.close = lambda: None
+        return target
+
+
+class TestDownload(TestCase):
+    def client(self):
+        client = Client()
+        client.sessionId = 'S1'
+        return client
+
+    def page(self, files, locator=None):
+        records = ''.join(RECORD % (name, name, name, b64encode(data))
+                          for name, data in files)
+        result = '''<queryResponse><result xsi:type="QueryResult">
+<done>%s</done><queryLocator%s</queryLocator>%s<size>3</size>
+</result></queryResponse>''' % (
+            'false' if locator else 'true',
+            '>%s' % locator if locator else ' xsi:nil="true">',
+            records
+        )
+        return Response(ENVELOPE % result, compressed=True)
+
+    def testDownload(self):
+        files = [('a', os.urandom(70000)), ('b', ''), ('c', os.urandom(5))]
+        client = self.client()
+        client.connection = PageConnection([
+            self.page(files[:2], '01gXXX-2'),
+            self.page(files[2:])
+        ])
+        sink = Sink()
+        records = list(BinaryDownloader(client, blockSize=100).download(
+            'SELECT Id, Name, Owner.Name, Body FROM Attachment', sink
+        ))
+        self.assertEqual([record['Id'] for record in records], ['a', 'b', 'c'])
+        self.assertEqual(records[0]['Body'], 70000)
+        self.assertFalse('Owner' in records[0])
+        for name, data in files:
+            self.assertEqual(sink.files[name].getvalue(), data)
+        self.assertTrue('01gXXX-2' in client.connection.bodies[1])
+
+    def testFault(self):
+        client = self.client()
+        client.connection = PageConnection([FAULT])
+        downloader = BinaryDownloader(client)
+        self.assertRaises(SessionExpired, list,
+                          downloader.download('SELECT Body FROM Document', None))
+
+    def testSessionRenewed(self):
+        client = self.client()
+        client.sessionStore = (RenewingStore(), 'jim', 'x')
+        client.connection = PageConnection([
+            FAULT, self.page([('a', 'data')], '01gXXX-2'),
+            FAULT, FAULT
+        ])
+        records = BinaryDownloader(client).download(
+            'SELECT Id, Body FROM Attachment', Sink()
+        )
+        self.assertRaises(SessionExpired, list, records)
+        bodies = client.connection.bodies
+        self.assertTrue('<sessionId>S1</' in bodies[0])
+        self.assertTrue('<sessionId>S2</' in bodies[1])
+        # queryMore goes on in the renewed session, renewed once per call.
+        self.assertTrue('<sessionId>S2</' in bodies[2])
+        self.assertTrue('<sessionId>S3</' in bodies[3])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+from sys import path
+from os.path import abspath, dirname, join
+path.insert(0, abspath(join(dirname(__file__), '..')))
+import re
+import threading
+from unittest import TestCase, main
+from lxml import objectify
+from extract import PartitionedExtractor, _recordId
+
+
+RESULT = '''<result xmlns:sf="urn:sobject.partner.soap.sforce.com">
+<done>true</done><queryLocator/>%s<size>%d</size></result>'''
+RECORD = '''<records><sf:type>Account</sf:type><sf:Id>%s</sf:Id>
+<sf:CreatedDate>%s</sf:CreatedDate></records>'''
+RECORDS = [('001000000000001', '2009-01-01T00:00:00.000Z'),
+           ('001000000000009', '2009-01-05T00:00:00.000Z'),
+           ('00100000000000Z', '2009-01-09T00:00:00.000Z')]
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.queries = []
+
+    def clone(self):
+        return self
+
+    def query(self, queryString, batchSize=500):
+        self.queries.append(queryString)
+        if 'ORDER BY' in queryString:
+            # ordered by Id and CreatedDate alike.
+            records = RECORDS
+        elif 'CreatedDate' in queryString:
+            # pretend every slice sees every record, duplicates must go.
+            records = RECORDS
+        else:
+            low = re.search(r"Id >= '(\w+)'", queryString)
+            high = re.search(r"Id < '(\w+)'", queryString)
+            records = [item for item in RECORDS
+                       if (not low or item[0] >= low.group(1))
+                       and (not high or item[0] < high.group(1))]
+        return [objectify.fromstring(
+            RESULT % (''.join(RECORD % item for item in records), len(records))
+        )]
+
+
+class PagingClient(FakeClient):
+    """ Serves pages of one record, forever unless limited. """
+    def __init__(self, pages=None):
+        FakeClient.__init__(self)
+        self.pages = pages
+        self.batchSizes = []
+        self.lock = threading.Lock()
+
+    def query(self, queryString, batchSize=500):
+        if 'ORDER BY' in queryString:
+            return FakeClient.query(self, queryString, batchSize)
+        return self.queryMore('01g-0', batchSize)
+
+    def queryMore(self, queryLocator, batchSize=500):
+        self.lock.acquire()
+        try:
+            self.batchSizes.append(batchSize)
+            count = len(self.batchSizes)
+        finally:
+            self.lock.release()
+        done = self.pages is not None and count >= self.pages
+        return [objectify.fromstring(RESULT.replace(
+            '<done>true</done><queryLocator/>',
+            '<done>%s</done><queryLocator>01g-%d</queryLocator>' % (
+                'true' if done else 'false', count
+            )
+        ) % (RECORD % RECORDS[0], 1))]
+
+
+class ScanClient(object):
+    """ Scans given Ids in pages of two records. """
+    def __init__(self, ids):
+        self.ids = ids
+        self.queries = []
+
+    def query(self, queryString, batchSize=500):
+        self.queries.append(queryString)
+        return self.queryMore('0', batchSize)
+
+    def queryMore(self, queryLocator, batchSize=500):
+        start = int(queryLocator)
+        done = start + 2 >= len(self.ids)
+        return [objectify.fromstring(RESULT.replace(
+            '<done>true</done><queryLocator/>',
+            '<done>%s</done><queryLocator>%d</queryLocator>' % (
+                'true' if done else 'false', start + 2
+            )
+        ) % (''.join(RECORD % (item, '2009-01-01T00:00:00.000Z')
+                     for item in self.ids[start:start + 2]), len(self.ids)))]
+
+
+class TestPartitionedExtractor(TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.extractor = PartitionedExtractor(self.client, workers=2)
+
+    def testPartition(self):
+        queries = self.extractor.partition(
+            "SELECT Id FROM Account WHERE Name != 'x'", 3
+        )
+        self.assertEqual(queries, [
+            "SELECT Id FROM Account WHERE (Name != 'x') "
+            "AND Id < '001000000000009'",
+            "SELECT Id FROM Account WHERE (Name != 'x') "
+            "AND Id >= '001000000000009' AND Id < '00100000000000Z'",
+            "SELECT Id FROM Account WHERE (Name != 'x') "
+            "AND Id >= '00100000000000Z'"
+        ])
+        self.assertRaises(ValueError, self.extractor.partition,
+                          'SELECT Id FROM Account LIMIT 5', 3)
+
+    def testExtractById(self):
+        records = list(self.extractor.extract('SELECT Id FROM Account', 3))
+        self.assertEqual(sorted(_recordId(record) for record in records),
+                         [item[0] for item in RECORDS])
+
+    def testExtractByDateDeduplicates(self):
+        records = list(self.extractor.extract(
+            'SELECT Id FROM Account', 3, by='CreatedDate'
+        ))
+        self.assertEqual(len(records), 3)
+
+
+    def testSampleAppliesConditions(self):
+        self.extractor.partition("SELECT Id, Name FROM Account "
+                                 "WHERE Name != 'x'", 3)
+        self.assertEqual(self.client.queries, [
+            "SELECT Id FROM Account WHERE Name != 'x' ORDER BY Id"
+        ])
+
+    def testSampleSkewedIds(self):
+        # most Ids crowd the low end, slices still get 3 records each.
+        ids = ['00100000000000%d' % index for index in xrange(8)] + \
+            ['001zzzzzzzzzzzz']
+        client = ScanClient(ids)
+        extractor = PartitionedExtractor(client)
+        self.assertEqual(extractor._sample('SELECT Id FROM Account', 'Id', 3),
+                         [ids[3], ids[6]])
+        self.assertEqual(client.queries, ['SELECT Id FROM Account ORDER BY Id'])
+
+    def testQueryMoreBatchSize(self):
+        client = PagingClient(pages=3)
+        extractor = PartitionedExtractor(client, workers=1, batchSize=200)
+        records = list(extractor.extract('SELECT Id FROM Account', 1))
+        self.assertEqual(len(records), 3)
+        self.assertEqual(client.batchSizes, [200] * 3)
+
+    def testEarlyStop(self):
+        before = threading.activeCount()
+        extractor = PartitionedExtractor(PagingClient(), workers=3, buffer=1)
+        records = extractor.extract('SELECT Id FROM Account', 3)
+        records.next()
+        records.close()
+        self.assertEqual(threading.activeCount(), before)
+
+
+if __name__ == '__main__':
+    main()
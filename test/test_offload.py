@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from sys import path
+from os.path import abspath, dirname, join
+path.insert(0, abspath(join(dirname(__file__), '..')))
+import re
+from unittest import TestCase, main
+from client import Client
+from error import SessionExpired
+from offload import ParserPool, parsePage, peek, records
+from request import Request
+from support import ENVELOPE, FAULT, PageConnection, RenewingStore, Response
+
+
+def page(ids, locator=None):
+    records = ''.join('''<records xsi:type="sf:sObject"><sf:type>Account</sf:type>
+<sf:Id>%s</sf:Id><sf:Id>%s</sf:Id><sf:Name>Name %s</sf:Name><sf:Site xsi:nil="true"/>
+<sf:Owner xsi:type="sf:sObject"><sf:Name>Jim</sf:Name></sf:Owner></records>''' % (
+        item, item, item) for item in ids)
+    return ENVELOPE % '''<queryResponse><result xsi:type="QueryResult">
+<done>%s</done><queryLocator%s</queryLocator>%s<size>4</size>
+</result></queryResponse>''' % (
+        'false' if locator else 'true',
+        '>%s' % locator if locator else ' xsi:nil="true">',
+        records
+    )
+
+
+def pagingClient(pages):
+    client = Client()
+    client.sessionId = 'S1'
+    client.connection = PageConnection(
+        [Response(data, compressed=True) for data in pages]
+    )
+    return client
+
+
+class TestOffload(TestCase):
+    def testPeek(self):
+        data = Request('query').compress(page(['001A'], '01gA-2000'))
+        self.assertEqual(peek(data, True), (False, '01gA-2000'))
+        self.assertEqual(peek(page(['001A']), False), (True, None))
+        self.assertEqual(peek(FAULT, False), None)
+
+    def testParsePage(self):
+        result = parsePage(page(['001A', '001B']), False)
+        self.assertEqual(list(records(result)), [
+            {'Id': '001A', 'Name': 'Name 001A', 'Site': None},
+            {'Id': '001B', 'Name': 'Name 001B', 'Site': None}
+        ])
+        self.assertRaises(SessionExpired, list,
+                          records(parsePage(FAULT, False)))
+
+    def testPages(self):
+        client = pagingClient([page(['001A', '001B'], '01gA-2'),
+                               page(['001C'])])
+        pool = ParserPool(2)
+        try:
+            ids = [record['Id'] for result in pool.pages(client, 'SELECT')
+                   for record in records(result.get())]
+        finally:
+            pool.close()
+        self.assertEqual(ids, ['001A', '001B', '001C'])
+
+    def testFault(self):
+        client = pagingClient([FAULT])
+        pool = ParserPool(1)
+        try:
+            self.assertRaises(SessionExpired, list,
+                              pool.pages(client, 'SELECT'))
+        finally:
+            pool.close()
+
+    def testSessionRenewed(self):
+        client = pagingClient([FAULT, page(['001A'], '01gA-2'), FAULT, FAULT])
+        client.sessionStore = (RenewingStore(), 'jim', 'x')
+        pool = ParserPool(1)
+        try:
+            pages = pool.pages(client, 'SELECT')
+            self.assertEqual([record['Id'] for record in
+                              records(pages.next().get())], ['001A'])
+            self.assertRaises(SessionExpired, pages.next)
+        finally:
+            pool.close()
+        bodies = client.connection.bodies
+        self.assertEqual(
+            [re.search(r'<sessionId>(\w+)</', body).group(1)
+             for body in bodies],
+            ['S1', 'S2', 'S2', 'S3']
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from sys import path
+from os.path import abspath, dirname, join
+path.insert(0, abspath(join(dirname(__file__), '..')))
+from unittest import TestCase, main
+from client import Client
+from error import SessionExpired
+from parsers import EtreeParser, ExpatParser, backends, objectify
+from request import Request
+from response import toDict
+from support import ENVELOPE, FAULT, PageConnection
+
+
+QUERY = ENVELOPE % '''<queryResponse><result xsi:type="QueryResult">
+<done>true</done><queryLocator xsi:nil="true"/>
+<records xsi:type="sf:sObject"><sf:type>Account</sf:type><sf:Id>001A</sf:Id>
+<sf:Id>001A</sf:Id><sf:Name>Acme</sf:Name><sf:Site xsi:nil="true"/>
+<sf:Owner xsi:type="sf:sObject"><sf:type>User</sf:type><sf:Id xsi:nil="true"/>
+<sf:Name>Jim</sf:Name></sf:Owner></records>
+<records xsi:type="sf:sObject"><sf:type>Account</sf:type><sf:Id xsi:nil="true"/>
+<sf:Id>001B</sf:Id><sf:Name>Zhan</sf:Name><sf:Site>HQ</sf:Site></records>
+<size>2</size></result></queryResponse>'''
+
+
+class TestParsers(TestCase):
+    def setUp(self):
+        self.request = Request('query')
+
+    def testSameRecords(self):
+        expected = [
+            {'Id': '001A', 'Name': 'Acme', 'Site': None},
+            {'Id': '001B', 'Name': 'Zhan', 'Site': 'HQ'}
+        ]
+        for backend in backends:
+            result = backend.parse(self.request, QUERY)
+            self.assertEqual(backend.text(result, 'done'), 'true')
+            self.assertEqual(backend.text(result, 'queryLocator'), None)
+            records = backend.children(result, 'records')
+            self.assertEqual([toDict(record) for record in records], expected)
+
+    def testFault(self):
+        for backend in backends:
+            self.assertRaises(SessionExpired, backend.parse,
+                              self.request, FAULT)
+
+    def testSelection(self):
+        client = Client()
+        client.connection = PageConnection([QUERY] * 3)
+        client.useParser(ExpatParser())
+        self.assertTrue(isinstance(client.query('SELECT')[0], dict))
+        with client.parsing(objectify):
+            self.assertFalse(isinstance(client.query('SELECT')[0], dict))
+        records = client.queryRecords('SELECT')
+        self.assertEqual([record['Id'] for record in records],
+                         ['001A', '001B'])
+
+
+if __name__ == '__main__':
+    main()
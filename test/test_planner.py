@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+from sys import path
+from os.path import abspath, dirname, join
+path.insert(0, abspath(join(dirname(__file__), '..')))
+from threading import Lock
+from unittest import TestCase, main
+from lxml import objectify
+from client import Client
+from planner import LoadPlanner
+
+
+REFERENCES = {
+    'Account': {'ParentId': ['Account'], 'PrimaryContact__c': ['Contact']},
+    'Contact': {'AccountId': ['Account']},
+    'Opportunity': {'AccountId': ['Account']},
+    'OpportunityContactRole': {'OpportunityId': ['Opportunity'],
+                               'ContactId': ['Contact']},
+    'Task': {'WhoId': ['Contact', 'Lead']}
+}
+
+RESULT = '''<result xmlns="urn:partner.soap.sforce.com"><id>%s</id>
+<success>%s</success></result>'''
+
+
+class PlanClient(Client):
+    """ Creates records with IDs of their type and position, checking that
+        references are to records created already.
+    """
+    lock = Lock()
+    calls = []
+    records = {}
+
+    def describeSObject(self, sObjectType):
+        fields = ''.join(
+            '<fields><name>%s</name><type>reference</type>%s</fields>' % (
+                name, ''.join('<referenceTo>%s</referenceTo>' % item
+                              for item in types)
+            ) for name, types in REFERENCES[sObjectType].items()
+        )
+        return objectify.fromstring(
+            '<result xmlns="urn:partner.soap.sforce.com"><fields><name>Name'
+            '</name><type>string</type></fields>%s</result>' % fields
+        )
+
+    def create(self, sObjects):
+        return self.write('create', sObjects)
+
+    def update(self, sObjects):
+        return self.write('update', sObjects)
+
+    def write(self, operation, sObjects):
+        results = []
+        self.lock.acquire()
+        try:
+            self.calls.append((operation, sObjects[0].recordType))
+            for sObject in sObjects:
+                fields = dict((child.tag.split('}')[-1], child.text)
+                              for child in sObject.xml)
+                for name in REFERENCES.get(fields['type'], ()):
+                    if name in fields:
+                        assert fields[name] in self.records, fields
+                if operation == 'create':
+                    recordId = '%s-%d' % (fields['type'], len(self.records))
+                    self.records[recordId] = fields
+                else:
+                    recordId = fields['Id']
+                    self.records[recordId].update(fields)
+                success = fields.get('Name') != 'Fail'
+                results.append(objectify.fromstring(
+                    RESULT % (recordId, 'true' if success else 'false')
+                ))
+        finally:
+            self.lock.release()
+        return results
+
+
+class TestLoadPlanner(TestCase):
+    def setUp(self):
+        del PlanClient.calls[:]
+        PlanClient.records.clear()
+        self.plan = LoadPlanner(PlanClient())
+
+    def testOrder(self):
+        plan = self.plan
+        acme = plan.add('Account', Name='Acme')
+        jims = plan.extend('Contact', [{'LastName': 'Zhan', 'AccountId': acme}
+                                       for i in xrange(3)])
+        deal = plan.add('Opportunity', Name='Deal', AccountId=acme)
+        plan.add('OpportunityContactRole', OpportunityId=deal,
+                 ContactId=jims[0])
+        plan.run()
+        order = [sObjectType for operation, sObjectType in PlanClient.calls]
+        self.assertEqual(order[0], 'Account')
+        self.assertEqual(order[-1], 'Opportunitycontactrole')
+        self.assertEqual(set(order[1:3]), set(['Contact', 'Opportunity']))
+        self.assertEqual(PlanClient.records[jims[2].id]['AccountId'], acme.id)
+
+    def testDeferred(self):
+        plan = self.plan
+        parent = plan.add('Account', Name='Parent')
+        child = plan.add('Account', Name='Child', ParentId=parent)
+        contact = plan.add('Contact', LastName='Zhan', AccountId=parent)
+        parent.fields['PrimaryContact__c'] = contact
+        plan.run()
+        self.assertEqual(PlanClient.calls[-1][0], 'update')
+        self.assertEqual(PlanClient.records[child.id]['ParentId'], parent.id)
+        self.assertEqual(PlanClient.records[parent.id]['PrimaryContact__c'],
+                         contact.id)
+
+    def testFailedParent(self):
+        acme = self.plan.add('Account', Name='Fail')
+        jim = self.plan.add('Contact', LastName='Zhan', AccountId=acme)
+        self.plan.run()
+        self.assertEqual((acme.id, jim.id), (None, None))
+        self.assertEqual(jim.error, 'Parent AccountId not created')
+
+    def testInvalidReference(self):
+        acme = self.plan.add('Account', Name='Acme')
+        self.plan.add('Task', WhoId=acme)
+        self.assertRaises(ValueError, self.plan.run)
+
+
+if __name__ == '__main__':
+    main()
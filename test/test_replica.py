@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+from sys import path
+from os.path import abspath, dirname, join
+path.insert(0, abspath(join(dirname(__file__), '..')))
+from datetime import datetime
+from unittest import TestCase, main
+from lxml import objectify
+from client import Client
+from replica import Replica
+from support import CannedConnection
+
+
+DESCRIBE = '''<result>
+<fields><name>Id</name><type>id</type></fields>
+<fields><name>Username</name><type>string</type></fields>
+<fields><name>IsActive</name><type>boolean</type></fields>
+<fields><name>Photo</name><type>base64</type></fields>
+</result>'''
+QUERY = '''<result xmlns:sf="urn:sobject.partner.soap.sforce.com">
+<done>true</done><queryLocator/>
+<records><sf:type>User</sf:type><sf:Id>005A</sf:Id><sf:Id>005A</sf:Id>
+<sf:Username>jim@xigital.com</sf:Username><sf:IsActive>true</sf:IsActive></records>
+<records><sf:type>User</sf:type><sf:Id>005B</sf:Id><sf:Id>005B</sf:Id>
+<sf:Username>bob@xigital.com</sf:Username><sf:IsActive>false</sf:IsActive></records>
+<size>2</size></result>'''
+
+RESPONSES = {
+    'describeSObject': '''<result>
+<fields><name>Id</name><type>id</type></fields>
+<fields><name>Username</name><type>string</type></fields>
+<fields><name>LastLoginDate</name><type>datetime</type></fields>
+<name>User</name></result>''',
+    'getServerTimestamp': '<result><timestamp>%(now)s</timestamp></result>',
+    'query': '''<result><done>true</done><queryLocator xsi:nil="true"/>
+<records xsi:type="sf:sObject"><sf:type>User</sf:type><sf:Id>005A</sf:Id>
+<sf:Id>005A</sf:Id><sf:Username>jim@xigital.com</sf:Username>
+<sf:LastLoginDate>2009-02-25T10:35:13.000Z</sf:LastLoginDate></records>
+<size>1</size></result>''',
+    'getUpdated': '''<result><ids>005B</ids>
+<latestDateCovered>%(now)s</latestDateCovered></result>''',
+    'getDeleted': '''<result><deletedRecords>
+<deletedDate>%(now)s</deletedDate><id>005A</id></deletedRecords>
+<earliestDateAvailable>2009-01-01T00:00:00.000Z</earliestDateAvailable>
+<latestDateCovered>%(now)s</latestDateCovered></result>''',
+    'retrieve': '''<result xsi:type="sf:sObject"><sf:type>User</sf:type>
+<sf:Id>005B</sf:Id><sf:Id>005B</sf:Id><sf:Username>bob@xigital.com</sf:Username>
+<sf:LastLoginDate xsi:nil="true"/></result>'''
+}
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.queries = []
+        self.replica = None
+
+    def getServerTimestamp(self):
+        return datetime.utcnow()
+
+    def describeSObject(self, sObjectType):
+        return objectify.fromstring(DESCRIBE)
+
+    def query(self, queryString):
+        self.queries.append(queryString)
+        return [objectify.fromstring(QUERY)]
+
+
+class TestReplica(TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.replica = Replica(self.client, ':memory:', {'User': ['Username']})
+
+    def testLoad(self):
+        self.replica.load('User')
+        self.assertEqual(
+            self.client.queries,
+            ['SELECT Id, Username, IsActive FROM User']
+        )
+        self.assertTrue(self.replica.isFresh('User'))
+        self.assertEqual(
+            self.replica.lookup('User', ['Id', 'IsActive'],
+                                {'Username': 'jim@xigital.com'}),
+            [{'Id': u'005A', 'IsActive': True}]
+        )
+
+    def testSupports(self):
+        self.assertFalse(self.replica.supports('User', ['Id'], {}))
+        self.replica.load('User')
+        self.assertTrue(self.replica.supports('User', ['Id'], {'IsActive': True}))
+        self.assertFalse(self.replica.supports('User', ['Photo'], {}))
+
+
+    def testLookupIgnoresCase(self):
+        self.replica.load('User')
+        self.assertEqual(
+            self.replica.lookup('User', ['Id'],
+                                {'Username': 'JIM@Xigital.com'}),
+            [{'Id': u'005A'}]
+        )
+        self.assertEqual(
+            self.replica.lookup('User', ['Id'], {'Id': '005a'}), []
+        )
+
+
+class TestReplicaClient(TestCase):
+    """ Replica of a real client, the connection stubbed. """
+    def setUp(self):
+        self.client = Client()
+        self.client.sessionId = 'S'
+        self.client.connection = self.connection = \
+            CannedConnection(RESPONSES, now='2009-03-01T00:00:00.000Z')
+        self.replica = Replica(self.client, ':memory:', {'User': ['Username']})
+
+    def testRefresh(self):
+        self.replica.refresh()
+        self.assertEqual(self.connection.calls, [
+            'describeSObject', 'getServerTimestamp', 'query',
+            'getServerTimestamp'
+        ])
+        self.connection.values['now'] = '2009-03-02T00:00:00.000Z'
+        self.connection.calls = []
+        self.replica.refresh()
+        self.assertEqual(self.connection.calls, [
+            'getServerTimestamp', 'getUpdated', 'getDeleted', 'retrieve'
+        ])
+        self.assertEqual(
+            self.replica.lookup('User', ['Id', 'Username'], {}),
+            [{'Id': u'005B', 'Username': u'bob@xigital.com'}]
+        )
+        self.assertEqual(self.replica.watermarks.get('User'),
+                         datetime(2009, 3, 2))
+
+    def testLookupDateTime(self):
+        self.replica.refresh()
+        self.assertEqual(
+            self.replica.lookup(
+                'User', ['Id'],
+                {'LastLoginDate': datetime(2009, 2, 25, 10, 35, 13)}
+            ),
+            [{'Id': u'005A'}]
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,295 @@
 # -*- coding: utf-8 -*-
 from sys import path
 from os.path import abspath, dirname, join
-path.insert(0, abspath(join(dirname(__file__), '..')))
\ No newline at end of file
+path.insert(0, abspath(join(dirname(__file__), '..')))
+import os
+import mmap
+import unittest
+from base64 import b64decode, b64encode
+from datetime import date
+from StringIO import StringIO
+from tempfile import mkstemp
+from lxml import etree
+from config import namespace
+from request import Base64File, EmailFileAttachment, MassEmailMessage, \
+     FieldTable, NULL, Request, SingleEmailMessage, SObject, TrackedSObject
+
+
+class RequestTest(unittest.TestCase):
+    def setUp(self):
+        self.request = Request('query')
+        self.request.debug = False
+        etree.SubElement(self.request.body, 'queryString').text = \
+            'SELECT Id FROM Account'
+
+
+    def testBuildLeavesHeaders(self):
+        headers = dict(self.request.headers)
+        payload = self.request.build()
+        self.assertEqual(self.request.headers, headers)
+        self.assertEqual(
+            dict(payload.headers)['Content-Length'],
+            str(len(payload.body))
+        )
+
+
+    def testBuildOnce(self):
+        self.assertTrue(self.request.build() is self.request.build())
+        self.assertEqual(repr(self.request), self.request.build().body)
+
+
+    def testCompress(self):
+        payload = self.request.build()
+        self.assertEqual(dict(payload.headers)['Content-Encoding'], 'gzip')
+        self.assertEqual(
+            self.request.decompress(payload.body),
+            etree.tostring(self.request.xml, xml_declaration=True,
+                           encoding=self.request.encoding)
+        )
+
+
+    def testBodyChangeResetsPayload(self):
+        payload = self.request.build()
+        etree.SubElement(self.request.body, 'queryString').text = 'x'
+        self.assertFalse(self.request.build() is payload)
+        self.assertTrue('<queryString>x</queryString>' in
+                        self.request.decompress(self.request.build().body))
+
+
+    def testReprLeavesPayload(self):
+        repr(self.request)
+        self.assertEqual(self.request.payload, None)
+        etree.SubElement(self.request.body, 'queryString').text = 'x'
+        self.assertTrue('<queryString>x</queryString>' in
+                        self.request.decompress(self.request.build().body))
+
+
+    def testSoapHeaderResetsPayload(self):
+        payload = self.request.build()
+        self.request.addSoapHeader(etree.Element('MruHeader'))
+        self.assertFalse(self.request.build() is payload)
+
+
+class Base64FileTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = mkstemp()
+        self.data = os.urandom(100000)
+        os.write(handle, self.data)
+        os.close(handle)
+        self.request = Request('create')
+        self.sObject = SObject('Attachment', Name='a.bin',
+                               Body=Base64File(self.path, chunkSize=1000))
+        self.request.body.append(self.sObject.xml)
+
+
+    def tearDown(self):
+        os.remove(self.path)
+
+
+    def body(self, xml):
+        root = etree.fromstring(xml)
+        return root.find('.//{%s}Body' % namespace.sobject).text
+
+
+    def testStreamed(self):
+        self.request.debug = True
+        payload = self.request.build()
+        self.assertFalse(isinstance(payload.body, str))
+        xml = ''.join(payload.body)
+        self.assertEqual(dict(payload.headers)['Content-Length'], str(len(xml)))
+        self.assertEqual(b64decode(self.body(xml)), self.data)
+        # can be sent again.
+        self.assertEqual(''.join(payload.body), xml)
+
+
+    def testStreamedCompressed(self):
+        self.request.debug = False
+        payload = self.request.build()
+        headers = dict(payload.headers)
+        self.assertEqual(headers['Transfer-Encoding'], 'chunked')
+        self.assertFalse('Content-Length' in headers)
+        xml = self.request.decompress(''.join(payload.body))
+        self.assertEqual(b64decode(self.body(xml)), self.data)
+
+
+    def testMemoryMapped(self):
+        source = open(self.path, 'rb')
+        region = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            value = Base64File(region, chunkSize=1000)
+            self.assertEqual(len(value), len(b64encode(self.data)))
+            self.assertEqual(''.join(value), b64encode(self.data))
+        finally:
+            region.close()
+            source.close()
+
+
+class EmailTest(unittest.TestCase):
+    def testSingleEmailMessage(self):
+        message = SingleEmailMessage(
+            toAddresses = ['a@x.com', 'b@x.com'],
+            fileAttachments = [EmailFileAttachment('a.txt', 'YQ==')],
+            subject = 'Hi'
+        ).xml
+        self.assertEqual(message.tag, 'messages')
+        self.assertEqual(
+            message.get('{%s}type' % namespace.xsi),
+            'SingleEmailMessage'
+        )
+        self.assertEqual(
+            [item.text for item in message.findall('toAddresses')],
+            ['a@x.com', 'b@x.com']
+        )
+        self.assertEqual(message.findtext('fileAttachments/fileName'), 'a.txt')
+        self.assertEqual(message.findtext('subject'), 'Hi')
+        # optional arguments left out are not sent.
+        self.assertEqual(message.find('templateId'), None)
+
+
+    def testMassEmailMessage(self):
+        message = MassEmailMessage(['003A', '003B'], templateId='00XA').xml
+        self.assertEqual(len(message.findall('targetObjectIds')), 2)
+        self.assertEqual(message.findtext('templateId'), '00XA')
+
+
+class TrackedSObjectTest(unittest.TestCase):
+    def setUp(self):
+        self.record = TrackedSObject.fromRecord(etree.fromstring(
+            '<records xmlns:sf="%s"><sf:type>Contact</sf:type>'
+            '<sf:Id>003A</sf:Id><sf:Title>CTO</sf:Title><sf:Fax>1</sf:Fax>'
+            '<sf:Phone>2</sf:Phone><sf:Age__c>42</sf:Age__c></records>'
+            % namespace.sobject
+        ))
+
+
+    def fields(self):
+        xml = self.record.xml
+        return [(child.tag.split('}')[-1], child.text) for child in xml]
+
+
+    def testUnchanged(self):
+        self.record['Age__c'] = 42
+        self.assertFalse(self.record.isDirty())
+        self.assertEqual(self.fields(), [('type', 'Contact'), ('Id', '003A')])
+
+
+    def testChanges(self):
+        self.record['Title'] = 'CEO'
+        self.record['Fax'] = None
+        del self.record['Phone']
+        self.assertTrue(self.record.isDirty())
+        self.assertEqual(self.fields(), [
+            ('type', 'Contact'), ('fieldsToNull', 'Fax'),
+            ('fieldsToNull', 'Phone'), ('Id', '003A'), ('Title', 'CEO')
+        ])
+        self.record.markSaved()
+        self.assertFalse(self.record.isDirty())
+
+
+    def testKeys(self):
+        record = TrackedSObject('Contact', keys=('Email__c',),
+                                Email__c='a@x.com', LastName='Zhan')
+        self.assertEqual(record.get('Email__c'), 'a@x.com')
+        xml = record.xml
+        self.assertEqual(
+            xml.findtext('{%s}Email__c' % namespace.sobject), 'a@x.com'
+        )
+        self.assertEqual(xml.find('{%s}LastName' % namespace.sobject), None)
+
+
+    def testUnicode(self):
+        record = TrackedSObject.fromRecord(etree.fromstring(
+            '<records xmlns:sf="%s"><sf:type>Contact</sf:type>'
+            '<sf:Id>003A</sf:Id><sf:LastName>Zo\xc3\xab</sf:LastName>'
+            '<sf:Title>CTO</sf:Title></records>' % namespace.sobject
+        ))
+        self.assertEqual(record.get('LastName'), u'Zo\xeb')
+        self.assertFalse(record.isDirty())
+        record['Title'] = u'Pr\xe9sident'
+        self.assertEqual(record.changes(),
+                         ({'Id': '003A', 'Title': u'Pr\xe9sident'}, []))
+        self.assertEqual(
+            record.xml.findtext('{%s}Title' % namespace.sobject),
+            u'Pr\xe9sident'
+        )
+        self.assertTrue('Pr&#233;sident' in repr(record))
+        record.markSaved()
+        self.assertFalse(record.isDirty())
+
+
+class CompactSObjectTest(unittest.TestCase):
+    def testRecord(self):
+        table = FieldTable('Contact', ['LastName'])
+        first = table.record(LastName='Zhan', Age__c=42)
+        second = table.record(LastName='Jim', Email='a@x.com', Fax=None)
+        self.assertEqual(table.fields, ['LastName', 'Age__c', 'Email', 'Fax'])
+        self.assertEqual(first.recordType, 'Contact')
+        self.assertEqual((first.get('Age__c'), first.get('Email')),
+                         ('42', None))
+        fields = [(child.tag.split('}')[-1], child.text)
+                  for child in second.xml]
+        self.assertEqual(fields, [('type', 'Contact'), ('LastName', 'Jim'),
+                                  ('Email', 'a@x.com')])
+        self.assertEqual(repr(second), repr(SObject('Contact')).replace(
+            '<sObjects><sobject:type xmlns:sobject="%s">Contact' %
+            namespace.sobject,
+            '<sObjects xmlns:sobject="%s"><sobject:type>Contact' %
+            namespace.sobject
+        ).replace('</sObjects>', '<sobject:LastName>Jim</sobject:LastName>'
+                  '<sobject:Email>a@x.com</sobject:Email></sObjects>'))
+
+
+    def fields(self, record):
+        return [(child.tag.split('}')[-1], child.text) for child in record.xml]
+
+
+    def testColumns(self):
+        table = FieldTable('Contact')
+        first, second = table.fromColumns({
+            'Birthdate': [date(2009, 2, 25), None],
+            'Age__c': [42, float('nan')],
+            'Active__c': [True, False],
+            'LastName': [u'Zh\xe4n', 'Jim']
+        })
+        self.assertEqual(self.fields(first), [
+            ('type', 'Contact'), ('Active__c', 'true'), ('Age__c', '42'),
+            ('Birthdate', '2009-02-25'), ('LastName', u'Zh\xe4n')
+        ])
+        self.assertEqual(self.fields(second), [
+            ('type', 'Contact'), ('fieldsToNull', 'Age__c'),
+            ('fieldsToNull', 'Birthdate'), ('Active__c', 'false'),
+            ('LastName', 'Jim')
+        ])
+        self.assertEqual(second.values[1], NULL)
+        self.assertEqual(second.get('Age__c', 'cleared'), 'cleared')
+        self.assertRaises(ValueError, table.fromColumns, [[1], [1, 2]],
+                          ['Age__c', 'LastName'])
+
+
+    def testRows(self):
+        table = FieldTable('Contact', ['Email'])
+        records = table.fromRows(('LastName', 'Age__c'),
+                                 [('Zhan', 42), ('Jim', 'unknown')])
+        self.assertEqual(self.fields(records[1]), [
+            ('type', 'Contact'), ('LastName', 'Jim'), ('Age__c', 'unknown')
+        ])
+        self.assertRaises(ValueError, table.fromRows, ('LastName',),
+                          [('Zhan', 42)])
+        self.assertEqual(table.fromRows(('LastName',), []), [])
+
+
+    def testCSV(self):
+        records = FieldTable('Contact').fromCSV(StringIO(
+            'LastName, Email\nZh\xc3\xa4n,\n\n"Jim, Jr",jim@xigital.com\n'
+        ))
+        self.assertEqual([self.fields(record) for record in records], [
+            [('type', 'Contact'), ('fieldsToNull', 'Email'),
+             ('LastName', u'Zh\xe4n')],
+            [('type', 'Contact'), ('LastName', 'Jim, Jr'),
+             ('Email', 'jim@xigital.com')]
+        ])
+        self.assertEqual(FieldTable('Contact').fromCSV(StringIO('')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,53 @@
 # -*- coding: utf-8 -*-
 from sys import path
 from os.path import abspath, dirname, join
-path.insert(0, abspath(join(dirname(__file__), '..')))
\ No newline at end of file
+path.insert(0, abspath(join(dirname(__file__), '..')))
+from unittest import TestCase, main
+from lxml import objectify
+from response import Error, Results
+
+
+RESPONSE = '''<createResponse xmlns="urn:partner.soap.sforce.com"
+ xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<result><id>001A</id><success>true</success></result>
+<result><errors><fields>Name</fields><fields>Site</fields>
+<message>Required fields are missing</message>
+<statusCode>REQUIRED_FIELD_MISSING</statusCode></errors>
+<id xsi:nil="true"/><success>false</success></result>
+<result><errors><message>Locked</message>
+<statusCode>UNABLE_TO_LOCK_ROW</statusCode></errors>
+<id xsi:nil="true"/><success>false</success></result>
+</createResponse>'''
+
+
+class TestResults(TestCase):
+    def setUp(self):
+        self.elements = objectify.fromstring(RESPONSE).getchildren()
+        self.results = Results(self.elements)
+
+    def testColumns(self):
+        self.assertEqual(len(self.results), 3)
+        self.assertEqual(self.results.ids, ['001A', None, None])
+        self.assertEqual(self.results.failed(), [1, 2])
+        self.assertEqual(self.results.succeeded(), ['001A'])
+        self.assertTrue(self.results[0].success)
+        self.assertFalse(self.results[-1].success)
+
+    def testErrors(self):
+        errors = self.results[1].errors
+        self.assertEqual(errors[0].statusCode, 'REQUIRED_FIELD_MISSING')
+        self.assertEqual(errors[0].fields, ['Name', 'Site'])
+        self.assertEqual(self.results[0].errors, [])
+        self.assertEqual(Error(self.elements[2].errors).fields, [])
+
+    def testExtend(self):
+        self.results.extend(Results(self.elements))
+        self.assertEqual(self.results.failed(), [1, 2, 4, 5])
+        self.assertEqual(self.results.errorCounts(), {
+            'REQUIRED_FIELD_MISSING': 2,
+            'UNABLE_TO_LOCK_ROW': 2
+        })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+from sys import path
+from os.path import abspath, dirname, join
+path.insert(0, abspath(join(dirname(__file__), '..')))
+import re
+import shutil
+import tempfile
+from multiprocessing import Process
+from unittest import TestCase, main
+from lxml import objectify
+from client import Client
+from request import AuthenticatedRequest
+from session import FileSessionStore
+from support import ENVELOPE, FAULT, Connection
+
+
+RESULT = ENVELOPE % '<queryResponse><result><size>0</size></result></queryResponse>'
+
+
+class LoggingClient(Client):
+    """ Logs in by appending to a log file, session IDs count logins. """
+    def __init__(self, log):
+        Client.__init__(self)
+        self.log = log
+
+    def openSession(self, username, password):
+        source = open(self.log, 'a+')
+        try:
+            source.write('%s\n' % username)
+            source.seek(0)
+            count = len(source.readlines())
+        finally:
+            source.close()
+        return objectify.fromstring(
+            '<result><serverUrl>http://127.0.0.1/services/Soap/u/15.0'
+            '</serverUrl><sessionId>S%d</sessionId></result>' % count
+        )
+
+    def useSession(self, loginResult):
+        connection = self.connection
+        Client.useSession(self, loginResult)
+        # stand-in connections survive session changes.
+        if isinstance(connection, SessionConnection):
+            self.connection = connection
+
+    def logins(self):
+        try:
+            return len(open(self.log).readlines())
+        except IOError:
+            return 0
+
+
+class SessionConnection(Connection):
+    """ Rejects session S1. """
+    def __init__(self):
+        Connection.__init__(self)
+        self.sessions = []
+
+    def answer(self, action, body):
+        session = re.search(r'<sessionId>([^<]*)</', body).group(1)
+        self.sessions.append(session)
+        return FAULT if session == 'S1' else RESULT
+
+
+def start(directory):
+    client = LoggingClient(join(directory, 'logins'))
+    FileSessionStore(join(directory, 'sessions')).login(client, 'jim', 'x')
+
+
+class TestFileSessionStore(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = FileSessionStore(join(self.directory, 'sessions'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def client(self):
+        return LoggingClient(join(self.directory, 'logins'))
+
+    def testColdStartReusesSession(self):
+        first = self.client()
+        first.useSessionStore(self.store, 'jim', 'x')
+        second = self.client()
+        second.useSessionStore(self.store, 'jim', 'x')
+        self.assertEqual(second.sessionId, 'S1')
+        self.assertEqual(second.loginResult.serverUrl,
+                         'http://127.0.0.1/services/Soap/u/15.0')
+        self.assertEqual(first.logins(), 1)
+
+    def testSingleLoginAcrossProcesses(self):
+        processes = [Process(target=start, args=(self.directory,))
+                     for i in xrange(8)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual(self.client().logins(), 1)
+        self.assertEqual(self.store.load('jim').sessionId, 'S1')
+
+    def testRenewOnce(self):
+        first, second = self.client(), self.client()
+        first.useSessionStore(self.store, 'jim', 'x')
+        second.useSessionStore(self.store, 'jim', 'x')
+        self.store.renew(first, 'jim', 'x', 'S1')
+        self.store.renew(second, 'jim', 'x', 'S1')
+        self.assertEqual((first.sessionId, second.sessionId), ('S2', 'S2'))
+        self.assertEqual(first.logins(), 2)
+
+    def testExpiredCallSentAgain(self):
+        client = self.client()
+        client.useSessionStore(self.store, 'jim', 'x')
+        client.connection = connection = SessionConnection()
+        request = AuthenticatedRequest(client.sessionId, 'query')
+        result = client.send(request)
+        self.assertEqual(result.size, 0)
+        self.assertEqual(connection.sessions, ['S1', 'S2'])
+        self.assertEqual(self.store.load('jim').sessionId, 'S2')
+
+
+if __name__ == '__main__':
+    main()
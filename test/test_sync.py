@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+from sys import path
+from os.path import abspath, dirname, join
+path.insert(0, abspath(join(dirname(__file__), '..')))
+import os
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase, main
+from lxml import objectify
+from client import Client
+from config import namespace
+from error import ReplicationExpired
+from sync import FileWatermarkStore, Sink, SyncEngine, WatermarkStore
+from support import CannedConnection
+
+
+UPDATED = '''<result><ids>001A</ids><ids>001B</ids>
+<latestDateCovered>%s</latestDateCovered></result>'''
+DELETED = '''<result><deletedRecords><deletedDate>%s</deletedDate><id>001C</id>
+</deletedRecords><earliestDateAvailable>%s</earliestDateAvailable>
+<latestDateCovered>%s</latestDateCovered></result>'''
+
+
+class FakeClient(object):
+    def __init__(self, now, earliest):
+        self.now = now
+        self.earliest = earliest
+        self.calls = []
+
+    def getServerTimestamp(self):
+        return self.now
+
+    def getUpdated(self, sObjectType, startDate, endDate):
+        self.calls.append(('getUpdated', startDate, endDate))
+        return [objectify.fromstring(UPDATED % endDate.isoformat())]
+
+    def getDeleted(self, sObjectType, startDate, endDate):
+        self.calls.append(('getDeleted', startDate, endDate))
+        return [objectify.fromstring(DELETED % (
+            endDate.isoformat(), self.earliest.isoformat(), endDate.isoformat()
+        ))]
+
+    def retrieve(self, fieldList, sObjectType, ids):
+        return [objectify.fromstring('<records><Id>%s</Id></records>' % item)
+                for item in ids]
+
+
+RESPONSES = {
+    'getServerTimestamp':
+        '<result><timestamp>2009-03-01T00:00:00.000Z</timestamp></result>',
+    'getUpdated': '''<result><ids>001A</ids><ids>001B</ids>
+<latestDateCovered>2009-03-01T00:00:00.000Z</latestDateCovered></result>''',
+    'getDeleted': '''<result><deletedRecords>
+<deletedDate>2009-02-20T00:00:00.000Z</deletedDate><id>001C</id>
+</deletedRecords>
+<earliestDateAvailable>2009-01-01T00:00:00.000Z</earliestDateAvailable>
+<latestDateCovered>2009-03-01T00:00:00.000Z</latestDateCovered></result>''',
+    'retrieve': '''<result><sf:type>Account</sf:type><sf:Id>001A</sf:Id>
+<sf:Id>001A</sf:Id></result><result><sf:type>Account</sf:type>
+<sf:Id>001B</sf:Id><sf:Id>001B</sf:Id></result>'''
+}
+
+
+class MemorySink(Sink):
+    def __init__(self):
+        self.upserted = []
+        self.deleted = []
+
+    def upsert(self, sObjectType, records):
+        self.upserted.extend(record.Id.text for record in records)
+
+    def delete(self, sObjectType, ids):
+        self.deleted.extend(ids)
+
+
+class IdSink(MemorySink):
+    """ Reads IDs of the records returned by a real client. """
+    def upsert(self, sObjectType, records):
+        self.upserted.extend(record.findtext('{%s}Id' % namespace.sobject)
+                             for record in records)
+
+
+class TestSync(TestCase):
+    def setUp(self):
+        self.now = datetime(2009, 3, 1)
+        self.client = FakeClient(self.now, datetime(2009, 1, 1))
+        self.store = WatermarkStore()
+        self.sink = MemorySink()
+        self.engine = SyncEngine(
+            self.client, self.store, self.sink, {'Account': ['Id']}
+        )
+
+    def testFirstSyncOnlyRecordsWatermark(self):
+        self.assertEqual(self.engine.sync('Account'), (0, 0))
+        self.assertEqual(self.store.get('Account'), self.now)
+        self.assertEqual(self.client.calls, [])
+
+    def testWindows(self):
+        self.store.set('Account', datetime(2009, 1, 15))
+        self.engine.sync('Account')
+        windows = [call[1:] for call in self.client.calls
+                   if call[0] == 'getUpdated']
+        self.assertEqual(windows, [
+            (datetime(2009, 1, 15), datetime(2009, 2, 14)),
+            (datetime(2009, 2, 14), datetime(2009, 3, 1)),
+        ])
+        self.assertEqual(self.sink.upserted, ['001A', '001B'] * 2)
+        self.assertEqual(self.sink.deleted, ['001C'] * 2)
+        self.assertEqual(self.store.get('Account'), self.now)
+
+    def testHydrateSharesClient(self):
+        ids = ['001%012d' % index for index in xrange(4500)]
+        # FakeClient has no clone(), batches go through the client.
+        self.assertEqual(self.engine.hydrate('Account', ids), 4500)
+        self.assertEqual(sorted(self.sink.upserted), ids)
+
+    def testExpired(self):
+        self.store.set('Account', datetime(2008, 12, 1))
+        self.assertRaises(ReplicationExpired, self.engine.sync, 'Account')
+
+    def testFileStore(self):
+        handle, name = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            FileWatermarkStore(name).set('Account', self.now)
+            self.assertEqual(FileWatermarkStore(name).get('Account'), self.now)
+        finally:
+            os.remove(name)
+
+
+class TestSyncClient(TestCase):
+    """ Sync through a real client, the connection stubbed. """
+    def setUp(self):
+        self.client = Client()
+        self.client.sessionId = 'S'
+        self.client.connection = self.connection = CannedConnection(RESPONSES)
+        self.store = WatermarkStore()
+        self.sink = IdSink()
+        self.engine = SyncEngine(
+            self.client, self.store, self.sink, {'Account': ['Id']}
+        )
+
+    def testSyncAll(self):
+        self.store.set('Account', datetime(2009, 2, 15))
+        self.assertEqual(self.engine.syncAll(), {'Account': (2, 1)})
+        self.assertEqual(self.connection.calls, [
+            'getServerTimestamp', 'getUpdated', 'getDeleted', 'retrieve'
+        ])
+        self.assertEqual(self.sink.upserted, ['001A', '001B'])
+        self.assertEqual(self.sink.deleted, ['001C'])
+        self.assertEqual(self.store.get('Account'), datetime(2009, 3, 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from sys import path
+from os.path import abspath, dirname, join
+path.insert(0, abspath(join(dirname(__file__), '..')))
+import re
+from unittest import TestCase, main
+from client import Client
+from soql import shape
+from tuning import QueryTuner
+from support import Connection, envelope
+
+
+RESULT = '''<result xsi:type="QueryResult">
+<done>%s</done><queryLocator>%s</queryLocator>%s<size>9999</size>
+</result>'''
+
+RECORD = '<records xsi:type="sf:sObject"><sf:type>Account</sf:type>' \
+    '<sf:Id>001A</sf:Id><sf:Description>%s</sf:Description></records>'
+
+
+class PagingConnection(Connection):
+    """ Answers pages of as many records as asked, of 1 KB each. """
+    def __init__(self):
+        Connection.__init__(self)
+        self.batchSizes = []
+
+    def answer(self, action, body):
+        batchSize = re.search(r'<batchSize>(\d+)</', body)
+        batchSize = int(batchSize.group(1)) if batchSize else 500
+        self.batchSizes.append(batchSize)
+        page = len(self.batchSizes)
+        return envelope(action, RESULT % (
+            'true' if page == 3 else 'false',
+            '01gD0000002HU6K-%d' % (page * batchSize),
+            (RECORD % ('x' * 1000)) * batchSize
+        ))
+
+
+class TestQueryTuner(TestCase):
+    def testShape(self):
+        self.assertEqual(
+            shape("SELECT Id,  Name FROM Account WHERE Name = 'a' LIMIT 5"),
+            'SELECT Id, Name FROM Account'
+        )
+        self.assertEqual(shape('SELECT Id FROM Account'),
+                         'SELECT Id FROM Account')
+
+    def testNarrowRowsGrow(self):
+        tuner = QueryTuner()
+        self.assertEqual(tuner.observe('narrow', 500, 500 * 100, 0.5), 2000)
+
+    def testWideRowsShrink(self):
+        tuner = QueryTuner(targetBytes=1000 * 1000)
+        self.assertEqual(tuner.observe('wide', 500, 500 * 4000, 1), 250)
+        self.assertEqual(tuner.batchSize('wide'), 250)
+        self.assertEqual(tuner.batchSize('other'), 500)
+
+    def testSlowRowsShrink(self):
+        tuner = QueryTuner(targetSeconds=5)
+        self.assertEqual(tuner.observe('slow', 1000, 1000, 10), 500)
+        # a small page is mostly round trip, its time is not counted.
+        self.assertEqual(tuner.observe('slow', 10, 10, 5), 500)
+
+    def testCursors(self):
+        tuner = QueryTuner(maxCursors=1)
+        tuner.observe('a', 500, 500, 1, '01gA-500')
+        self.assertEqual(tuner.shapeOf('01gA-1000'), 'a')
+        tuner.observe('b', 500, 500, 1, '01gB-500')
+        self.assertEqual(tuner.shapeOf('01gA-1000'), None)
+
+
+class TestTunedClient(TestCase):
+    def testQueryRecords(self):
+        client = Client()
+        client.connection = connection = PagingConnection()
+        client.useQueryTuner(QueryTuner(targetBytes=400 * 1024))
+        query = "SELECT Id, Description FROM Account WHERE Name = '%s'"
+        records = client.queryRecords(query % 'a')
+        self.assertEqual(connection.batchSizes[0], 500)
+        # ~1.1 KB per record.
+        self.assertTrue(300 < connection.batchSizes[1] < 400)
+        self.assertEqual(connection.batchSizes[2], connection.batchSizes[1])
+        self.assertEqual(len(records), sum(connection.batchSizes))
+        # same shape, other conditions.
+        client.query(query % 'b')
+        self.assertEqual(connection.batchSizes[3], connection.batchSizes[1])
+
+    def testUntuned(self):
+        client = Client()
+        client.connection = connection = PagingConnection()
+        client.query('SELECT Id FROM Account')
+        client.queryMore('01gD0000002HU6K-500')
+        self.assertEqual(connection.batchSizes, [500, 500])
+
+
+if __name__ == '__main__':
+    main()
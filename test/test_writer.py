@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from sys import path
+from os.path import abspath, dirname, join
+path.insert(0, abspath(join(dirname(__file__), '..')))
+import time
+from unittest import TestCase, main
+from request import SObject
+from writer import WriteBehind
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.calls = []
+
+    def clone(self):
+        return self
+
+    def update(self, sObjects):
+        self.calls.append(('update', len(sObjects)))
+        return ['result-%d' % index for index in xrange(len(sObjects))]
+
+    def upsert(self, externalIDFieldName, sObjects):
+        self.calls.append(('upsert', externalIDFieldName, len(sObjects)))
+        raise ValueError('boom')
+
+
+class TestWriteBehind(TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+
+    def testBatchSize(self):
+        writer = WriteBehind(self.client, batchSize=3, interval=None)
+        handles = [writer.update(SObject('Account', Id=str(i)))
+                   for i in xrange(7)]
+        self.assertEqual(self.client.calls, [('update', 3), ('update', 3)])
+        writer.close()
+        self.assertEqual(self.client.calls[-1], ('update', 1))
+        self.assertEqual(handles[4].result(), 'result-1')
+        self.assertRaises(ValueError, writer.update,
+                          SObject('Account', Id='8'))
+
+    def testContextManagerAndErrors(self):
+        with WriteBehind(self.client, interval=None) as writer:
+            handle = writer.upsert('External__c', SObject('Account', Name='a'))
+        self.assertEqual(self.client.calls, [('upsert', 'External__c', 1)])
+        self.assertRaises(ValueError, handle.result)
+
+    def testInterval(self):
+        writer = WriteBehind(self.client, interval=0.05)
+        handle = writer.update(SObject('Account', Id='1'))
+        self.assertEqual(handle.result(timeout=5), 'result-0')
+        writer.close()
+
+    def testByteBudget(self):
+        writer = WriteBehind(self.client, maxBytes=1, interval=None)
+        writer.update(SObject('Account', Id='1'))
+        writer.update(SObject('Account', Id='2'))
+        self.assertEqual(self.client.calls, [('update', 1)])
+        writer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2008, 2009 Xigital Solutions
+#
+# Written by Jim Zhan <jim@xigital.com>
+#
+# This file is part of SFDC-Python Salesforce python accessor.
+#
+""" Batch sizes tuned from what calls are measured to cost, see
+    Client.useQueryTuner() and bulk.BulkWriter.
+"""
+import time
+from threading import Condition, Lock
+from collections import OrderedDict
+
+
+__author__ = 'Jim Zhan'
+__email__ = 'jim@xigital.com'
+
+
+class QueryTuner(object):
+    """ QueryOptions batch size of query()/queryAll()/queryMore() by query
+        shape (see soql.shape()), adjusted after each page from the bytes
+        per record and the seconds per record measured, so that pages get
+        close to the targets: narrow rows go in large batches, wide ones
+        in small batches.
+
+        @param targetBytes: Size of a page (uncompressed), 0 for any.
+        @param targetSeconds: Time to fetch a page, 0 for any.
+        @param minimum: Smallest batch size, Salesforce's is 200.
+        @param maximum: Largest batch size, Salesforce's is 2,000.
+        @param initial: Batch size of shapes not measured yet.
+        @param smoothing: Weight of the latest page in the averages.
+        @param maxCursors: Query locators remembered, to tune queryMore().
+
+        @type targetBytes: integer
+        @type targetSeconds: integer/float
+        @type minimum: integer
+        @type maximum: integer
+        @type initial: integer
+        @type smoothing: float
+        @type maxCursors: integer
+    """
+    def __init__(self, targetBytes=4 * 1024 * 1024, targetSeconds=10,
+                 minimum=200, maximum=2000, initial=500, smoothing=0.5,
+                 maxCursors=1024):
+        self.targetBytes = targetBytes
+        self.targetSeconds = targetSeconds
+        self.minimum = minimum
+        self.maximum = maximum
+        self.initial = initial
+        self.smoothing = smoothing
+        self.maxCursors = maxCursors
+        self.lock = Lock()
+        # shape: [bytes per record, seconds per record, batch size]
+        self.shapes = {}
+        # server side cursor: shape, least recently used go first.
+        self.cursors = OrderedDict()
+
+
+    def batchSize(self, shape):
+        """ Batch size to query given shape with. """
+        self.lock.acquire()
+        try:
+            entry = self.shapes.get(shape)
+            return entry[2] if entry is not None else self.initial
+        finally:
+            self.lock.release()
+
+
+    def shapeOf(self, queryLocator):
+        """ Shape of the query a locator belongs to, None if unknown. """
+        self.lock.acquire()
+        try:
+            return self.cursors.get(_cursor(queryLocator))
+        finally:
+            self.lock.release()
+
+
+    def observe(self, shape, records, size, seconds, queryLocator=None):
+        """ Account for a page fetched.
+
+            @param shape: Shape of the query.
+            @param records: Number of records in the page.
+            @param size: Size of the response, in bytes.
+            @param seconds: Time the call took.
+            @param queryLocator: Locator of the next page, if any.
+
+            @type shape: string
+            @type records: integer
+            @type size: integer
+            @type seconds: float
+            @type queryLocator: string
+
+            @return: The new batch size of the shape.
+        """
+        self.lock.acquire()
+        try:
+            if queryLocator:
+                self.cursors.pop(_cursor(queryLocator), None)
+                self.cursors[_cursor(queryLocator)] = shape
+                while len(self.cursors) > self.maxCursors:
+                    self.cursors.popitem(last=False)
+            entry = self.shapes.get(shape)
+            if entry is None:
+                entry = self.shapes[shape] = [None, None, self.initial]
+            if not records:
+                return entry[2]
+            entry[0] = self._average(entry[0], float(size) / records)
+            # small pages are mostly round trip, which says nothing
+            # about the cost of a record.
+            if records >= self.minimum:
+                entry[1] = self._average(entry[1], float(seconds) / records)
+            limits = [self.maximum]
+            if self.targetBytes:
+                limits.append(self.targetBytes / entry[0])
+            if self.targetSeconds and entry[1]:
+                limits.append(self.targetSeconds / entry[1])
+            entry[2] = max(self.minimum, int(min(limits)))
+            return entry[2]
+        finally:
+            self.lock.release()
+
+
+    def _average(self, average, value):
+        if average is None:
+            return value
+        return average + self.smoothing * (value - average)
+
+
+class BatchController(object):
+    """ Batch size & concurrency of DML calls on one sObject type, grown
+        step by step while calls are fast and clean, halved as soon as
+        they run into lock contention or time out (additive increase,
+        multiplicative decrease).
+
+        @param batchSize: Initial batch size.
+        @param maximum: Largest batch size, 200 for DML calls.
+        @param minimum: Smallest batch size.
+        @param concurrency: Initial number of calls at the same time.
+        @param maxConcurrency: Largest number of calls at the same time.
+        @param targetSeconds: Calls slower than this do not grow batches.
+        @param step: Records added to batches after a clean call.
+
+        @type batchSize: integer
+        @type maximum: integer
+        @type minimum: integer
+        @type concurrency: integer
+        @type maxConcurrency: integer
+        @type targetSeconds: integer/float
+        @type step: integer
+    """
+    def __init__(self, batchSize=200, maximum=200, minimum=1, concurrency=2,
+                 maxConcurrency=8, targetSeconds=10, step=10):
+        self.batchSize = batchSize
+        self.maximum = maximum
+        self.minimum = minimum
+        self.concurrency = concurrency
+        self.maxConcurrency = maxConcurrency
+        self.targetSeconds = targetSeconds
+        self.step = step
+        self.condition = Condition()
+        self.running = 0
+        # clean calls since the last change of concurrency.
+        self.clean = 0
+        self.decreased = 0
+
+
+    def acquire(self):
+        """ Wait for a call slot, see release(). """
+        self.condition.acquire()
+        try:
+            while self.running >= self.concurrency:
+                self.condition.wait()
+            self.running += 1
+        finally:
+            self.condition.release()
+
+
+    def release(self):
+        self.condition.acquire()
+        try:
+            self.running -= 1
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+
+    def succeeded(self, seconds):
+        """ Account for a call without contention, which took seconds. """
+        self.condition.acquire()
+        try:
+            if seconds > self.targetSeconds:
+                return
+            if self.batchSize < self.maximum:
+                self.batchSize = min(self.maximum, self.batchSize + self.step)
+                return
+            # full batches go through, try one more call at a time.
+            self.clean += 1
+            if self.clean >= self.concurrency and \
+               self.concurrency < self.maxConcurrency:
+                self.concurrency += 1
+                self.clean = 0
+                self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+
+    def contended(self, started=None):
+        """ Account for a call running into locks or timing out.
+
+            @param started: When the call started, calls started before
+                the last decrease do not decrease again.
+
+            @type started: float
+        """
+        self.condition.acquire()
+        try:
+            if started is not None and started < self.decreased:
+                return
+            self.decreased = time.time()
+            self.batchSize = max(self.minimum, self.batchSize // 2)
+            self.concurrency = max(1, self.concurrency // 2)
+            self.clean = 0
+        finally:
+            self.condition.release()
+
+
+def _cursor(queryLocator):
+    """ Server side cursor of a query locator, e.g. 01gD0000002HU6KIAW
+        of 01gD0000002HU6KIAW-2000.
+    """
+    return queryLocator.rsplit('-', 1)[0]
+
+
+if __name__ == '__main__':
+    pass
@@ -32,24 +32,106 @@ def getName():
 
 def getTime(timestamp):
     """ Turn standard timestamp(2009-02-25T10:35:13.959Z)
-        into datetime.
+        into datetime. Kept for compatibility, see
+        codec.parseDateTime().
     """
-    from datetime import datetime
-    date, time = timestamp.split('T')
-    year, month, day = [int(item) for item in date.split('-')]
-    time = time.replace('Z', '').split(':')
-    hour, minute = int(time[0]), int(time[1])
-    second, microsecond = time[-1].split('.')
-    
-    return datetime(
-        year,
-        month,
-        day,
-        hour,
-        minute,
-        int(second),
-        int(microsecond)
-    )
+    from codec import parseDateTime
+    return parseDateTime(timestamp)
+
+
+def chunk(items, size):
+    """ Split a sequence into lists with maximum length of size. """
+    items = list(items)
+    return [items[i:i + size] for i in xrange(0, len(items), size)]
+
+
+def parallel(function, items, workers=4):
+    """ Call function with each item in a pool of threads.
+
+        @param function: Callable which takes one item.
+        @param items: Items to be processed.
+        @param workers: Maximum number of threads.
+
+        @type function: callable
+        @type items: iterable
+        @type workers: integer
+
+        @return: List of results, in the same order as items.
+
+        @raise Exception: The first exception raised by function, once
+            all running calls are finished.
+    """
+    from threading import Thread
+    from Queue import Queue, Empty
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    tasks = Queue()
+    for index, item in enumerate(items):
+        tasks.put((index, item))
+    results = [None] * len(items)
+    errors = []
+
+    def work():
+        while not errors:
+            try:
+                index, item = tasks.get_nowait()
+            except Empty:
+                return
+            try:
+                results[index] = function(item)
+            except Exception, e:
+                errors.append(e)
+
+    threads = [Thread(target=work) for i in xrange(min(workers, len(items)))]
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+class Future(object):
+    """ Result of a call which is going to be finished by another thread. """
+    def __init__(self):
+        from threading import Event
+        self.event = Event()
+        self.value = None
+        self.error = None
+
+
+    def set(self, value):
+        self.value = value
+        self.event.set()
+
+
+    def fail(self, error):
+        self.error = error
+        self.event.set()
+
+
+    def done(self):
+        return self.event.isSet()
+
+
+    def result(self, timeout=None):
+        """ Wait for the result.
+
+            @param timeout: Seconds to wait, wait forever if None.
+
+            @return: The result.
+
+            @raise Exception: The exception the call failed with.
+        """
+        if not self.event.wait(timeout) and not self.event.isSet():
+            raise RuntimeError('Timeout waiting for the result')
+        if self.error is not None:
+            raise self.error
+        return self.value
 
 
 class Record(object):
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2008, 2009 Xigital Solutions
+#
+# Written by Jim Zhan <jim@xigital.com>
+#
+# This file is part of SFDC-Python Salesforce python accessor.
+#
+""" Write-behind buffering of single-record DML calls.
+
+    Usage:
+        writer = WriteBehind(client)
+        handles = [writer.update(SObject('Account', Id=item, Rating='Hot'))
+                   for item in ids]
+        writer.close()
+        failed = [handle for handle in handles
+                  if handle.result().success.text != 'true']
+
+    Or as a context manager, which flushes on exit:
+        with WriteBehind(client) as writer:
+            writer.create(SObject('Contact', LastName='Zhan'))
+"""
+import time
+from threading import Event, Lock, Thread
+from response import Results
+from util import Future
+
+
+__author__ = 'Jim Zhan'
+__email__ = 'jim@xigital.com'
+
+
+# create()/update()/upsert()/delete() accept 200 records at most.
+DML_LIMIT = 200
+
+
+class _Buffer(object):
+    """ Records waiting for one (operation, sObject type) call. """
+    def __init__(self, key):
+        self.key = key
+        self.records = []
+        self.futures = []
+        self.bytes = 0
+        self.created = time.time()
+
+
+class WriteBehind(object):
+    """ Buffers single-record create/update/upsert/delete calls per
+        operation and sObject type, and sends them in batches once a
+        buffer reaches batchSize records, maxBytes of payload, or is
+        older than interval seconds. Each call returns a <util.Future>
+        resolved with the record's SaveResult/UpsertResult/DeleteResult
+        (or <response.Result>, see Client.useCompactResults()).
+
+        @param client: Logged in client.
+        @param batchSize: Records per call, 200 at most.
+        @param maxBytes: Payload size (serialized records) per call.
+        @param interval: Seconds a record may wait in a buffer, None
+            to flush by size (and flush()/close()) only.
+
+        @type client: <client.Client>
+        @type batchSize: integer
+        @type maxBytes: integer
+        @type interval: float
+    """
+    def __init__(self, client, batchSize=DML_LIMIT,
+                 maxBytes=5 * 1024 * 1024, interval=1.0):
+        self.client = client
+        self.batchSize = min(batchSize, DML_LIMIT)
+        self.maxBytes = maxBytes
+        self.interval = interval
+        self.lock = Lock()
+        self.buffers = {}
+        self.stopped = Event()
+        self.thread = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+    def create(self, sObject):
+        return self._write(('create', sObject.recordType), sObject)
+
+
+    def update(self, sObject):
+        return self._write(('update', sObject.recordType), sObject)
+
+
+    def upsert(self, externalIDFieldName, sObject):
+        return self._write(
+            ('upsert', sObject.recordType, externalIDFieldName),
+            sObject
+        )
+
+
+    def delete(self, recordId):
+        return self._write(('delete', None), recordId)
+
+
+    def _write(self, key, record):
+        if key[0] == 'delete':
+            size = len(record)
+        else:
+            size = len(repr(record)) + sum(
+                len(value) for value in getattr(record, 'files', ())
+            )
+        future = Future()
+        ready = []
+        self.lock.acquire()
+        try:
+            if self.stopped.isSet():
+                # nothing would ever flush it.
+                raise ValueError('Write to a closed WriteBehind')
+            buffer = self.buffers.get(key)
+            if buffer is not None and buffer.bytes + size > self.maxBytes:
+                ready.append(self.buffers.pop(key))
+                buffer = None
+            if buffer is None:
+                buffer = self.buffers[key] = _Buffer(key)
+            buffer.records.append(record)
+            buffer.futures.append(future)
+            buffer.bytes += size
+            if len(buffer.records) >= self.batchSize:
+                ready.append(self.buffers.pop(key))
+            if self.interval is not None and self.thread is None:
+                self.thread = Thread(target=self._run)
+                self.thread.setDaemon(True)
+                self.thread.start()
+        finally:
+            self.lock.release()
+        for buffer in ready:
+            self._send(buffer)
+        return future
+
+
+    def _send(self, buffer):
+        """ Send one buffer, route results back to its futures. """
+        operation = buffer.key[0]
+        args = list(buffer.key[2:]) + [buffer.records]
+        try:
+            results = getattr(self.client, operation)(*args)
+            if not isinstance(results, (tuple, list, Results)):
+                results = [results]
+            for future, result in zip(buffer.futures, results):
+                future.set(result)
+        except Exception, e:
+            for future in buffer.futures:
+                future.fail(e)
+
+
+    def _run(self):
+        while not self.stopped.isSet():
+            self.stopped.wait(self.interval / 2.0)
+            now = time.time()
+            self.lock.acquire()
+            try:
+                ready = [self.buffers.pop(key)
+                         for key, buffer in self.buffers.items()
+                         if now - buffer.created >= self.interval]
+            finally:
+                self.lock.release()
+            for buffer in ready:
+                self._send(buffer)
+
+
+    def flush(self):
+        """ Send all buffered records now. """
+        self.lock.acquire()
+        try:
+            ready = self.buffers.values()
+            self.buffers = {}
+        finally:
+            self.lock.release()
+        for buffer in ready:
+            self._send(buffer)
+
+
+    def close(self):
+        """ Flush buffered records and stop the background flusher,
+            writes are refused from now on.
+        """
+        self.lock.acquire()
+        try:
+            self.stopped.set()
+        finally:
+            self.lock.release()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+
+if __name__ == '__main__':
+    pass